@@ -0,0 +1,269 @@
+import time
+from collections import Counter, deque
+from datetime import timedelta
+from database import to_db_timestamp, utc_now
+from cache import metrics_cache
+from log_partitions import LogStore
+from rollups import ActivityRollups
+from instrumentation import instrumentation
+
+
+def today_range():
+    """[start, end) of the current UTC day as database timestamps"""
+    start = utc_now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return to_db_timestamp(start), to_db_timestamp(start + timedelta(days=1))
+
+
+class ActivityAggregator:
+    """Activity counts for the dashboard charts.
+
+    Counts are read from the activity rollup tables over the last
+    `window_days` whole days, so each query touches a few hundred rollup
+    rows whatever the size of the logs table. Results are shared through
+    the metrics cache until the logs table is written or the TTL expires;
+    with grace > 0 they may be reused for that many seconds after a write.
+    Queries go to the read replica when one is configured.
+    """
+    def __init__(self, db_manager, window_days=30, cache=metrics_cache, ttl=30.0, grace=0.0):
+        self.db = db_manager
+        self.window_days = window_days
+        self.cache = cache
+        self.ttl = ttl
+        self.grace = grace
+
+    def window_start(self):
+        return to_db_timestamp(utc_now() - timedelta(days=self.window_days))
+
+    def window_start_day(self):
+        return self.window_start()[:10]
+
+    def _query(self, name, sql, params=()):
+        def run():
+            # Imported on first use so the login page never loads pandas
+            import pandas as pd
+            with self.db.read_connection('logs') as conn:
+                return pd.read_sql(sql, conn, params=params)
+
+        return self._cached(name, run, params)
+
+    def _cached(self, name, run, params):
+        if self.cache is None or self.db.pending_replication('logs'):
+            return run()
+        # params[0] is the window start, which moves with the clock; key on
+        # window_days and the remaining parameters instead
+        return self.cache.get_or_compute(
+            self.db.cache_scope, (name, self.window_days, params[1:]), run,
+            depends_on=('logs',), ttl=self.ttl, grace=self.grace
+        )
+
+    def daily_action_counts(self):
+        """Columns: date, action, count"""
+        return self._query(
+            'daily_action_counts',
+            """
+            SELECT day AS date, action, SUM(count) AS count
+            FROM activity_daily_rollup
+            WHERE day >= ?
+            GROUP BY day, action
+            ORDER BY day
+            """,
+            (self.window_start_day(),)
+        )
+
+    def role_counts(self):
+        """Columns: role, count"""
+        return self._query(
+            'role_counts',
+            """
+            SELECT role, SUM(count) AS count
+            FROM activity_daily_rollup
+            WHERE day >= ?
+            GROUP BY role
+            ORDER BY count DESC
+            """,
+            (self.window_start_day(),)
+        )
+
+    def hourly_counts(self):
+        """Columns: hour (0-23), count"""
+        return self._query(
+            'hourly_counts',
+            """
+            SELECT hour, SUM(count) AS count
+            FROM activity_hourly_rollup
+            WHERE day >= ?
+            GROUP BY hour
+            ORDER BY hour
+            """,
+            (self.window_start_day(),)
+        )
+
+    def recent_activity(self, limit=100):
+        """Most recent log rows inside the window, including compacted months"""
+        start = self.window_start()
+
+        def run():
+            import pandas as pd
+            columns, rows = LogStore(self.db, read_replica=True).recent(limit, start=start)
+            return pd.DataFrame(rows, columns=columns)
+
+        return self._cached('recent_activity', run, (start, limit))
+
+
+class DashboardMetrics:
+    """Headline dashboard numbers, cached across sessions"""
+    def __init__(self, db_manager, cache=metrics_cache, ttl=30.0):
+        self.db = db_manager
+        self.cache = cache
+        self.ttl = ttl
+
+    def _cached(self, key, compute, depends_on):
+        # A session with writes the replica lacks reads the primary, uncached
+        if self.cache is None or self.db.pending_replication(*depends_on):
+            return compute()
+        return self.cache.get_or_compute(self.db.cache_scope, key, compute,
+                                         depends_on=depends_on, ttl=self.ttl)
+
+    def counts(self):
+        """dict with patients, users and today's log count"""
+        def compute():
+            with self.db.read_connection('patients', 'users', 'logs') as conn:
+                return {
+                    'patients': conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0],
+                    'users': conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+                    'today_logs': conn.execute(
+                        "SELECT COALESCE(SUM(count), 0) FROM activity_daily_rollup WHERE day = ?",
+                        (today_range()[0][:10],)
+                    ).fetchone()[0]
+                }
+
+        # Keyed by day so the "today" count rolls over at midnight
+        return self._cached(('counts', today_range()[0]), compute, ('patients', 'users', 'logs'))
+
+    def recent_logs(self, limit=5):
+        def compute():
+            import pandas as pd
+            columns, rows = LogStore(self.db, read_replica=True).recent(limit)
+            return pd.DataFrame(rows, columns=columns)
+
+        return self._cached(('recent_logs', limit), compute, ('logs',))
+
+
+class LiveActivity:
+    """Dashboard chart data for one session, kept current from a log_id watermark.
+
+    load() reads the rollup tables for the window and the audit chain head
+    (the newest log_id) in one read transaction, so the counts and the
+    watermark agree. Each poll() then fetches only entries after the
+    watermark and adds them to the in-memory counters and the recent
+    table: its cost grows with the number of new entries, not with the
+    log. Counters are kept per day, so the window slides by dropping
+    days; a full load() every resync_interval seconds picks up
+    corrections such as retention deletes.
+    """
+    def __init__(self, db_manager, window_days=30, recent_limit=100, max_rows_per_poll=5000,
+                 resync_interval=300.0):
+        self.db = db_manager
+        self.window_days = window_days
+        self.recent_limit = recent_limit
+        self.max_rows_per_poll = max_rows_per_poll
+        self.resync_interval = resync_interval
+        self.store = LogStore(db_manager, read_replica=True)
+        self.watermark = None
+        self.loaded_at = None
+        self.columns = None
+        self.daily = Counter()
+        self.hourly = Counter()
+        self.recent = deque(maxlen=recent_limit)
+        self.last_poll_rows = 0
+
+    def window_start(self):
+        return to_db_timestamp(utc_now() - timedelta(days=self.window_days))
+
+    def load(self):
+        start = self.window_start()
+        with self.db.read_connection('logs') as conn:
+            if self.db.db_type == 'sqlite' and not conn.in_transaction:
+                # One snapshot for the head and the rollups
+                conn.execute("BEGIN")
+            watermark = conn.execute("SELECT log_id FROM audit_chain_head WHERE id = 1").fetchone()[0]
+            daily = Counter({
+                (day, action, role): count for day, action, role, count in conn.execute(
+                    "SELECT day, action, role, count FROM activity_daily_rollup WHERE day >= ?", (start[:10],)
+                ).fetchall()
+            })
+            hourly = Counter({
+                (day, hour): count for day, hour, count in conn.execute(
+                    "SELECT day, hour, count FROM activity_hourly_rollup WHERE day >= ?", (start[:10],)
+                ).fetchall()
+            })
+            # Last, as it may end the transaction
+            columns, rows = self.store.recent(self.recent_limit, start=start)
+        key = columns.index('log_id')
+        self.columns = columns
+        self.daily, self.hourly = daily, hourly
+        self.recent = deque((row for row in rows if row[key] <= watermark), maxlen=self.recent_limit)
+        self.watermark = watermark
+        self.loaded_at = time.monotonic()
+
+    @instrumentation.timed('analytics.live_poll')
+    def poll(self):
+        """Merge entries written since the last poll; returns how many"""
+        if self.watermark is None or time.monotonic() - self.loaded_at > self.resync_interval:
+            self.load()
+            self.last_poll_rows = 0
+            return 0
+        chunks = self.store.iter_rows(after_id=self.watermark, chunk_size=self.max_rows_per_poll)
+        try:
+            columns, rows = next(chunks, (self.columns, []))
+        finally:
+            chunks.close()
+        if rows:
+            role, action, timestamp = (columns.index(c) for c in ('role', 'action', 'timestamp'))
+            daily, hourly = ActivityRollups.buckets((r[role], r[action], r[timestamp]) for r in rows)
+            self.daily.update(daily)
+            self.hourly.update(hourly)
+            # Newest first
+            self.recent.extendleft(rows)
+            self.watermark = rows[-1][columns.index('log_id')]
+        self.last_poll_rows = len(rows)
+        return len(rows)
+
+    def _window_day(self):
+        return self.window_start()[:10]
+
+    def daily_action_counts(self):
+        """Columns: date, action, count"""
+        import pandas as pd
+        start = self._window_day()
+        counts = Counter()
+        for (day, action, _), n in self.daily.items():
+            if day >= start:
+                counts[(day, action)] += n
+        return pd.DataFrame([(day, action, n) for (day, action), n in sorted(counts.items()) if n > 0],
+                            columns=['date', 'action', 'count'])
+
+    def role_counts(self):
+        """Columns: role, count"""
+        import pandas as pd
+        start = self._window_day()
+        counts = Counter()
+        for (day, _, role), n in self.daily.items():
+            if day >= start:
+                counts[role] += n
+        return pd.DataFrame([(role, n) for role, n in counts.most_common() if n > 0], columns=['role', 'count'])
+
+    def hourly_counts(self):
+        """Columns: hour, count"""
+        import pandas as pd
+        start = self._window_day()
+        counts = Counter()
+        for (day, hour), n in self.hourly.items():
+            if day >= start:
+                counts[hour] += n
+        return pd.DataFrame(sorted(counts.items()), columns=['hour', 'count'])
+
+    def recent_activity(self, limit=100):
+        """Newest entries first, as ActivityAggregator.recent_activity"""
+        import pandas as pd
+        return pd.DataFrame(list(self.recent)[:limit], columns=self.columns)
\ No newline at end of file
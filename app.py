@@ -1,332 +1,694 @@
-import streamlit as st
-import pandas as pd
-from datetime import datetime
-from database import DatabaseManager
-from auth import Authentication
-from encryption import DataProtection
-from visualization import ActivityVisualization
-from gdpr_compliance import GDPRCompliance
-
-
-
-# Page configuration
-st.set_page_config(
-    page_title="Hospital Management System",
-    page_icon="🏥",
-    layout="wide"
-)
-
-# Initialize classes
-db = DatabaseManager()
-auth = Authentication()
-encryption = DataProtection()
-
-def main():
-    if 'logged_in' not in st.session_state:
-        st.session_state.logged_in = False
-    
-    # Initialize GDPR compliance
-    gdpr = GDPRCompliance(db)
-
-    # Show consent banner for all users
-    gdpr.show_consent_banner()
-
-    if not st.session_state.logged_in:
-        auth.login_page()
-        return
-    
-    user = st.session_state.user
-    st.sidebar.title(f"Welcome, {user['username']}")
-    st.sidebar.write(f"Role: {user['role']}")
-    
-    # Navigation based on role
-    if user['role'] == 'admin':
-        menu = ["Dashboard", "Patient Management", "Audit Logs", "GDPR Management","System Info"]
-    elif user['role'] == 'doctor':
-        menu = ["Dashboard", "View Patients"]
-    else:  # receptionist
-        menu = ["Dashboard", "Add Patient", "Edit Patient"]
-    
-    choice = st.sidebar.selectbox("Navigation", menu)
-    
-    # Display appropriate page based on selection
-    if choice == "Dashboard":
-        show_dashboard(user)
-    elif choice == "Patient Management" and user['role'] == 'admin':
-        patient_management(user)
-    elif choice == "View Patients" and user['role'] in ['admin', 'doctor']:
-        view_patients(user)
-    elif choice == "Add Patient" and user['role'] in ['admin', 'receptionist']:
-        add_patient(user)
-    elif choice == "Edit Patient" and user['role'] in ['admin', 'receptionist']:
-        edit_patient(user)
-    elif choice == "Audit Logs" and user['role'] == 'admin':
-        audit_logs(user)
-    elif choice == "GDPR Management" and user['role'] == 'admin':
-        gdpr_management(user, gdpr)    
-    elif choice == "System Info":
-        system_info(user)
-    
-    # Logout button
-    if st.sidebar.button("Logout"):
-        db.log_activity(user['user_id'], user['role'], "logout", "User logged out")
-        st.session_state.logged_in = False
-        st.session_state.user = None
-        st.rerun()
-
-def show_dashboard(user):
-    st.title("Hospital Management Dashboard")
-    
-    # System statistics
-    conn = db.get_connection()
-    
-    # Get counts
-    patient_count = pd.read_sql("SELECT COUNT(*) FROM patients", conn).iloc[0,0]
-    user_count = pd.read_sql("SELECT COUNT(*) FROM users", conn).iloc[0,0]
-    today_logs = pd.read_sql(
-        "SELECT COUNT(*) FROM logs WHERE DATE(timestamp) = DATE('now')", 
-        conn
-    ).iloc[0,0]
-    
-    conn.close()
-    
-    # Display metrics
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric("Total Patients", patient_count)
-    with col2:
-        st.metric("System Users", user_count)
-    with col3:
-        st.metric("Today's Activities", today_logs)
-    
-    # Recent activities (last 5)
-    if user['role'] == 'admin':
-        st.subheader("Recent Activities")
-        conn = db.get_connection()
-        recent_logs = pd.read_sql(
-            "SELECT * FROM logs ORDER BY timestamp DESC LIMIT 5", 
-            conn
-        )
-        conn.close()
-        st.dataframe(recent_logs)
-
-     # REAL-TIME ACTIVITY GRAPHS (Admin only)
-    if user['role'] == 'admin':
-        st.subheader("Real-time Activity Analytics")
-        
-        viz = ActivityVisualization(db)
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            viz.plot_daily_activity()
-        
-        with col2:
-            viz.plot_role_activity()
-        
-        viz.plot_action_timeline()    
-
-def patient_management(user):
-    st.title("Patient Management")
-    
-    conn = db.get_connection()
-    
-    if st.button("Anonymize All Patient Data"):
-        patients = pd.read_sql("SELECT * FROM patients", conn)
-        for _, patient in patients.iterrows():
-            anonymized_name = encryption.anonymize_name(patient['name'], patient['patient_id'])
-            anonymized_contact = encryption.anonymize_contact(patient['contact'])
-            
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE patients SET anonymized_name = ?, anonymized_contact = ? WHERE patient_id = ?",
-                (anonymized_name, anonymized_contact, patient['patient_id'])
-            )
-        
-        conn.commit()
-        db.log_activity(user['user_id'], user['role'], "anonymization", "Anonymized all patient data")
-        st.success("All patient data anonymized!")
-    
-    # Show patient data based on role
-    if user['role'] == 'admin':
-        patients = pd.read_sql("SELECT * FROM patients", conn)
-        st.subheader("All Patient Data (Raw)")
-        st.dataframe(patients)
-    else:
-        patients = pd.read_sql(
-            "SELECT patient_id, anonymized_name, anonymized_contact, diagnosis, date_added FROM patients", 
-            conn
-        )
-        st.subheader("Anonymized Patient Data")
-        st.dataframe(patients)
-    
-    conn.close()
-
-def view_patients(user):
-    st.title("View Patients")
-    
-    conn = db.get_connection()
-    
-    # Doctors see only anonymized data
-    patients = pd.read_sql(
-        "SELECT patient_id, anonymized_name, anonymized_contact, diagnosis, date_added FROM patients", 
-        conn
-    )
-    
-    st.dataframe(patients)
-    db.log_activity(user['user_id'], user['role'], "view", "Viewed patient list")
-    
-    conn.close()
-
-def add_patient(user):
-    st.title("Add New Patient")
-    
-    with st.form("add_patient_form"):
-        name = st.text_input("Patient Name")
-        contact = st.text_input("Contact Information")
-        diagnosis = st.text_area("Diagnosis")
-        
-        submitted = st.form_submit_button("Add Patient")
-        
-        if submitted:
-            conn = db.get_connection()
-            cursor = conn.cursor()
-            
-            # Add patient
-            cursor.execute(
-                "INSERT INTO patients (name, contact, diagnosis) VALUES (?, ?, ?)",
-                (name, contact, diagnosis)
-            )
-            
-            patient_id = cursor.lastrowid
-            
-            # Apply anonymization
-            anonymized_name = encryption.anonymize_name(name, patient_id)
-            anonymized_contact = encryption.anonymize_contact(contact)
-            
-            cursor.execute(
-                "UPDATE patients SET anonymized_name = ?, anonymized_contact = ? WHERE patient_id = ?",
-                (anonymized_name, anonymized_contact, patient_id)
-            )
-            
-            conn.commit()
-            conn.close()
-            
-            db.log_activity(user['user_id'], user['role'], "add_patient", f"Added patient: {name}")
-            st.success("Patient added successfully!")
-
-def edit_patient(user):
-    st.title("Edit Patient")
-    
-    conn = db.get_connection()
-    patients = pd.read_sql("SELECT patient_id, name, contact, diagnosis FROM patients", conn)
-    conn.close()
-    
-    if not patients.empty:
-        patient_options = [f"{row['patient_id']}: {row['name']}" for _, row in patients.iterrows()]
-        selected_patient = st.selectbox("Select Patient to Edit", patient_options)
-        
-        if selected_patient:
-            patient_id = int(selected_patient.split(":")[0])
-            
-            conn = db.get_connection()
-            patient_data = pd.read_sql(
-                f"SELECT * FROM patients WHERE patient_id = {patient_id}", 
-                conn
-            ).iloc[0]
-            conn.close()
-            
-            with st.form("edit_patient_form"):
-                diagnosis = st.text_area("Diagnosis", value=patient_data['diagnosis'])
-                
-                submitted = st.form_submit_button("Update Patient")
-                
-                if submitted:
-                    conn = db.get_connection()
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        "UPDATE patients SET diagnosis = ? WHERE patient_id = ?",
-                        (diagnosis, patient_id)
-                    )
-                    conn.commit()
-                    conn.close()
-                    
-                    db.log_activity(user['user_id'], user['role'], "edit_patient", f"Updated patient ID: {patient_id}")
-                    st.success("Patient updated successfully!")
-
-def audit_logs(user):
-    st.title("Audit Logs")
-    
-    conn = db.get_connection()
-    logs = pd.read_sql("SELECT * FROM logs ORDER BY timestamp DESC", conn)
-    conn.close()
-    
-    st.dataframe(logs)
-    
-    # Export option
-    if st.button("Export Logs to CSV"):
-        csv = logs.to_csv(index=False)
-        st.download_button(
-            label="Download CSV",
-            data=csv,
-            file_name=f"audit_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
-        )
-def gdpr_management(user, gdpr):
-    st.title("GDPR Compliance Management")
-    gdpr.data_retention_management(user)
-    
-    # Add data export for right to access
-    st.subheader("Data Subject Rights")
-    
-    if st.button("Export All User Data (Right to Access)"):
-        conn = db.get_connection()
-        all_data = pd.read_sql("SELECT * FROM logs", conn)
-        conn.close()
-        
-        csv = all_data.to_csv(index=False)
-        st.download_button(
-            label="Download All Data as CSV",
-            data=csv,
-            file_name=f"gdpr_data_export_{datetime.now().strftime('%Y%m%d')}.csv",
-            mime="text/csv"
-        )        
-
-def system_info(user):
-    st.title("System Information")
-    
-    st.subheader("CIA Triad Implementation")
-    
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        st.info("**Confidentiality**")
-        st.write("✓ Data anonymization")
-        st.write("✓ Role-based access control")
-        st.write("✓ Encryption for sensitive data")
-    
-    with col2:
-        st.info("**Integrity**")
-        st.write("✓ Comprehensive activity logging")
-        st.write("✓ Data validation")
-        st.write("✓ Audit trails")
-    
-    with col3:
-        st.info("**Availability**")
-        st.write("✓ Error handling")
-        st.write("✓ Data backup/export")
-        st.write("✓ System monitoring")
-    
-    st.subheader("GDPR Compliance Features")
-    st.write("✓ Data minimization through anonymization")
-    st.write("✓ Access controls and authentication")
-    st.write("✓ Audit trails for accountability")
-    st.write("✓ Data export capability")
-    
-    # System uptime (simplified)
-    st.subheader("System Status")
-    st.write(f"Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    st.success("🟢 System Operational")
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+import time
+_script_started = time.perf_counter()
+
+import io
+import threading
+import streamlit as st
+from datetime import datetime, timedelta
+from database import DatabaseManager, DatabaseSession
+from audit_writer import AuditWriteError
+from auth import Authentication
+from encryption import DataProtection
+from analytics import DashboardMetrics
+from cache import metrics_cache
+from bulk_operations import BulkAnonymizer, EncryptionBackfill, BlindIndexBackfill, KeyRotation
+import patients
+from patients import PatientQueryService, ANONYMIZED_COLUMNS, ALL_COLUMNS
+from export import StreamingExporter, FORMATS, open_download, close_download
+from log_partitions import LogStore
+from log_search import LogSearch
+from patient_import import PatientImporter, ImportFileError
+from gdpr_compliance import GDPRCompliance
+from instrumentation import instrumentation
+
+
+
+# Page configuration
+st.set_page_config(
+    page_title="Hospital Management System",
+    page_icon="🏥",
+    layout="wide"
+)
+
+# pandas and plotly (via visualization) are imported inside the pages that
+# use them, so the login page and reruns of light pages never load them
+
+@st.cache_resource
+def get_services():
+    """Database, authentication and crypto objects shared by every session.
+
+    Built once per server process; later script runs reuse them. Display
+    reads go to a periodically refreshed copy of the database.
+    """
+    started = time.perf_counter()
+    db = DatabaseManager(replica_name='hospital_replica.db')
+    services = db, Authentication(db), DataProtection()
+    instrumentation.record('app.startup', time.perf_counter() - started)
+    return services
+
+# Initialize classes
+db, auth, encryption = get_services()
+
+def main():
+    if 'logged_in' not in st.session_state:
+        st.session_state.logged_in = False
+    # Lets this session read its own writes while the replica catches up
+    if 'db_session' not in st.session_state:
+        st.session_state.db_session = DatabaseSession()
+    db.bind_session(st.session_state.db_session)
+    
+    # Initialize GDPR compliance
+    gdpr = GDPRCompliance(db)
+
+    # Show consent banner for all users
+    gdpr.show_consent_banner()
+
+    if not st.session_state.logged_in:
+        auth.login_page()
+        return
+    
+    user = st.session_state.user
+    st.sidebar.title(f"Welcome, {user['username']}")
+    st.sidebar.write(f"Role: {user['role']}")
+    
+    # Navigation based on role
+    if user['role'] == 'admin':
+        menu = ["Dashboard", "Patient Management", "Audit Logs", "GDPR Management","System Info", "Performance"]
+    elif user['role'] == 'doctor':
+        menu = ["Dashboard", "View Patients"]
+    else:  # receptionist
+        menu = ["Dashboard", "Add Patient", "Edit Patient"]
+    
+    choice = st.sidebar.selectbox("Navigation", menu)
+    
+    # Display appropriate page based on selection
+    if choice == "Dashboard":
+        show_dashboard(user)
+    elif choice == "Patient Management" and user['role'] == 'admin':
+        patient_management(user)
+    elif choice == "View Patients" and user['role'] in ['admin', 'doctor']:
+        view_patients(user)
+    elif choice == "Add Patient" and user['role'] in ['admin', 'receptionist']:
+        add_patient(user)
+    elif choice == "Edit Patient" and user['role'] in ['admin', 'receptionist']:
+        edit_patient(user)
+    elif choice == "Audit Logs" and user['role'] == 'admin':
+        audit_logs(user)
+    elif choice == "GDPR Management" and user['role'] == 'admin':
+        gdpr_management(user, gdpr)    
+    elif choice == "System Info":
+        system_info(user)
+    elif choice == "Performance" and user['role'] == 'admin':
+        performance(user)
+    
+    # Logout button
+    if st.sidebar.button("Logout"):
+        db.log_activity(user['user_id'], user['role'], "logout", "User logged out")
+        st.session_state.logged_in = False
+        st.session_state.user = None
+        st.rerun()
+
+@instrumentation.page
+def show_dashboard(user):
+    st.title("Hospital Management Dashboard")
+    
+    # System statistics, shared between sessions through the metrics cache
+    metrics = DashboardMetrics(db)
+    counts = metrics.counts()
+    patient_count = counts['patients']
+    user_count = counts['users']
+    today_logs = counts['today_logs']
+    
+    # Display metrics
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Total Patients", patient_count)
+    with col2:
+        st.metric("System Users", user_count)
+    with col3:
+        st.metric("Today's Activities", today_logs)
+    
+    # Recent activities (last 5)
+    if user['role'] == 'admin':
+        st.subheader("Recent Activities")
+        recent_logs = metrics.recent_logs(5)
+        st.dataframe(recent_logs)
+
+     # REAL-TIME ACTIVITY GRAPHS (Admin only)
+    if user['role'] == 'admin':
+        st.subheader("Real-time Activity Analytics")
+        
+        window_days = st.selectbox("Analytics window (days)", [7, 30, 90, 365], index=1)
+        live = st.toggle("Live updates", key="activity_live")
+        from visualization import ActivityVisualization
+        viz = ActivityVisualization(db, window_days=window_days)
+        
+        if live:
+            # Refreshes on its own, fetching only entries newer than the last refresh
+            viz.show_live(interval=5)
+            return
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            viz.plot_daily_activity()
+        
+        with col2:
+            viz.plot_role_activity()
+        
+        viz.plot_action_timeline()    
+
+@instrumentation.page
+def patient_management(user):
+    st.title("Patient Management")
+    
+    if st.button("Anonymize All Patient Data"):
+        progress_bar = st.progress(0.0)
+        
+        def show_progress(report):
+            if report['max_id']:
+                progress_bar.progress(min(report['last_id'] / report['max_id'], 1.0))
+        
+        # Chunked and resumable: an interrupted run continues where it stopped
+        report = BulkAnonymizer(db, encryption).run(progress=show_progress)
+        progress_bar.progress(1.0)
+        db.log_activity(
+            user['user_id'], user['role'], "anonymization",
+            f"Anonymized all patient data ({report['updated']} of {report['processed']} rows updated)",
+            durable=True
+        )
+        st.success(
+            f"All patient data anonymized! {report['updated']} rows updated, "
+            f"{report['processed']} checked in {report['elapsed']:.1f}s"
+        )
+    
+    if st.button("Encrypt Unencrypted Patient Records"):
+        with st.spinner("Encrypting patient records..."):
+            report = EncryptionBackfill(db, encryption).run()
+        db.log_activity(
+            user['user_id'], user['role'], "encryption_backfill",
+            f"Encrypted {report['updated']} patient records ({report['failed']} failed)",
+            durable=True
+        )
+        st.success(f"Encrypted {report['updated']} records ({report['rows_per_sec']:.0f} rows/s)")
+        if report['failed']:
+            st.error(f"{report['failed']} records could not be encrypted")
+    
+    if st.button("Build Blind Indexes"):
+        with st.spinner("Indexing patient names and contacts..."):
+            report = BlindIndexBackfill(db, encryption).run()
+        db.log_activity(
+            user['user_id'], user['role'], "index_backfill",
+            f"Blind-indexed {report['updated']} of {report['processed']} patient records",
+            durable=True
+        )
+        st.success(f"Indexed {report['updated']} records ({report['rows_per_sec']:.0f} rows/s)")
+    
+    with st.expander("Import Patients (CSV / JSON)"):
+        import_patients(user)
+    
+    with st.expander("Encryption Keys"):
+        key_rotation(user)
+    
+    # Show patient data based on role
+    if user['role'] == 'admin':
+        st.subheader("All Patient Data (Raw)")
+        patient_browser("manage_patients", ALL_COLUMNS, exact_lookup=True)
+    else:
+        st.subheader("Anonymized Patient Data")
+        patient_browser("manage_patients", ANONYMIZED_COLUMNS)
+
+def key_rotation(user):
+    """Key ring status plus an online re-encryption job running in the background"""
+    job = KeyRotation(db, encryption)
+    st.write(f"Primary key: `{encryption.primary_key_id}` · "
+             f"{len(encryption.ring.keys) - 1} retired keys")
+    in_use = job.retired_keys_in_use()
+    if in_use:
+        st.write("Rows still on other keys: " + ", ".join(f"`{k}`: {n}" for k, n in in_use.items()))
+    
+    running = st.session_state.get('key_rotation')
+    if running and running['thread'].is_alive():
+        report = running['report']
+        st.info(f"Re-encrypting: {report.get('processed', 0)} rows done, "
+                f"{report.get('remaining', '?')} remaining ({report.get('rows_per_sec', 0):.0f} rows/s)")
+        if st.button("Refresh Status", key="key_rotation_refresh"):
+            st.rerun()
+        return
+    if running and running['report'].get('completed'):
+        report = running['report']
+        st.success(f"Re-encrypted {report['updated']} records in {report['elapsed']:.1f}s "
+                   f"({report['rows_per_sec']:.0f} rows/s, {report['failed']} failed)")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        rotate = st.button("Rotate Key")
+    with col2:
+        reencrypt = st.button("Re-encrypt Under Primary Key", disabled=not in_use)
+    with col3:
+        if st.button("Remove Retired Keys", disabled=bool(in_use) or len(encryption.ring.keys) < 2):
+            retired = [k for k in encryption.ring.keys if k != encryption.primary_key_id]
+            encryption.remove_retired_keys(retired)
+            db.log_activity(user['user_id'], user['role'], "key_removal",
+                            f"Removed retired encryption keys {', '.join(retired)}", durable=True)
+            st.rerun()
+    
+    if rotate:
+        new_key, _ = encryption.rotate_key()
+        db.log_activity(user['user_id'], user['role'], "key_rotation",
+                        f"New primary encryption key {new_key}", durable=True)
+    if rotate or reencrypt:
+        # Runs in small throttled chunks while the app keeps serving reads
+        state = {'report': {}}
+        
+        def work():
+            state['report'] = job.run(progress=lambda report: state.update(report=dict(report)))
+        
+        state['thread'] = threading.Thread(target=work, name="key-rotation", daemon=True)
+        state['thread'].start()
+        st.session_state.key_rotation = state
+        st.rerun()
+
+def import_patients(user):
+    """Bulk import from an uploaded file, with a downloadable reject file"""
+    st.caption("Columns: name, contact, diagnosis and optionally date_added (ISO format). "
+               "JSON may be an array of objects or one object per line.")
+    upload = st.file_uploader("Patient file", type=["csv", "json", "jsonl"], key="patient_import_file")
+    if upload is None or not st.button("Import", key="patient_import_button"):
+        return
+    
+    fmt = 'csv' if upload.name.lower().endswith('.csv') else 'json'
+    progress_text = st.empty()
+    
+    def show_progress(report):
+        progress_text.write(f"{report['read']} read, {report['imported']} imported, "
+                            f"{report['rejected']} rejected ({report['rows_per_sec']:.0f} rows/s)")
+    
+    rejects = io.StringIO()
+    try:
+        report = PatientImporter(db, encryption).import_file(
+            io.TextIOWrapper(upload, encoding='utf-8-sig', newline=''), fmt, user,
+            source=upload.name, reject_file=rejects, progress=show_progress
+        )
+    except ImportFileError as e:
+        # Raised for malformed JSON/CSV and for bytes that are not UTF-8
+        st.error(f"Import stopped, {upload.name} could not be read at {e}. "
+                 f"{e.report['imported']} records before that point were imported.")
+        report = e.report
+    else:
+        st.success(f"Imported {report['imported']} of {report['read']} records in "
+                   f"{report['elapsed']:.1f}s ({report['rows_per_sec']:.0f} rows/s)")
+    if report['rejected']:
+        st.warning(f"{report['rejected']} records were rejected")
+        st.download_button(
+            label="Download Rejected Rows",
+            data=rejects.getvalue(),
+            file_name=f"rejected_{upload.name}.csv",
+            mime="text/csv",
+            key="patient_import_rejects"
+        )
+
+@instrumentation.page
+def view_patients(user):
+    st.title("View Patients")
+    
+    # Doctors see only anonymized data
+    patient_browser("view_patients", ANONYMIZED_COLUMNS)
+    db.log_activity(user['user_id'], user['role'], "view", "Viewed patient list")
+
+def patient_browser(key, columns, exact_lookup=False):
+    """Filtered patient table paged by patient_id; the page cursor lives in session_state.
+
+    exact_lookup adds exact name/contact filters backed by the blind indexes.
+    """
+    service = PatientQueryService(db, encryption, read_replica=True)
+    
+    with st.expander("Filters"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            patient_id = st.text_input("Patient ID", key=f"{key}_patient_id")
+            diagnosis = st.text_input("Diagnosis contains", key=f"{key}_diagnosis")
+        with col2:
+            date_from = st.date_input("Added from", value=None, key=f"{key}_date_from")
+            date_to = st.date_input("Added to", value=None, key=f"{key}_date_to")
+        with col3:
+            page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1, key=f"{key}_page_size")
+        exact_name = exact_contact = ""
+        if exact_lookup:
+            col1, col2 = st.columns(2)
+            with col1:
+                exact_name = st.text_input("Exact name", key=f"{key}_exact_name")
+            with col2:
+                exact_contact = st.text_input("Exact contact", key=f"{key}_exact_contact")
+    
+    filters = {
+        'name': exact_name.strip(),
+        'contact': exact_contact.strip(),
+        'patient_id': int(patient_id) if patient_id.strip().isdigit() else None,
+        'diagnosis': diagnosis.strip(),
+        'date_from': date_from,
+        'date_to': date_to + timedelta(days=1) if date_to else None
+    }
+    
+    # Start again from the first page whenever the filters change
+    state_key = f"{key}_pages"
+    signature = (tuple(sorted((k, str(v)) for k, v in filters.items())), page_size)
+    if st.session_state.get(state_key, {}).get('signature') != signature:
+        st.session_state[state_key] = {'signature': signature, 'cursors': [None]}
+    state = st.session_state[state_key]
+    
+    page, next_after = service.page(filters, after_id=state['cursors'][-1], limit=page_size, columns=columns)
+    total, exact = service.estimate_count(filters)
+    
+    st.caption(f"Page {len(state['cursors'])} · {'' if exact else '~'}{total} matching patients")
+    st.dataframe(page)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Previous page", key=f"{key}_prev", disabled=len(state['cursors']) == 1):
+            state['cursors'].pop()
+            st.rerun()
+    with col2:
+        if st.button("Next page", key=f"{key}_next", disabled=next_after is None):
+            state['cursors'].append(next_after)
+            st.rerun()
+
+@instrumentation.page
+def add_patient(user):
+    st.title("Add New Patient")
+    
+    with st.form("add_patient_form"):
+        name = st.text_input("Patient Name")
+        contact = st.text_input("Contact Information")
+        diagnosis = st.text_area("Diagnosis")
+        
+        submitted = st.form_submit_button("Add Patient")
+        
+        if submitted:
+            # Anonymized columns and blind indexes are filled in with the row
+            patient_id = patients.add_patient(db, encryption, name, contact, diagnosis)
+            # The patient is referenced by ID only; no personal data in the log
+            db.log_activity(user['user_id'], user['role'], "add_patient", f"Added patient ID: {patient_id}",
+                            subject=('patient', patient_id))
+            st.success("Patient added successfully!")
+
+@instrumentation.page
+def edit_patient(user):
+    st.title("Edit Patient")
+    
+    # Indexed, LIMITed lookup instead of loading every patient into the selectbox
+    search = st.text_input("Search patient by name, contact or ID")
+    matches = PatientQueryService(db, encryption).search(search)
+    
+    if search and not matches:
+        st.info("No matching patients")
+    
+    if matches:
+        patient_options = [f"{patient_id}: {name}" for patient_id, name in matches]
+        selected_patient = st.selectbox("Select Patient to Edit", patient_options)
+        
+        if selected_patient:
+            patient_id = int(selected_patient.split(":")[0])
+            patient_data = PatientQueryService(db).get(patient_id)
+            
+            with st.form("edit_patient_form"):
+                diagnosis = st.text_area("Diagnosis", value=patient_data['diagnosis'])
+                
+                submitted = st.form_submit_button("Update Patient")
+                
+                if submitted:
+                    patients.update_diagnosis(db, patient_id, diagnosis)
+                    db.log_activity(user['user_id'], user['role'], "edit_patient", f"Updated patient ID: {patient_id}",
+                                    subject=('patient', patient_id))
+                    st.success("Patient updated successfully!")
+
+@instrumentation.page
+def audit_logs(user):
+    import pandas as pd
+    
+    st.title("Audit Logs")
+    
+    # Make sure entries still queued in the background writer are visible
+    try:
+        db.flush_logs(timeout=5)
+    except AuditWriteError as e:
+        st.warning(f"Some recent audit entries may be missing: {e}")
+    # Spans the hot table and any compacted months
+    columns, rows = LogStore(db, read_replica=True).recent(1000)
+    logs = pd.DataFrame(rows, columns=columns)
+    
+    st.caption("Showing the 1,000 most recent entries. Search or export for the full log.")
+    st.dataframe(logs)
+    
+    st.subheader("Search Logs")
+    search_logs(user)
+    
+    # Export option
+    st.subheader("Export Logs")
+    export_controls("audit_export", "audit_logs", "Export Logs")
+    
+    st.subheader("Integrity")
+    verify_audit_chain(user)
+
+def search_logs(user, page_size=50):
+    """Ranked full-text search over action and details, including compacted months"""
+    import pandas as pd
+    
+    text = st.text_input("Search for", placeholder="e.g. patient 4821", key="log_search_text")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        date_from = st.date_input("From", value=None, key="log_search_from")
+    with col2:
+        date_to = st.date_input("To", value=None, key="log_search_to")
+    with col3:
+        role = st.selectbox("Role", ["Any", "admin", "doctor", "receptionist"], key="log_search_role")
+    with col4:
+        with db.read_connection('users') as conn:
+            users = conn.execute("SELECT user_id, username FROM users ORDER BY username").fetchall()
+        user_filter = st.selectbox("User", [None] + users, key="log_search_user",
+                                   format_func=lambda u: "Any" if u is None else u[1])
+    
+    order = st.radio("Order", ["Best match", "Newest"], horizontal=True, key="log_search_order")
+    
+    criteria = (text, date_from, date_to, role, user_filter, order)
+    # A new search starts again from the first page; the page stack holds
+    # the keyset position each page starts after
+    if st.session_state.get('log_search_criteria') != criteria:
+        st.session_state.log_search_criteria = criteria
+        st.session_state.log_search_pages = [None]
+    if not text.strip():
+        return
+    
+    pages = st.session_state.log_search_pages
+    started = time.perf_counter()
+    columns, rows, next_after = LogSearch(db).search(
+        text,
+        start=date_from,
+        end=date_to + timedelta(days=1) if date_to else None,
+        role=None if role == "Any" else role,
+        user_id=user_filter[0] if user_filter else None,
+        limit=page_size,
+        after=pages[-1],
+        order='newest' if order == "Newest" else 'rank'
+    )
+    elapsed = time.perf_counter() - started
+    if len(pages) == 1:
+        # The search text can name patients, so it is not recorded
+        db.log_activity(user['user_id'], user['role'], "search_logs", "Searched audit log")
+    
+    if not rows:
+        st.info("No matching log entries")
+        return
+    first = (len(pages) - 1) * page_size + 1
+    st.caption(f"Results {first}-{first + len(rows) - 1}, newest first"
+               f"{'' if order == 'Newest' else ', best match first on each page'} ({elapsed * 1000:.0f} ms)")
+    st.dataframe(pd.DataFrame(rows, columns=columns).drop(columns=['rank']), hide_index=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(pages) > 1 and st.button("Previous", key="log_search_prev"):
+            pages.pop()
+            st.rerun()
+    with col2:
+        if next_after is not None and st.button("Next", key="log_search_next"):
+            pages.append(next_after)
+            st.rerun()
+
+def verify_audit_chain(user):
+    """Hash chain verification from the last signed checkpoint (or from genesis)"""
+    full = st.checkbox("Full verification (from the start of the chain)", key="audit_verify_full")
+    if st.button("Verify Audit Log Integrity"):
+        progress_text = st.empty()
+        report = db.audit_chain.verify(
+            full=full,
+            progress=lambda r: progress_text.write(f"{r['rows']} entries checked ({r['rows_per_sec']:.0f}/s)")
+        )
+        db.log_activity(
+            user['user_id'], user['role'], "verify_audit_log",
+            f"{'Full' if full else 'Incremental'} verification of {report['rows']} entries: "
+            f"{'ok' if report['ok'] else str(report['problem_count']) + ' problems'}",
+            durable=True
+        )
+        if report['ok']:
+            st.success(f"Audit log intact: {report['rows']} entries after log ID {report['from_log_id']} "
+                       f"verified in {report['elapsed']:.2f}s ({report['rows_per_sec']:.0f} entries/s)")
+        else:
+            st.error(f"Audit log integrity check failed: {report['problem_count']} problems")
+            st.dataframe(report['problems'])
+
+def export_controls(key, file_prefix, label):
+    """Filter inputs plus a streamed export of the logs table"""
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        date_from = st.date_input("From", value=None, key=f"{key}_from")
+    with col2:
+        date_to = st.date_input("To", value=None, key=f"{key}_to")
+    with col3:
+        user_filter = st.text_input("User ID", key=f"{key}_user")
+    with col4:
+        fmt = st.selectbox("Format", list(FORMATS), key=f"{key}_format")
+    
+    if st.button(label, key=f"{key}_button"):
+        stats = StreamingExporter(db).export(
+            fmt,
+            start=date_from,
+            end=date_to + timedelta(days=1) if date_to else None,
+            user_id=int(user_filter) if user_filter.strip().isdigit() else None
+        )
+        
+        # Only the newest export of each control is kept open for download
+        previous = st.session_state.pop(f"{key}_file", None)
+        if previous is not None:
+            close_download(previous)
+        handle = st.session_state[f"{key}_file"] = open_download(stats['path'])
+        
+        st.caption(
+            f"{stats['rows']} rows, {stats['bytes'] / 1024:.1f} KiB in {stats['elapsed']:.2f}s "
+            f"({stats['rows_per_sec']:.0f} rows/s, {stats['bytes_per_sec'] / 1024:.0f} KiB/s)"
+        )
+        st.download_button(
+            label="Download",
+            # Called on click, so the file is only read when it is downloaded
+            data=lambda: handle,
+            file_name=f"{file_prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{FORMATS[fmt][0]}",
+            mime=stats['mime'],
+            on_click="ignore",
+            key=f"{key}_download"
+        )
+
+@instrumentation.page
+def gdpr_management(user, gdpr):
+    st.title("GDPR Compliance Management")
+    gdpr.data_retention_management(user)
+    
+    # Right of access and right to erasure, per data subject
+    gdpr.data_subject_requests(user, encryption)
+
+@instrumentation.page
+def system_info(user):
+    st.title("System Information")
+    
+    st.subheader("CIA Triad Implementation")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        st.info("**Confidentiality**")
+        st.write("✓ Data anonymization")
+        st.write("✓ Role-based access control")
+        st.write("✓ Encryption for sensitive data")
+    
+    with col2:
+        st.info("**Integrity**")
+        st.write("✓ Comprehensive activity logging")
+        st.write("✓ Data validation")
+        st.write("✓ Audit trails")
+    
+    with col3:
+        st.info("**Availability**")
+        st.write("✓ Error handling")
+        st.write("✓ Data backup/export")
+        st.write("✓ System monitoring")
+    
+    st.subheader("GDPR Compliance Features")
+    st.write("✓ Data minimization through anonymization")
+    st.write("✓ Access controls and authentication")
+    st.write("✓ Audit trails for accountability")
+    st.write("✓ Data export capability")
+    
+    st.subheader("Dashboard Metrics Cache")
+    st.json(metrics_cache.stats())
+    
+    st.subheader("Login Latency")
+    st.json(auth.latency.summary())
+    
+    # System uptime (simplified)
+    st.subheader("System Status")
+    st.write(f"Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    st.success("🟢 System Operational")
+
+def performance(user):
+    import pandas as pd
+    
+    st.title("Performance")
+    
+    enabled = st.toggle("Record timings", value=instrumentation.enabled,
+                        help="Process-wide; adds a small cost to every query while on")
+    if enabled != instrumentation.enabled:
+        instrumentation.enabled = enabled
+        st.rerun()
+    
+    snapshot = instrumentation.snapshot()
+    if not snapshot['timings_ms']:
+        st.info("No timings recorded yet. Enable recording and use the app.")
+    
+    st.subheader("Page Renders")
+    pages = pd.DataFrame([
+        {
+            'page': name,
+            'renders': stats['renders'],
+            'p50_ms': snapshot['timings_ms'][f"page.{name}"]['p50'],
+            'p95_ms': snapshot['timings_ms'][f"page.{name}"]['p95'],
+            'max_ms': snapshot['timings_ms'][f"page.{name}"]['max'],
+            'queries_avg': stats['queries']['mean'],
+            'queries_max': stats['queries']['max'],
+            'rows_avg': stats['rows']['mean'],
+            'rows_max': stats['rows']['max']
+        }
+        for name, stats in snapshot['pages'].items()
+    ])
+    st.dataframe(pages, use_container_width=True)
+    
+    st.subheader("Operation Latency (ms)")
+    timings = pd.DataFrame([
+        {'operation': name, **{k: v for k, v in h.items() if k != 'buckets'}}
+        for name, h in snapshot['timings_ms'].items()
+    ])
+    st.dataframe(timings, use_container_width=True)
+    
+    st.subheader("Connection Pool")
+    st.json(db.pool_stats())
+    
+    st.subheader("Read Replica")
+    st.json(db.replica_stats())
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="Download Metrics Snapshot",
+            data=instrumentation.export_json(),
+            file_name=f"performance_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json"
+        )
+    with col2:
+        if st.button("Reset Metrics"):
+            instrumentation.reset()
+            st.rerun()
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        # Whole script run, from the first import to the end of the page
+        if instrumentation.enabled:
+            instrumentation.record('app.rerun', time.perf_counter() - _script_started)
\ No newline at end of file
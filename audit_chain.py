@@ -0,0 +1,376 @@
+import argparse
+import hashlib
+import hmac
+import json
+import operator
+import os
+import time
+
+from database import to_db_timestamp, utc_now
+from log_partitions import LogStore
+
+
+# row_hash the first chained entry links to
+GENESIS_HASH = '0' * 64
+# Columns covered by content_hash, in hashing order
+HASHED_COLUMNS = ('log_id', 'user_id', 'role', 'action', 'details', 'timestamp', 'subject_type', 'subject_id')
+MAX_PROBLEMS = 100
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+# Signing keys by path
+_keys = {}
+
+
+def load_chain_key(path):
+    """HMAC key for checkpoints and redactions, generated on first use"""
+    if path not in _keys:
+        try:
+            with open(path, 'rb') as key_file:
+                _keys[path] = key_file.read()
+        except FileNotFoundError:
+            key = os.urandom(32)
+            with open(path, 'wb') as key_file:
+                key_file.write(key)
+            _keys[path] = key
+    return _keys[path]
+
+
+def _number(value):
+    # INTEGER affinity turns numeric strings into integers on insert
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return value
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def content_hash(log_id, user_id, role, action, details, timestamp, subject_type, subject_id):
+    """SHA-256 of one entry's fields, normalized the way SQLite stores them"""
+    canonical = _encoder.encode([log_id, _number(user_id), _text(role), _text(action), _text(details),
+                                 _text(timestamp), _text(subject_type), _number(subject_id)])
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def link(prev_hash, entry_hash):
+    """row_hash of an entry: its content hash chained to the previous row_hash"""
+    return hashlib.sha256(f"{prev_hash}{entry_hash}".encode()).hexdigest()
+
+
+class AuditChain:
+    """Hash chain over the audit log.
+
+    Every entry carries content_hash (its own fields) and row_hash, which
+    chains content_hash to the previous entry's row_hash in log_id order.
+    write_log_batch seals each batch under the write lock and keeps a
+    signed copy of the chain head in audit_chain_head, together with the
+    id of the newest checkpoint.
+
+    audit_checkpoints holds HMAC-signed (log_id, row_hash) facts. A
+    'verified' checkpoint lets verify() rehash only later entries. A
+    'retention' anchor records the last entry of each deleted run, so the
+    chain still verifies across entries removed by retention. Checkpoints
+    are never deleted, so their ids run without gaps up to the one the
+    head records. Erasure changes an entry's fields but not its hashes.
+    Instead it records a signed redaction with the new content hash.
+
+    Entries written before the chain existed (log_id up to the 'genesis'
+    checkpoint) are not covered.
+    """
+    key_file = 'audit_chain.key'
+
+    def __init__(self, db_manager):
+        self.db = db_manager
+        self.key = load_chain_key(self.key_file)
+        self.store = LogStore(db_manager)
+
+    def sign(self, *parts):
+        message = "|".join('' if part is None else str(part) for part in parts)
+        return hmac.new(self.key, message.encode(), hashlib.sha256).hexdigest()
+
+    def _signed(self, signature, *parts):
+        return signature is not None and hmac.compare_digest(signature, self.sign(*parts))
+
+    def seal(self, conn, records):
+        """Assign log_ids and hashes to (user_id, role, action, details, timestamp,
+        subject_type, subject_id) records; returns rows for insertion.
+
+        Must run inside the write transaction that inserts them, so no other
+        writer can move the chain head in between.
+        """
+        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'logs'").fetchone()
+        next_id = (seq[0] if seq else 0) + 1
+        prev_hash, checkpoint_id = conn.execute(
+            "SELECT row_hash, checkpoint_id FROM audit_chain_head WHERE id = 1"
+        ).fetchone()
+        rows = []
+        for log_id, record in enumerate(records, next_id):
+            entry_hash = content_hash(log_id, *record)
+            prev_hash = link(prev_hash, entry_hash)
+            rows.append((log_id,) + tuple(record) + (entry_hash, prev_hash))
+        if rows:
+            self.set_head(conn, rows[-1][0], prev_hash, checkpoint_id)
+        return rows
+
+    def set_head(self, conn, log_id, row_hash, checkpoint_id):
+        """Move the signed chain head in the caller's transaction"""
+        conn.execute(
+            "UPDATE audit_chain_head SET log_id = ?, row_hash = ?, checkpoint_id = ?, signature = ?, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = 1",
+            (log_id, row_hash, checkpoint_id, self.sign('head', log_id, row_hash, checkpoint_id))
+        )
+
+    def checkpoint(self, conn, kind, log_id, row_hash, rows=0, record_in_head=True):
+        """Record a signed checkpoint in the caller's transaction; returns its id"""
+        created_at = to_db_timestamp(utc_now())
+        cursor = conn.execute(
+            "INSERT INTO audit_checkpoints (kind, log_id, row_hash, rows, created_at, signature) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, log_id, row_hash, rows, created_at,
+             self.sign('checkpoint', kind, log_id, row_hash, rows, created_at))
+        )
+        if record_in_head:
+            head_id, head_hash = conn.execute(
+                "SELECT log_id, row_hash FROM audit_chain_head WHERE id = 1"
+            ).fetchone()
+            self.set_head(conn, head_id, head_hash, cursor.lastrowid)
+        return cursor.lastrowid
+
+    def anchor_deleted(self, conn, columns, rows):
+        """Anchor the chain across log rows deleted in the caller's transaction"""
+        key, row_hash = columns.index('log_id'), columns.index('row_hash')
+        deleted = {row[key] for row in rows}
+        # The last row of every deleted run links to the next surviving row.
+        # Anchors this deletion makes redundant are kept, so the checkpoint
+        # sequence stays gapless
+        for row in rows:
+            if row[row_hash] is not None and row[key] + 1 not in deleted:
+                self.checkpoint(conn, 'retention', row[key], row[row_hash])
+        conn.executemany("DELETE FROM audit_redactions WHERE log_id = ?", [(log_id,) for log_id in deleted])
+
+    def redact(self, conn, columns, rows):
+        """Record signed redactions for rows whose fields were rewritten by erasure.
+
+        rows hold the new field values with the original content_hash.
+        """
+        index = [columns.index(c) for c in HASHED_COLUMNS]
+        key, original = columns.index('log_id'), columns.index('content_hash')
+        redactions = []
+        for row in rows:
+            if row[original] is None:
+                continue
+            after = content_hash(*(row[i] for i in index))
+            redactions.append((row[key], after, self.sign('redaction', row[key], row[original], after)))
+        conn.executemany(
+            "INSERT OR REPLACE INTO audit_redactions (log_id, content_hash, signature, redacted_at) "
+            "VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+            redactions
+        )
+
+    def _checkpoints(self, conn, kinds):
+        cursor = conn.execute(
+            f"SELECT checkpoint_id, kind, log_id, row_hash, rows, created_at, signature FROM audit_checkpoints "
+            f"WHERE kind IN ({', '.join('?' * len(kinds))}) ORDER BY log_id DESC, checkpoint_id DESC",
+            kinds
+        )
+        return cursor.fetchall()
+
+    def _valid(self, checkpoint):
+        _, kind, log_id, row_hash, rows, created_at, signature = checkpoint
+        return self._signed(signature, 'checkpoint', kind, log_id, row_hash, rows, created_at)
+
+    def _anchor(self, conn, log_id):
+        """Signed row_hash of a log_id that is no longer stored, or None"""
+        for checkpoint in conn.execute(
+            "SELECT checkpoint_id, kind, log_id, row_hash, rows, created_at, signature "
+            "FROM audit_checkpoints WHERE log_id = ?", (log_id,)
+        ).fetchall():
+            if self._valid(checkpoint):
+                return checkpoint[3]
+        return None
+
+    def _start(self, conn, full, problem):
+        """(log_id, row_hash) verification starts after"""
+        kinds = ('genesis',) if full else ('genesis', 'verified')
+        for checkpoint in self._checkpoints(conn, kinds):
+            if self._valid(checkpoint):
+                return checkpoint[2], checkpoint[3]
+            problem(checkpoint[2], f"checkpoint {checkpoint[0]} has an invalid signature")
+        raise RuntimeError("No valid genesis checkpoint; the audit chain cannot be verified")
+
+    def _check_head(self, conn, head, problem):
+        """Report a head behind the newest checkpoint, or checkpoints missing up to the one it records"""
+        head_id, _, head_checkpoint, _ = head
+        newest = conn.execute(
+            "SELECT checkpoint_id, kind, log_id, row_hash, rows, created_at, signature FROM audit_checkpoints "
+            "WHERE log_id > ? ORDER BY log_id DESC, checkpoint_id DESC", (head_id,)
+        ).fetchall()
+        for checkpoint in newest:
+            if self._valid(checkpoint):
+                problem(head_id, f"chain head is behind checkpoint {checkpoint[0]} at entry {checkpoint[2]}; "
+                                 f"entries were truncated")
+                break
+
+        # Sealing and checkpointing move the head in the same transaction
+        # as the AUTOINCREMENT counters, so the counters never run ahead of it
+        sequences = dict(conn.execute(
+            "SELECT name, seq FROM sqlite_sequence WHERE name IN ('logs', 'audit_checkpoints')"
+        ).fetchall())
+        if sequences.get('logs', 0) > head_id:
+            problem(head_id, f"entries up to {sequences['logs']} were written after the chain head")
+        if sequences.get('audit_checkpoints', 0) > head_checkpoint:
+            problem(head_id, f"checkpoints up to {sequences['audit_checkpoints']} were written "
+                             f"after the one the chain head records")
+
+        expected = 1
+        for (checkpoint_id,) in conn.execute("SELECT checkpoint_id FROM audit_checkpoints ORDER BY checkpoint_id"):
+            if checkpoint_id > head_checkpoint:
+                problem(head_id, f"checkpoint {checkpoint_id} is newer than the chain head records")
+                break
+            if checkpoint_id != expected:
+                problem(head_id, f"checkpoints {expected} to {checkpoint_id - 1} are missing")
+            expected = checkpoint_id + 1
+        if expected <= head_checkpoint:
+            problem(head_id, f"checkpoints {expected} to {head_checkpoint} are missing")
+
+    def verify(self, full=False, checkpoint=True, progress=None, chunk_size=20000):
+        """Rehash the chain from the newest valid checkpoint (or from genesis
+        with full=True) to the head; returns a report.
+
+        On success a new 'verified' checkpoint is written at the head, so
+        the next run only covers entries added since.
+        """
+        started = time.perf_counter()
+        self.db.flush_logs()
+        report = {
+            'ok': True,
+            'full': full,
+            'from_log_id': None,
+            'to_log_id': None,
+            'rows': 0,
+            'redactions': 0,
+            'anchors': 0,
+            'problems': [],
+            'problem_count': 0,
+            'checkpoint_id': None,
+            'head_log_id': None,
+            'head_checkpoint_id': None,
+            'elapsed': 0.0,
+            'rows_per_sec': 0.0
+        }
+
+        def problem(log_id, message):
+            report['ok'] = False
+            report['problem_count'] += 1
+            if len(report['problems']) < MAX_PROBLEMS:
+                report['problems'].append({'log_id': log_id, 'problem': message})
+
+        with self.db.connection() as conn:
+            # One read transaction, so the head, the counters and the
+            # checkpoints are all seen as of the same moment
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            prev_id, prev_hash = self._start(conn, full, problem)
+            head = conn.execute(
+                "SELECT log_id, row_hash, checkpoint_id, signature FROM audit_chain_head WHERE id = 1"
+            ).fetchone()
+            head_signed = self._signed(head[3], 'head', head[0], head[1], head[2])
+            if head_signed:
+                # A replayed older head, or truncated checkpoints, show up here
+                self._check_head(conn, head, problem)
+        report['from_log_id'] = prev_id
+        report['head_log_id'], report['head_checkpoint_id'] = head[0], head[2]
+
+        # The checkpointed entry itself must still carry the hash it was verified with
+        found = self.store.row(prev_id)
+        if found is not None:
+            columns, row = found
+            if row[columns.index('row_hash')] not in (None, prev_hash):
+                problem(prev_id, "entry no longer matches its checkpoint")
+
+        for columns, rows in self.store.iter_rows(after_id=prev_id, chunk_size=chunk_size):
+            key, row_hash, entry_hash = (columns.index(c) for c in ('log_id', 'row_hash', 'content_hash'))
+            # Entries written since the head was read are left for the next run
+            past_head = rows[-1][key] > head[0]
+            if past_head:
+                rows = [row for row in rows if row[key] <= head[0]]
+                if not rows:
+                    break
+            fields = operator.itemgetter(*(columns.index(c) for c in HASHED_COLUMNS))
+            with self.db.connection() as conn:
+                redactions = dict((log_id, (after, signature)) for log_id, after, signature in conn.execute(
+                    "SELECT log_id, content_hash, signature FROM audit_redactions WHERE log_id BETWEEN ? AND ?",
+                    (rows[0][key], rows[-1][key])
+                ).fetchall())
+                for row in rows:
+                    log_id = row[key]
+                    if log_id != prev_id + 1:
+                        anchored = self._anchor(conn, log_id - 1)
+                        if anchored is None:
+                            problem(log_id, f"entries {prev_id + 1} to {log_id - 1} are missing")
+                        else:
+                            report['anchors'] += 1
+                            prev_hash = anchored
+                    if row[row_hash] is None or row[entry_hash] is None:
+                        problem(log_id, "entry is not sealed")
+                        prev_id, prev_hash = log_id, row[row_hash]
+                        continue
+
+                    computed = content_hash(*fields(row))
+                    if computed != row[entry_hash]:
+                        after, signature = redactions.get(log_id, (None, None))
+                        if after == computed and self._signed(signature, 'redaction', log_id,
+                                                              row[entry_hash], computed):
+                            report['redactions'] += 1
+                        else:
+                            problem(log_id, "entry fields were modified")
+                    if link(prev_hash, row[entry_hash]) != row[row_hash]:
+                        problem(log_id, "chain link is broken")
+                    # Continue from the stored hash so one bad entry is reported once
+                    prev_id, prev_hash = log_id, row[row_hash]
+
+            report['rows'] += len(rows)
+            report['to_log_id'] = prev_id
+            report['elapsed'] = time.perf_counter() - started
+            report['rows_per_sec'] = report['rows'] / report['elapsed'] if report['elapsed'] else 0.0
+            if progress:
+                progress(report)
+            if past_head:
+                break
+
+        with self.db.connection() as conn:
+            head_id, head_hash = head[0], head[1]
+            if not head_signed:
+                problem(head_id, "chain head has an invalid signature")
+            else:
+                if head_id < prev_id:
+                    problem(head_id, f"chain head is behind entry {prev_id}")
+                elif head_id > prev_id:
+                    # The newest entries were deleted: only an anchor can vouch for them
+                    if self._anchor(conn, head_id) != head_hash:
+                        problem(head_id, f"entries after {prev_id} are missing")
+                elif head_hash != prev_hash:
+                    problem(head_id, "chain head does not match the newest entry")
+
+            if report['ok'] and checkpoint and report['rows']:
+                report['checkpoint_id'] = self.checkpoint(conn, 'verified', prev_id, prev_hash, report['rows'])
+
+        report['elapsed'] = time.perf_counter() - started
+        report['rows_per_sec'] = report['rows'] / report['elapsed'] if report['elapsed'] else 0.0
+        return report
+
+
+if __name__ == "__main__":
+    from database import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Verify the audit log hash chain")
+    parser.add_argument("--db", default="hospital.db")
+    parser.add_argument("--full", action="store_true", help="verify from genesis, not the last checkpoint")
+    parser.add_argument("--no-checkpoint", action="store_true", help="do not record a verified checkpoint")
+    args = parser.parse_args()
+
+    chain = AuditChain(DatabaseManager(db_name=args.db))
+    report = chain.verify(full=args.full, checkpoint=not args.no_checkpoint,
+                          progress=lambda r: print(f"{r['rows']} entries ({r['rows_per_sec']:.0f}/s)"))
+    print(report)
\ No newline at end of file
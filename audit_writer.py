@@ -0,0 +1,176 @@
+import atexit
+import queue
+import threading
+import time
+from collections import deque
+
+
+class AuditWriteError(Exception):
+    """Raised to durable callers when their audit records could not be written"""
+    pass
+
+
+# Queue markers understood by the worker thread
+_FLUSH = object()
+_STOP = object()
+
+
+class AuditLogWriter:
+    """Background writer that batches audit log records.
+
+    Records are queued in memory and written by a single worker thread with
+    one write_batch() call (one transaction) per batch. A batch is written
+    when it reaches batch_size records, when flush_interval seconds have
+    passed since its first record, or as soon as a caller asks for a flush.
+    """
+    def __init__(self, write_batch, batch_size=200, flush_interval=0.5,
+                 max_queue=10000, max_retries=3):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._submit_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._submitted = 0
+        self._written = 0
+        # (first, last) submission numbers of failed batches, most recent last
+        self._failed = deque(maxlen=1000)
+        self._closed = False
+        self.batches = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.last_error = None
+
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, record, wait=False, timeout=None):
+        """Queue one record; with wait=True block until it is committed"""
+        with self._submit_lock:
+            if self._closed:
+                # Writer is gone (e.g. during interpreter shutdown): write inline
+                self._write([record])
+                return
+            # Blocks when the queue is full, applying backpressure to callers
+            self._queue.put(record)
+            self._submitted += 1
+            seq = self._submitted
+            if wait:
+                self._queue.put(_FLUSH)
+        if wait:
+            self._wait_for(seq - 1, seq, timeout)
+
+    def flush(self, timeout=None):
+        """Block until every record submitted so far is committed.
+
+        Raises AuditWriteError if any record still pending when the flush
+        started could not be written; earlier failures are not reported
+        again.
+        """
+        with self._submit_lock:
+            seq = self._submitted
+            if self._closed or seq == 0:
+                return
+            with self._cond:
+                since = self._written
+            self._queue.put(_FLUSH)
+        self._wait_for(since, seq, timeout)
+
+    def close(self, timeout=None):
+        """Drain the queue and stop the worker thread"""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': self._queue.qsize(),
+                'submitted': self._submitted,
+                'written': self.rows_written,
+                'failed': self.rows_failed,
+                'batches': self.batches,
+                'last_error': self.last_error
+            }
+
+    def _wait_for(self, since, seq, timeout):
+        """Wait until records up to seq are done; raise if any in (since, seq] failed"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._written < seq:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise AuditWriteError(f"Audit log flush timed out after {timeout}s")
+                self._cond.wait(remaining)
+            if any(first <= seq and last > since for first, last in self._failed):
+                raise AuditWriteError(f"Audit log write failed: {self.last_error}")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                if item is _FLUSH:
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if stopping:
+                # Pick up anything that raced in behind the stop marker
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _FLUSH and item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._commit(batch)
+            else:
+                # A flush request with nothing pending still wakes waiters
+                with self._cond:
+                    self._cond.notify_all()
+
+    def _commit(self, batch):
+        ok = False
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._write(batch)
+                ok = True
+                break
+            except Exception as e:
+                self.last_error = str(e)
+                if attempt < self.max_retries:
+                    time.sleep(0.1 * 2 ** attempt)
+
+        with self._cond:
+            first = self._written + 1
+            self._written += len(batch)
+            self.batches += 1
+            if ok:
+                self.rows_written += len(batch)
+            else:
+                self.rows_failed += len(batch)
+                self._failed.append((first, self._written))
+            self._cond.notify_all()
+
+    def _write(self, records):
+        self.write_batch(records)
\ No newline at end of file
@@ -1,59 +1,158 @@
-import hashlib
-import streamlit as st
-from database import DatabaseManager
-
-class Authentication:
-    def __init__(self):
-        self.db = DatabaseManager()
-    
-    def hash_password(self, password):
-        return hashlib.sha256(password.encode()).hexdigest()
-    
-    def authenticate_user(self, username, password):
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        # Debug: Check what's actually in the database
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        db_user = cursor.fetchone()
-        
-        if db_user:
-            st.write(f"Debug - Database record: {db_user}")
-            st.write(f"Debug - Input password (hashed): {self.hash_password(password)}")
-            st.write(f"Debug - Stored password: {db_user[2]}")
-        
-        hashed_password = self.hash_password(password)
-        cursor.execute(
-            "SELECT user_id, username, role FROM users WHERE username = ? AND password = ?",
-            (username, hashed_password)
-        )
-        
-        user = cursor.fetchone()
-        conn.close()
-        
-        if user:
-            return {
-                'user_id': user[0],
-                'username': user[1],
-                'role': user[2]
-            }
-        return None
-    
-    def login_page(self):
-        st.title("Hospital Management System - Login")
-        
-        with st.form("login_form"):
-            username = st.text_input("Username")
-            password = st.text_input("Password", type="password")
-            submit = st.form_submit_button("Login")
-            
-            if submit:
-                user = self.authenticate_user(username, password)
-                if user:
-                    st.session_state.user = user
-                    st.session_state.logged_in = True
-                    self.db.log_activity(user['user_id'], user['role'], "login", "User logged in")
-                    st.success(f"Welcome {user['username']}!")
-                    st.rerun()
-                else:
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+import streamlit as st
+from database import DatabaseManager
+from passwords import hash_password, verify_password, needs_rehash
+
+# Verified against when the username does not exist, so unknown users take
+# as long to reject as wrong passwords; created on first use
+_dummy_hash = None
+
+
+def _get_dummy_hash():
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(os.urandom(16).hex())
+    return _dummy_hash
+
+
+class VerifiedCredentialCache:
+    """Short-lived cache of credentials that recently passed the KDF.
+
+    Keys are HMACs under a per-process secret of (username, password,
+    stored hash), so no password is kept in memory and a password change
+    invalidates the entry. Bounded to max_size entries, least recently
+    used evicted first.
+    """
+    def __init__(self, ttl=300.0, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def token(self, username, password, stored_hash):
+        message = "\0".join((username, password, stored_hash)).encode()
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def get(self, token):
+        with self._lock:
+            expires = self._entries.get(token)
+            if expires is None:
+                return False
+            if time.monotonic() >= expires:
+                del self._entries[token]
+                return False
+            self._entries.move_to_end(token)
+            return True
+
+    def add(self, token):
+        with self._lock:
+            self._entries[token] = time.monotonic() + self.ttl
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class LoginLatency:
+    """Keeps the most recent login timings for percentile reporting"""
+    def __init__(self, max_samples=1000):
+        self.samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, total, kdf, cached):
+        with self._lock:
+            self.samples.append((total, kdf, cached))
+
+    def summary(self):
+        with self._lock:
+            samples = list(self.samples)
+        if not samples:
+            return {'logins': 0}
+
+        def pct(values, q):
+            values = sorted(values)
+            return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+        totals = [s[0] for s in samples]
+        kdf = [s[1] for s in samples if not s[2]]
+        return {
+            'logins': len(samples),
+            'cache_hit_rate': sum(1 for s in samples if s[2]) / len(samples),
+            'p50_ms': pct(totals, 0.50),
+            'p95_ms': pct(totals, 0.95),
+            'p99_ms': pct(totals, 0.99),
+            'kdf_p50_ms': pct(kdf, 0.50) if kdf else 0.0,
+            'kdf_p99_ms': pct(kdf, 0.99) if kdf else 0.0
+        }
+
+
+class Authentication:
+    def __init__(self, db_manager=None, cache_ttl=300.0, cache_size=1024):
+        self.db = db_manager or DatabaseManager()
+        self.credential_cache = VerifiedCredentialCache(cache_ttl, cache_size)
+        self.latency = LoginLatency()
+
+    def hash_password(self, password):
+        return hash_password(password)
+
+    def authenticate_user(self, username, password):
+        started = time.perf_counter()
+        with self.db.connection() as conn:
+            db_user = conn.execute(
+                "SELECT user_id, username, role, password FROM users WHERE username = ?",
+                (username,)
+            ).fetchone()
+
+        kdf_started = time.perf_counter()
+        cached = False
+        if db_user is None:
+            verify_password(password, _get_dummy_hash())
+            verified = False
+        else:
+            token = self.credential_cache.token(username, password, db_user[3])
+            cached = self.credential_cache.get(token)
+            verified = cached or verify_password(password, db_user[3])
+        kdf_time = time.perf_counter() - kdf_started
+
+        if verified and not cached:
+            stored = db_user[3]
+            if needs_rehash(stored):
+                # Transparent upgrade from legacy SHA-256 or old scrypt parameters
+                stored = hash_password(password)
+                with self.db.connection() as conn:
+                    conn.execute("UPDATE users SET password = ? WHERE user_id = ?", (stored, db_user[0]))
+            self.credential_cache.add(self.credential_cache.token(username, password, stored))
+
+        self.latency.record(time.perf_counter() - started, kdf_time, cached)
+
+        if verified:
+            return {
+                'user_id': db_user[0],
+                'username': db_user[1],
+                'role': db_user[2]
+            }
+        return None
+
+    def login_page(self):
+        st.title("Hospital Management System - Login")
+
+        with st.form("login_form"):
+            username = st.text_input("Username")
+            password = st.text_input("Password", type="password")
+            submit = st.form_submit_button("Login")
+
+            if submit:
+                user = self.authenticate_user(username, password)
+                if user:
+                    st.session_state.user = user
+                    st.session_state.logged_in = True
+                    self.db.log_activity(user['user_id'], user['role'], "login", "User logged in")
+                    st.success(f"Welcome {user['username']}!")
+                    st.rerun()
+                else:
                     st.error("Invalid credentials")
\ No newline at end of file
@@ -0,0 +1,310 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from database import DatabaseManager, to_db_timestamp
+from encryption import DataProtection
+from analytics import ActivityAggregator, DashboardMetrics
+from bulk_operations import BulkAnonymizer
+from retention import RetentionEngine, RetentionPolicy
+from export import StreamingExporter
+
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda',
+               'David', 'Elizabeth', 'Ahmed', 'Fatima', 'Wei', 'Mei', 'Carlos', 'Sofia']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis',
+              'Khan', 'Ali', 'Wang', 'Li', 'Martinez', 'Lopez', 'Wilson', 'Anderson']
+DIAGNOSES = ['Hypertension', 'Type 2 diabetes', 'Asthma', 'Influenza', 'Migraine',
+             'Fractured wrist', 'Pneumonia', 'Anemia', 'Bronchitis', 'Gastritis']
+# (role, action, weight) mix modeled on the app's pages
+ACTIVITY_MIX = [
+    ('admin', 'login', 5), ('admin', 'logout', 4), ('admin', 'anonymization', 1),
+    ('doctor', 'login', 10), ('doctor', 'view', 40), ('doctor', 'logout', 8),
+    ('receptionist', 'login', 8), ('receptionist', 'add_patient', 15),
+    ('receptionist', 'edit_patient', 12), ('receptionist', 'logout', 6),
+]
+ROLE_USERS = {'admin': 1, 'doctor': 2, 'receptionist': 3}
+
+
+def generate_synthetic_data(db_path, patients=10000, logs=100000, days=90, seed=42, chunk=50000):
+    """Fill a scratch SQLite database with reproducible patients and logs"""
+    rng = random.Random(seed)
+    db = DatabaseManager(db_name=db_path, async_logging=False)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    span = days * 86400
+
+    with db.connection() as conn:
+        for start in range(0, patients, chunk):
+            rows = []
+            for _ in range(start, min(start + chunk, patients)):
+                rows.append((
+                    f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                    f"555-{rng.randrange(10 ** 7):07d}",
+                    rng.choice(DIAGNOSES),
+                    to_db_timestamp(now - timedelta(seconds=rng.randrange(span)))
+                ))
+            conn.executemany(
+                "INSERT INTO patients (name, contact, diagnosis, date_added) VALUES (?, ?, ?, ?)", rows
+            )
+            conn.commit()
+
+    # Logs go through the real batch write path so rollups are maintained;
+    # timestamps are generated oldest first, as they would be written
+    population = [(role, action) for role, action, _ in ACTIVITY_MIX]
+    weights = [weight for _, _, weight in ACTIVITY_MIX]
+    offsets = sorted((rng.randrange(span) for _ in range(logs)), reverse=True)
+    for start in range(0, logs, chunk):
+        records = []
+        for offset in offsets[start:start + chunk]:
+            role, action = rng.choices(population, weights)[0]
+            records.append((ROLE_USERS[role], role, action, f"synthetic {action}",
+                            to_db_timestamp(now - timedelta(seconds=offset)), None, None))
+        db.write_log_batch(records)
+    db.pool.close_all()
+    return db_path
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+class BenchmarkSuite:
+    """Times the app's data paths against a scratch database.
+
+    Each benchmark runs once as a warm-up and then `repeat` times; setup
+    (resetting state, copying the database) is excluded from the timings.
+    """
+    def __init__(self, db_path, repeat=5, sample_size=10000, workdir=None):
+        self.db_path = db_path
+        self.repeat = repeat
+        self.sample_size = sample_size
+        self.workdir = workdir or tempfile.mkdtemp(prefix="hms_bench_")
+        self.db = DatabaseManager(db_name=db_path)
+        self.protection = DataProtection()
+
+    def measure(self, fn, setup=None, rows=None):
+        timings = []
+        for i in range(self.repeat + 1):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+            if i > 0:
+                timings.append(elapsed)
+        result = {
+            'runs': len(timings),
+            'min_s': min(timings),
+            'median_s': statistics.median(timings),
+            'mean_s': statistics.mean(timings),
+            'stdev_s': statistics.stdev(timings) if len(timings) > 1 else 0.0
+        }
+        if rows:
+            result['rows'] = rows
+            result['rows_per_sec'] = rows / result['median_s'] if result['median_s'] else 0.0
+        return result
+
+    def bench_log_activity(self):
+        n = self.sample_size
+
+        def run():
+            for i in range(n):
+                self.db.log_activity(2, 'doctor', 'view', 'Viewed patient list')
+            self.db.flush_logs()
+        return self.measure(run, rows=n)
+
+    def bench_dashboard_queries(self):
+        metrics = DashboardMetrics(self.db, cache=None)
+
+        def run():
+            metrics.counts()
+            metrics.recent_logs(5)
+        return self.measure(run)
+
+    def bench_activity_aggregations(self):
+        aggregator = ActivityAggregator(self.db, window_days=30, cache=None)
+
+        def run():
+            aggregator.daily_action_counts()
+            aggregator.role_counts()
+            aggregator.hourly_counts()
+        return self.measure(run)
+
+    def bench_bulk_anonymization(self):
+        def reset():
+            with self.db.connection() as conn:
+                conn.execute("UPDATE patients SET anonymized_name = NULL, anonymized_contact = NULL")
+            self.db.clear_checkpoint(BulkAnonymizer.job_name)
+
+        with self.db.connection() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+        return self.measure(lambda: BulkAnonymizer(self.db, self.protection).run(resume=False),
+                            setup=reset, rows=rows)
+
+    def bench_encrypt(self):
+        values = [f"Patient {i}" for i in range(self.sample_size)]
+        return self.measure(lambda: self.protection.encrypt_many(values), rows=len(values))
+
+    def bench_decrypt(self):
+        tokens = self.protection.encrypt_many([f"Patient {i}" for i in range(self.sample_size)]).values
+        return self.measure(lambda: self.protection.decrypt_many(tokens), rows=len(tokens))
+
+    def bench_retention_delete(self):
+        # Every run needs the expired rows back, so it works on a fresh copy
+        copy_path = os.path.join(self.workdir, "retention.db")
+        state = {}
+
+        def setup():
+            if 'db' in state:
+                state['db'].pool.close_all()
+            shutil.copy(self.db_path, copy_path)
+            state['db'] = DatabaseManager(db_name=copy_path, async_logging=False)
+
+        def run():
+            policy = RetentionPolicy('logs', 30, 'timestamp', 'log_id', archive=False)
+            state['deleted'] = RetentionEngine(state['db'], batch_size=5000).enforce(policy)['deleted']
+
+        result = self.measure(run, setup=setup)
+        result['rows'] = state['deleted']
+        result['rows_per_sec'] = state['deleted'] / result['median_s'] if result['median_s'] else 0.0
+        return result
+
+    def bench_csv_export(self):
+        path = os.path.join(self.workdir, "export.csv")
+        state = {}
+
+        def run():
+            state['stats'] = StreamingExporter(self.db).export('csv', path=path)
+        result = self.measure(run)
+        result['rows'] = state['stats']['rows']
+        result['bytes'] = state['stats']['bytes']
+        result['rows_per_sec'] = result['rows'] / result['median_s'] if result['median_s'] else 0.0
+        return result
+
+    def bench_verify_chain(self):
+        # Full rehash of the chain; incremental runs only cover newer entries
+        state = {}
+
+        def run():
+            state['report'] = self.db.audit_chain.verify(full=True, checkpoint=False)
+        result = self.measure(run)
+        result['rows'] = state['report']['rows']
+        result['ok'] = state['report']['ok']
+        result['rows_per_sec'] = result['rows'] / result['median_s'] if result['median_s'] else 0.0
+        return result
+
+    def benchmarks(self):
+        return {
+            'log_activity': self.bench_log_activity,
+            'dashboard_queries': self.bench_dashboard_queries,
+            'activity_aggregations': self.bench_activity_aggregations,
+            'bulk_anonymization': self.bench_bulk_anonymization,
+            'encrypt_many': self.bench_encrypt,
+            'decrypt_many': self.bench_decrypt,
+            'retention_delete': self.bench_retention_delete,
+            'csv_export': self.bench_csv_export,
+            'verify_chain': self.bench_verify_chain,
+        }
+
+    def run(self, only=None):
+        results = {}
+        for name, bench in self.benchmarks().items():
+            if only and name not in only:
+                continue
+            results[name] = bench()
+            print(f"{name:24s} median {results[name]['median_s'] * 1000:10.2f} ms"
+                  + (f"  {results[name]['rows_per_sec']:12.0f} rows/s" if 'rows_per_sec' in results[name] else ""))
+        return results
+
+
+def compare(results, baseline, threshold):
+    """Print median changes against a baseline; returns names that regressed"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        change = (result['median_s'] - before['median_s']) / before['median_s'] * 100
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:24s} {before['median_s'] * 1000:10.2f} -> {result['median_s'] * 1000:10.2f} ms "
+              f"({change:+.1f}%){flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hospital data paths on synthetic data")
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--logs", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=90, help="spread of synthetic timestamps")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="database to benchmark a copy of (generated if missing)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sample-size", type=int, default=10000,
+                        help="operations per run for log_activity and crypto benchmarks")
+    parser.add_argument("--only", nargs="*", help="benchmark names to run")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="hms_bench_")
+    db_path = args.db or os.path.join(workdir, f"bench_{args.patients}_{args.logs}.db")
+    if not os.path.exists(db_path):
+        print(f"Generating {args.patients} patients and {args.logs} logs in {db_path}")
+        started = time.perf_counter()
+        generate_synthetic_data(db_path, args.patients, args.logs, args.days, args.seed)
+        print(f"Generated in {time.perf_counter() - started:.1f}s")
+
+    # Benchmarks that write (log_activity) run on a copy so reruns stay comparable
+    run_path = os.path.join(workdir, "run.db")
+    shutil.copy(db_path, run_path)
+    suite = BenchmarkSuite(run_path, repeat=args.repeat, sample_size=args.sample_size, workdir=workdir)
+    results = suite.run(args.only)
+    suite.db.flush_logs()
+    suite.db.pool.close_all()
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'patients': args.patients,
+            'logs': args.logs,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'sample_size': args.sample_size
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            raise SystemExit(1)
\ No newline at end of file
@@ -0,0 +1,343 @@
+import argparse
+import time
+
+
+class BulkJob:
+    """Keyset-paginated, resumable job over the patients table.
+
+    Rows are read in chunks ordered by patient_id. Each chunk's writes and
+    the job checkpoint are committed together, so an interrupted run resumes
+    after the last committed chunk. `pause` seconds of sleep between
+    chunks throttles jobs that run alongside live traffic.
+    """
+    job_name = None
+
+    def __init__(self, db_manager, chunk_size=1000, pause=0.0):
+        self.db = db_manager
+        self.chunk_size = chunk_size
+        self.pause = pause
+        # (patient_id, reason) for rows process_chunk() had to skip
+        self.failures = []
+
+    def fetch_chunk(self, conn, after_id):
+        raise NotImplementedError
+
+    def process_chunk(self, rows):
+        """Return the parameter tuples to pass to apply_chunk()"""
+        raise NotImplementedError
+
+    def apply_chunk(self, conn, updates):
+        raise NotImplementedError
+
+    def pending(self, conn, after_id):
+        """Rows after after_id the job still has to process, or None if unknown"""
+        return None
+
+    def run(self, progress=None, resume=True):
+        """Run to completion; progress(report) is called after every chunk"""
+        start = time.perf_counter()
+        after_id = self.db.get_checkpoint(self.job_name) if resume else None
+        report = {
+            'job': self.job_name,
+            'resumed_from': after_id,
+            'processed': 0,
+            'updated': 0,
+            'failed': 0,
+            'chunks': 0,
+            'last_id': after_id,
+            'max_id': self._max_id(),
+            'remaining': None,
+            'elapsed': 0.0,
+            'rows_per_sec': 0.0,
+            'completed': False
+        }
+        after_id = after_id or 0
+        with self.db.connection() as conn:
+            pending = self.pending(conn, after_id)
+
+        while True:
+            with self.db.connection() as conn:
+                rows = self.fetch_chunk(conn, after_id)
+            if not rows:
+                break
+
+            # Compute outside the write transaction to keep it short
+            updates = self.process_chunk(rows)
+            after_id = rows[-1][0]
+            with self.db.connection() as conn:
+                if updates:
+                    self.apply_chunk(conn, updates)
+                self.db.save_checkpoint(conn, self.job_name, after_id)
+            if updates:
+                self.db.notify_write('patients')
+
+            report['processed'] += len(rows)
+            report['updated'] += len(updates)
+            report['failed'] = len(self.failures)
+            report['chunks'] += 1
+            report['last_id'] = after_id
+            report['elapsed'] = time.perf_counter() - start
+            report['rows_per_sec'] = report['processed'] / report['elapsed'] if report['elapsed'] else 0.0
+            if pending is not None:
+                report['remaining'] = max(pending - report['processed'], 0)
+            if progress:
+                progress(report)
+            if self.pause:
+                time.sleep(self.pause)
+
+        self.db.clear_checkpoint(self.job_name)
+        report['elapsed'] = time.perf_counter() - start
+        report['rows_per_sec'] = report['processed'] / report['elapsed'] if report['elapsed'] else 0.0
+        if pending is not None:
+            report['remaining'] = 0
+        report['completed'] = True
+        return report
+
+    def _max_id(self):
+        with self.db.connection() as conn:
+            return conn.execute("SELECT MAX(patient_id) FROM patients").fetchone()[0] or 0
+
+
+class BulkAnonymizer(BulkJob):
+    """Fills in anonymized_name/anonymized_contact and the blind indexes for every patient.
+
+    Only rows whose stored values are missing or differ from what
+    DataProtection produces are written.
+    """
+    job_name = 'anonymize_patients'
+
+    def __init__(self, db_manager, data_protection, chunk_size=1000):
+        super().__init__(db_manager, chunk_size)
+        self.protection = data_protection
+
+    def fetch_chunk(self, conn, after_id):
+        return conn.execute(
+            """
+            SELECT patient_id, name, contact, anonymized_name, anonymized_contact,
+                   name_bidx, contact_bidx
+            FROM patients
+            WHERE patient_id > ?
+            ORDER BY patient_id
+            LIMIT ?
+            """,
+            (after_id, self.chunk_size)
+        ).fetchall()
+
+    def process_chunk(self, rows):
+        derived = self.protection.derived_many([row[:3] for row in rows])
+        # Parameters for the chunk's single executemany, changed rows only
+        return [new + (row[0],) for row, new in zip(rows, derived) if new != row[3:]]
+
+    def apply_chunk(self, conn, updates):
+        conn.executemany(
+            "UPDATE patients SET anonymized_name = ?, anonymized_contact = ?, "
+            "name_bidx = ?, contact_bidx = ? WHERE patient_id = ?",
+            updates
+        )
+
+
+class BlindIndexBackfill(BulkJob):
+    """Computes name_bidx/contact_bidx for existing rows.
+
+    Every row is checked and only stale or missing indexes are written,
+    so the same job recomputes all of them after the index key changes.
+    """
+    job_name = 'index_patients'
+
+    def __init__(self, db_manager, data_protection, chunk_size=5000):
+        super().__init__(db_manager, chunk_size)
+        self.protection = data_protection
+
+    def fetch_chunk(self, conn, after_id):
+        return conn.execute(
+            """
+            SELECT patient_id, name, contact, name_bidx, contact_bidx
+            FROM patients
+            WHERE patient_id > ?
+            ORDER BY patient_id
+            LIMIT ?
+            """,
+            (after_id, self.chunk_size)
+        ).fetchall()
+
+    def process_chunk(self, rows):
+        blind_index = self.protection.blind_index
+        updates = []
+        for patient_id, name, contact, name_bidx, contact_bidx in rows:
+            new = (blind_index(name, 'name'), blind_index(contact, 'contact'))
+            if new != (name_bidx, contact_bidx):
+                updates.append(new + (patient_id,))
+        return updates
+
+    def apply_chunk(self, conn, updates):
+        conn.executemany(
+            "UPDATE patients SET name_bidx = ?, contact_bidx = ? WHERE patient_id = ?",
+            updates
+        )
+
+
+class EncryptionBackfill(BulkJob):
+    """Fills in encrypted_name/encrypted_contact where they are missing.
+
+    One DataProtection.worker_pool is started for the run (workers=1 keeps
+    everything in-process) and every chunk is split across it, so worker
+    start-up is paid once rather than per chunk.
+    """
+    job_name = 'encrypt_patients'
+
+    def __init__(self, db_manager, data_protection, chunk_size=20000, workers=None):
+        super().__init__(db_manager, chunk_size)
+        self.protection = data_protection
+        self.workers = workers
+        self.pool = None
+
+    def run(self, progress=None, resume=True):
+        with self.protection.worker_pool(self.workers) as pool:
+            self.pool = pool
+            try:
+                return super().run(progress, resume)
+            finally:
+                self.pool = None
+
+    def fetch_chunk(self, conn, after_id):
+        return conn.execute(
+            """
+            SELECT patient_id, name, contact
+            FROM patients
+            WHERE patient_id > ? AND (encrypted_name IS NULL OR encrypted_contact IS NULL)
+            ORDER BY patient_id
+            LIMIT ?
+            """,
+            (after_id, self.chunk_size)
+        ).fetchall()
+
+    def process_chunk(self, rows):
+        key_id = self.protection.primary_key_id
+        names = self.protection.encrypt_many([row[1] for row in rows], pool=self.pool)
+        contacts = self.protection.encrypt_many([row[2] for row in rows], pool=self.pool)
+        updates = []
+        for i, row in enumerate(rows):
+            error = names.errors.get(i) or contacts.errors.get(i)
+            if error:
+                self.failures.append((row[0], error))
+                continue
+            updates.append((names.values[i], contacts.values[i], key_id, row[0]))
+        return updates
+
+    def apply_chunk(self, conn, updates):
+        conn.executemany(
+            "UPDATE patients SET encrypted_name = ?, encrypted_contact = ?, key_id = ? WHERE patient_id = ?",
+            updates
+        )
+
+
+class KeyRotation(BulkJob):
+    """Re-encrypts encrypted_name/encrypted_contact under the primary key.
+
+    Run after DataProtection.rotate_key(). Reads keep working throughout,
+    because retired keys stay in the key ring until remove_retired_keys().
+    Rows are re-encrypted with MultiFernet.rotate, so plaintext never
+    leaves the crypto layer. Each update only applies if the row still
+    holds the ciphertext that was read, so a concurrent edit is never
+    overwritten; such rows are picked up by the next run.
+    """
+    job_name = 'rotate_patient_keys'
+
+    def __init__(self, db_manager, data_protection, chunk_size=2000, pause=0.05):
+        super().__init__(db_manager, chunk_size, pause)
+        self.protection = data_protection
+
+    def _stale(self):
+        return ("(encrypted_name IS NOT NULL OR encrypted_contact IS NOT NULL) "
+                "AND (key_id IS NULL OR key_id != ?)")
+
+    def fetch_chunk(self, conn, after_id):
+        return conn.execute(
+            f"""
+            SELECT patient_id, encrypted_name, encrypted_contact
+            FROM patients
+            WHERE patient_id > ? AND {self._stale()}
+            ORDER BY patient_id
+            LIMIT ?
+            """,
+            (after_id, self.protection.primary_key_id, self.chunk_size)
+        ).fetchall()
+
+    def pending(self, conn, after_id):
+        return conn.execute(
+            f"SELECT COUNT(*) FROM patients WHERE patient_id > ? AND {self._stale()}",
+            (after_id, self.protection.primary_key_id)
+        ).fetchone()[0]
+
+    def process_chunk(self, rows):
+        key_id = self.protection.primary_key_id
+        names = self.protection.rotate_many([row[1] for row in rows])
+        contacts = self.protection.rotate_many([row[2] for row in rows])
+        updates = []
+        for i, (patient_id, name, contact) in enumerate(rows):
+            error = names.errors.get(i) or contacts.errors.get(i)
+            if error:
+                self.failures.append((patient_id, error))
+                continue
+            updates.append((names.values[i], contacts.values[i], key_id, patient_id, name, contact))
+        return updates
+
+    def apply_chunk(self, conn, updates):
+        conn.executemany(
+            """
+            UPDATE patients SET encrypted_name = ?, encrypted_contact = ?, key_id = ?
+            WHERE patient_id = ? AND encrypted_name IS ? AND encrypted_contact IS ?
+            """,
+            updates
+        )
+
+    def retired_keys_in_use(self):
+        """{key_id: rows} for keys other than the primary still referenced by rows"""
+        with self.db.connection() as conn:
+            return dict(conn.execute(
+                f"SELECT COALESCE(key_id, 'untagged'), COUNT(*) FROM patients WHERE {self._stale()} GROUP BY 1",
+                (self.protection.primary_key_id,)
+            ).fetchall())
+
+
+if __name__ == "__main__":
+    from database import DatabaseManager
+    from encryption import DataProtection
+
+    parser = argparse.ArgumentParser(description="Run bulk patient data jobs")
+    parser.add_argument("job", choices=["anonymize", "encrypt", "index", "rotate"])
+    parser.add_argument("--db", default="hospital.db")
+    parser.add_argument("--chunk-size", type=int)
+    parser.add_argument("--restart", action="store_true", help="ignore any saved checkpoint")
+    parser.add_argument("--pause", type=float, help="seconds to sleep between chunks")
+    parser.add_argument("--workers", type=int, help="encrypt: worker processes (1 = in-process)")
+    parser.add_argument("--new-key", action="store_true",
+                        help="rotate: make a new primary key before re-encrypting")
+    args = parser.parse_args()
+
+    db = DatabaseManager(db_name=args.db)
+    job_class = {
+        "anonymize": BulkAnonymizer,
+        "encrypt": EncryptionBackfill,
+        "index": BlindIndexBackfill,
+        "rotate": KeyRotation
+    }[args.job]
+    protection = DataProtection()
+    if args.new_key:
+        print("New primary key: %s (retired: %s)" % protection.rotate_key())
+    job = job_class(db, protection)
+    if args.chunk_size:
+        job.chunk_size = args.chunk_size
+    if args.pause is not None:
+        job.pause = args.pause
+    if args.workers and hasattr(job, 'workers'):
+        job.workers = args.workers
+
+    def print_progress(report):
+        print(f"{report['last_id']}/{report['max_id']} processed={report['processed']} "
+              f"updated={report['updated']} failed={report['failed']} "
+              f"remaining={report['remaining'] if report['remaining'] is not None else '?'} "
+              f"({report['rows_per_sec']:.0f} rows/s)")
+
+    report = job.run(progress=print_progress, resume=not args.restart)
+    print(report)
\ No newline at end of file
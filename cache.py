@@ -0,0 +1,134 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_size(value):
+    """Rough in-memory size of a cached value in bytes"""
+    if hasattr(value, 'memory_usage'):
+        # pandas DataFrame / Series
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class MetricsCache:
+    """Process-wide cache for dashboard metrics and chart aggregates.
+
+    An entry is served while it is younger than its TTL and none of the
+    tables it depends on have been written since it was computed. Writers
+    call bump() to advance a table's generation, which invalidates its
+    entries straight away. Callers that accept slightly stale results can
+    pass a `grace` period: under a constant stream of writes their entry is
+    still reused for that many seconds, so the query behind it runs at most
+    once per grace period. Concurrent misses on
+    the same key wait for a single computation. Entries are evicted least
+    recently used first once their estimated size exceeds max_bytes.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, default_ttl=30.0, grace=0.0):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.grace = grace
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def bump(self, scope, *tables):
+        """Mark tables of one database (scope) as written"""
+        with self._lock:
+            for table in tables:
+                key = (scope, table)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def _snapshot(self, scope, tables):
+        return tuple(self._generations.get((scope, table), 0) for table in tables)
+
+    def _lookup(self, key, scope, depends_on, now, grace, record=True):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, size, created, expires, generations = entry
+        if now >= expires:
+            return None
+        if generations != self._snapshot(scope, depends_on) and now - created >= grace:
+            if record:
+                self.invalidations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_or_compute(self, scope, key, compute, depends_on=(), ttl=None, grace=None):
+        """Return the cached value for (scope, key), computing it on a miss"""
+        full_key = (scope, key)
+        grace = self.grace if grace is None else grace
+        now = time.monotonic()
+        with self._lock:
+            entry = self._lookup(full_key, scope, depends_on, now, grace, record=False)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            key_lock = self._key_locks.setdefault(full_key, threading.Lock())
+
+        with key_lock:
+            # Another session may have filled it while we waited
+            now = time.monotonic()
+            with self._lock:
+                entry = self._lookup(full_key, scope, depends_on, now, grace)
+                if entry is not None:
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+                generations = self._snapshot(scope, depends_on)
+
+            value = compute()
+            size = estimate_size(value)
+            with self._lock:
+                self._discard(full_key)
+                expires = now + (ttl if ttl is not None else self.default_ttl)
+                self._entries[full_key] = (value, size, now, expires, generations)
+                self._bytes += size
+                while self._bytes > self.max_bytes and len(self._entries) > 1:
+                    oldest = next(iter(self._entries))
+                    self._discard(oldest)
+                    self._key_locks.pop(oldest, None)
+                    self.evictions += 1
+            return value
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+# Shared by every session of the Streamlit server process
+metrics_cache = MetricsCache()
\ No newline at end of file
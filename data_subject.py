@@ -0,0 +1,405 @@
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+
+from database import to_db_timestamp, utc_now
+from log_partitions import LogStore, remove_segment
+
+
+SUBJECT_TYPES = ('patient', 'user')
+MODES = ('pseudonymize', 'erase')
+# Columns that are never included in an export bundle
+PRIVATE_COLUMNS = {'password', 'name_bidx', 'contact_bidx'}
+
+
+class SubjectRequestError(Exception):
+    """Raised when a data subject request cannot be carried out"""
+    pass
+
+
+class DataSubjectService:
+    """Right-of-access exports and right-to-erasure processing for one subject.
+
+    A subject is a patient or a user. Log entries about a patient are found
+    through the indexed logs.subject_type/subject_id columns; entries made
+    by a user through logs.user_id. Erasure rewrites the subject's log
+    entries in keyset-ordered chunks, each committed with a checkpoint, and
+    removes or pseudonymizes the subject's own row in a final transaction,
+    so an interrupted request is resumed by running it again. Compacted log
+    months are found through LogStore's subject refs and their segments
+    rewritten. Log retention archives under archive_dir/logs are rewritten
+    too, including entries archived before logs had subject columns, which
+    are matched by their "Added patient: <name>" details.
+    """
+    def __init__(self, db_manager, data_protection, chunk_size=1000, archive_dir='archive'):
+        self.db = db_manager
+        self.protection = data_protection
+        self.chunk_size = chunk_size
+        self.archive_dir = archive_dir
+        self.store = LogStore(db_manager)
+
+    def _check_type(self, subject_type):
+        if subject_type not in SUBJECT_TYPES:
+            raise SubjectRequestError(f"Unknown subject type: {subject_type}")
+
+    def _log_filter(self, subject_type):
+        if subject_type == 'patient':
+            return "subject_type = 'patient' AND subject_id = ?"
+        return "user_id = ?"
+
+    def _log_scope(self, subject_type, subject_id):
+        """LogStore filter for the subject's log entries"""
+        if subject_type == 'patient':
+            return {'subject': ('patient', subject_id)}
+        return {'user_id': subject_id}
+
+    def subject_row(self, conn, subject_type, subject_id):
+        table, key = ('patients', 'patient_id') if subject_type == 'patient' else ('users', 'user_id')
+        cursor = conn.execute(f"SELECT * FROM {table} WHERE {key} = ?", (subject_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+
+    def locate(self, subject_type, subject_id):
+        """Where the subject's data lives: {'record': bool, 'logs': n, 'first_log', 'last_log'}"""
+        self._check_type(subject_type)
+        self.db.flush_logs()
+        with self.db.connection() as conn:
+            record = self.subject_row(conn, subject_type, subject_id)
+            count, first, last = conn.execute(
+                f"SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM logs WHERE {self._log_filter(subject_type)}",
+                (subject_id,)
+            ).fetchone()
+        # Compacted months: only the segments the refs point at are read
+        for columns, rows in self.store.iter_rows(hot=False, **self._log_scope(subject_type, subject_id)):
+            timestamps = [str(row[columns.index('timestamp')]) for row in rows]
+            count += len(rows)
+            first = min(timestamps + ([first] if first else []))
+            last = max(timestamps + ([last] if last else []))
+        return {
+            'subject_type': subject_type,
+            'subject_id': subject_id,
+            'record': record is not None,
+            'logs': count,
+            'first_log': first,
+            'last_log': last
+        }
+
+    def export_bundle(self, subject_type, subject_id, path=None):
+        """Write a zip with manifest.json, subject.json and logs.csv; returns stats"""
+        self._check_type(subject_type)
+        started = time.perf_counter()
+        self.db.flush_logs()
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".zip", prefix=f"{subject_type}_{subject_id}_")
+            os.close(fd)
+
+        rows = 0
+        with self.db.connection() as conn, zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as bundle:
+            record = self.subject_row(conn, subject_type, subject_id)
+            if record is None:
+                raise SubjectRequestError(f"No {subject_type} with ID {subject_id}")
+            record = {k: v for k, v in record.items() if k not in PRIVATE_COLUMNS}
+            if subject_type == 'patient':
+                # The plaintext behind the encrypted copies, not the ciphertext
+                record = self.protection.reveal_original_data(record)
+                record.pop('encrypted_name', None)
+                record.pop('encrypted_contact', None)
+            bundle.writestr('subject.json', json.dumps(record, indent=2, default=str))
+
+            with bundle.open('logs.csv', 'w') as raw:
+                out = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+                writer = csv.writer(out)
+                writer.writerow(self.store.columns(conn))
+                for _, chunk in self.store.iter_rows(chunk_size=self.chunk_size,
+                                                     **self._log_scope(subject_type, subject_id)):
+                    writer.writerows(chunk)
+                    rows += len(chunk)
+                out.flush()
+                out.detach()
+
+            bundle.writestr('manifest.json', json.dumps({
+                'subject_type': subject_type,
+                'subject_id': subject_id,
+                'generated_at': to_db_timestamp(utc_now()),
+                'files': {'subject.json': 1, 'logs.csv': rows}
+            }, indent=2))
+
+        return {
+            'path': path,
+            'logs': rows,
+            'bytes': os.path.getsize(path),
+            'elapsed': time.perf_counter() - started
+        }
+
+    def _check_erasable(self, conn, subject_type, subject_id, requested_by):
+        if subject_type != 'user':
+            return
+        if requested_by and requested_by.get('user_id') == subject_id:
+            raise SubjectRequestError("Users cannot erase their own account")
+        role = conn.execute("SELECT role FROM users WHERE user_id = ?", (subject_id,)).fetchone()
+        if role and role[0] == 'admin':
+            admins = conn.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'").fetchone()[0]
+            if admins <= 1:
+                raise SubjectRequestError("Cannot erase the last admin account")
+
+    def erase(self, subject_type, subject_id, mode='pseudonymize', requested_by=None, progress=None):
+        """Erase or pseudonymize a subject; returns a processing report.
+
+        pseudonymize: patient name/contact are replaced by their anonymized
+        forms and the encrypted copies and blind indexes cleared; a user's
+        username is replaced and their password made unusable. Log entries
+        about a patient keep the patient ID but lose any other details.
+        erase: the patient or user row is deleted and log entries about a
+        patient are unlinked from it. Entries a user made stay, identified
+        only by the numeric user_id, for accountability.
+        """
+        self._check_type(subject_type)
+        if mode not in MODES:
+            raise SubjectRequestError(f"Unknown mode: {mode}")
+        started = time.perf_counter()
+        job = f"subject_{mode}_{subject_type}_{subject_id}"
+        self.db.flush_logs()
+
+        with self.db.connection() as conn:
+            self._check_erasable(conn, subject_type, subject_id, requested_by)
+            record = self.subject_row(conn, subject_type, subject_id)
+        found = record is not None
+        after_id = self.db.get_checkpoint(job) or 0
+        report = {
+            'subject_type': subject_type,
+            'subject_id': subject_id,
+            'mode': mode,
+            'record_found': found,
+            'resumed_from': after_id or None,
+            'logs_updated': 0,
+            'chunks': 0,
+            'archive_files': 0,
+            'archive_entries': 0,
+            'record_updated': 0,
+            'elapsed': 0.0,
+            'completed': False
+        }
+
+        if subject_type == 'patient':
+            while True:
+                with self.db.connection() as conn:
+                    columns = self.store.columns(conn)
+                    rows = conn.execute(
+                        f"SELECT {', '.join(columns)} FROM logs "
+                        "WHERE subject_type = 'patient' AND subject_id = ? AND log_id > ? "
+                        "ORDER BY log_id LIMIT ?",
+                        (subject_id, after_id, self.chunk_size)
+                    ).fetchall()
+                    if not rows:
+                        break
+                    rewritten, _ = self._rewrite_rows(columns, rows, subject_id, mode)
+                    key, details, stype, sid = (columns.index(c) for c in
+                                                ('log_id', 'details', 'subject_type', 'subject_id'))
+                    conn.executemany(
+                        "UPDATE logs SET details = ?, subject_type = ?, subject_id = ? WHERE log_id = ?",
+                        [(row[details], row[stype], row[sid], row[key]) for row in rewritten]
+                    )
+                    # Keeps the rewritten entries verifiable on the audit hash chain
+                    self.db.logs_rewritten(conn, columns, rewritten)
+                    after_id = rows[-1][key]
+                    self.db.save_checkpoint(conn, job, after_id)
+                report['logs_updated'] += len(rows)
+                report['chunks'] += 1
+                if progress:
+                    progress(report)
+                if len(rows) < self.chunk_size:
+                    break
+
+            # Compacted months: each affected segment is streamed into a
+            # rewritten copy; a rerun finds the same segments again
+            for partition in self.store.partitions(months=self.store.subject_months(('patient', subject_id))):
+                with self.db.connection() as conn:
+                    columns = self.store.columns(conn)
+                changed = []
+
+                def rewritten_rows():
+                    for rows in self.store.segment_chunks(partition, columns):
+                        rewritten, _ = self._rewrite_rows(columns, rows, subject_id, mode)
+                        changed.extend(new for old, new in zip(rows, rewritten) if new is not old)
+                        yield from rewritten
+
+                self.store.rewrite(partition, columns, rewritten_rows(),
+                                   apply=lambda conn: self.db.logs_rewritten(conn, columns, changed))
+                report['logs_updated'] += len(changed)
+                report['chunks'] += 1
+                if progress:
+                    progress(report)
+
+            # Before the record goes, while the name is still known
+            self._erase_archives(subject_id, mode, record['name'] if record else None, report)
+            if progress:
+                progress(report)
+
+        # The subject's own row, together with the end of the job
+        with self.db.connection() as conn:
+            report['record_updated'] = self._apply_to_record(conn, subject_type, subject_id, mode)
+            conn.execute("DELETE FROM job_checkpoints WHERE job = ?", (job,))
+        self.db.notify_write('patients' if subject_type == 'patient' else 'users', 'logs')
+
+        report['elapsed'] = time.perf_counter() - started
+        report['completed'] = True
+        if requested_by:
+            self.db.log_activity(
+                requested_by['user_id'], requested_by['role'], f"subject_{mode}",
+                f"Processed {mode} request for {subject_type} ID {subject_id}: "
+                f"{report['logs_updated']} log entries, {report['record_updated']} records",
+                durable=True,
+                subject=(subject_type, subject_id) if mode == 'pseudonymize' else None
+            )
+        return report
+
+    def _rewrite_rows(self, columns, rows, subject_id, mode, name=None):
+        """Log rows with the erase/pseudonymize edits applied; returns (rows, changed).
+
+        With a name, unlinked "Added patient: <name>" entries count as the
+        subject's too.
+        """
+        action, details = columns.index('action'), columns.index('details')
+        stype, sid = columns.index('subject_type'), columns.index('subject_id')
+        legacy = f"Added patient: {name}" if name else None
+        rewritten = []
+        changed = 0
+        for row in rows:
+            if (row[stype], row[sid]) == ('patient', subject_id) or (
+                    legacy and row[sid] is None and row[action] == 'add_patient' and row[details] == legacy):
+                row = list(row)
+                if mode == 'erase':
+                    row[details] = f"{row[action]} (erased patient)"
+                    row[stype] = row[sid] = None
+                else:
+                    row[details] = f"{row[action]} (patient ID: {subject_id})"
+                row = tuple(row)
+                changed += 1
+            rewritten.append(row)
+        return rewritten, changed
+
+    def _erase_archives(self, subject_id, mode, name, report):
+        """Rewrite the retention archive files holding entries about the patient"""
+        directory = os.path.join(self.archive_dir, 'logs')
+        if not os.path.isdir(directory):
+            return
+        archive = LogStore(self.db, segment_dir=directory)
+        with self.db.connection() as conn:
+            columns = self.store.columns(conn)
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if filename.endswith('.jsonl.gz'):
+                changed = self._erase_jsonl_archive(path, subject_id, mode, name)
+            elif filename.endswith(('.parquet', '.seg.gz')):
+                changed = self._erase_segment_archive(archive, filename, columns, subject_id, mode, name)
+            else:
+                continue
+            if changed:
+                report['archive_files'] += 1
+                report['archive_entries'] += changed
+
+    def _erase_jsonl_archive(self, path, subject_id, mode, name):
+        """Rewrite one SegmentWriter file in place (via a temporary copy); returns entries changed"""
+        def records():
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    # Archives written before logs had subject columns
+                    record.setdefault('subject_type', None)
+                    record.setdefault('subject_id', None)
+                    columns = list(record)
+                    rows, changed = self._rewrite_rows(columns, [tuple(record.values())], subject_id, mode, name)
+                    yield dict(zip(columns, rows[0])), changed
+
+        if not any(changed for _, changed in records()):
+            return 0
+        tmp = path + ".tmp"
+        total = 0
+        with gzip.open(tmp, 'wt', encoding='utf-8') as out:
+            for record, changed in records():
+                out.write(json.dumps(record, default=str) + "\n")
+                total += changed
+        os.replace(tmp, path)
+        return total
+
+    def _erase_segment_archive(self, archive, filename, columns, subject_id, mode, name):
+        """Replace one archived partition segment with a rewritten copy; returns entries changed"""
+        # Archived segments keep their logs_<month>_<version> file names
+        partition = {'month': filename.split('_')[1], 'path': filename}
+        if not any(self._rewrite_rows(columns, rows, subject_id, mode, name)[1]
+                   for rows in archive.segment_chunks(partition, columns)):
+            return 0
+        total = 0
+
+        def rewritten_rows():
+            nonlocal total
+            for rows in archive.segment_chunks(partition, columns):
+                rewritten, changed = self._rewrite_rows(columns, rows, subject_id, mode, name)
+                total += changed
+                yield from rewritten
+
+        archive.write(partition['month'], columns, rewritten_rows())
+        remove_segment(os.path.join(archive.segment_dir, filename))
+        return total
+
+    def _apply_to_record(self, conn, subject_type, subject_id, mode):
+        if subject_type == 'patient':
+            if mode == 'erase':
+                return conn.execute("DELETE FROM patients WHERE patient_id = ?", (subject_id,)).rowcount
+            row = conn.execute("SELECT contact FROM patients WHERE patient_id = ?", (subject_id,)).fetchone()
+            if row is None:
+                return 0
+            return conn.execute(
+                """
+                UPDATE patients SET name = ?, contact = ?, anonymized_name = ?, anonymized_contact = ?,
+                    encrypted_name = NULL, encrypted_contact = NULL, key_id = NULL,
+                    name_bidx = NULL, contact_bidx = NULL
+                WHERE patient_id = ?
+                """,
+                (self.protection.anonymize_name(None, subject_id),
+                 self.protection.anonymize_contact(row[0]),
+                 self.protection.anonymize_name(None, subject_id),
+                 self.protection.anonymize_contact(row[0]),
+                 subject_id)
+            ).rowcount
+
+        if mode == 'erase':
+            return conn.execute("DELETE FROM users WHERE user_id = ?", (subject_id,)).rowcount
+        # '!' never matches a password hash, so the account can no longer log in
+        return conn.execute(
+            "UPDATE users SET username = ?, password = '!' WHERE user_id = ?",
+            (f"erased_user_{subject_id}", subject_id)
+        ).rowcount
+
+
+if __name__ == "__main__":
+    from database import DatabaseManager
+    from encryption import DataProtection
+
+    parser = argparse.ArgumentParser(description="Process GDPR data subject requests")
+    parser.add_argument("command", choices=["locate", "export", "pseudonymize", "erase"])
+    parser.add_argument("subject_type", choices=SUBJECT_TYPES)
+    parser.add_argument("subject_id", type=int)
+    parser.add_argument("--db", default="hospital.db")
+    parser.add_argument("--output", help="bundle path for export")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--archive-dir", default="archive", help="retention archives to erase from")
+    args = parser.parse_args()
+
+    db = DatabaseManager(db_name=args.db)
+    service = DataSubjectService(db, DataProtection(), chunk_size=args.chunk_size, archive_dir=args.archive_dir)
+    if args.command == "locate":
+        print(service.locate(args.subject_type, args.subject_id))
+    elif args.command == "export":
+        print(service.export_bundle(args.subject_type, args.subject_id, args.output))
+    else:
+        print(service.erase(args.subject_type, args.subject_id, mode=args.command,
+                            requested_by={'user_id': None, 'role': 'system'}))
\ No newline at end of file
@@ -1,111 +1,570 @@
-import mysql.connector
-import sqlite3
-from datetime import datetime
-import hashlib
-
-class DatabaseManager:
-    def __init__(self, db_type='sqlite', db_name='hospital.db'):
-        self.db_type = db_type
-        self.db_name = db_name
-        self.init_database()
-    
-    def hash_password(self, password):
-        return hashlib.sha256(password.encode()).hexdigest()
-
-    def get_connection(self):
-        if self.db_type == 'sqlite':
-            return sqlite3.connect(self.db_name)
-        else:
-            return mysql.connector.connect(
-                host="localhost",
-                user="your_username",
-                password="your_password",
-                database=self.db_name
-            )
-    
-    def init_database(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Create users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                role TEXT NOT NULL
-            )
-        ''')
-        
-        # Create patients table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS patients (
-            patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            contact TEXT NOT NULL,
-            diagnosis TEXT NOT NULL,
-            anonymized_name TEXT,
-            anonymized_contact TEXT,
-            encrypted_name TEXT,
-            encrypted_contact TEXT,
-            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-''')
-        
-        # Create logs table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS logs (
-                log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                role TEXT,
-                action TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                details TEXT
-            )
-        ''')
-        
-        # Insert default users
-        default_users = [
-            ('admin', self.hash_password('admin123'), 'admin'),
-            ('dr_bob', self.hash_password('doc123'), 'doctor'),
-            ('alice_recep', self.hash_password('rec123'), 'receptionist')
-        ]
-        
-        for user in default_users:
-            try:
-                cursor.execute(
-                    "INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)",
-                    user
-                )
-            except:
-                pass
-        
-        conn.commit()
-        conn.close()
-    
-    def log_activity(self, user_id, role, action, details=""):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO logs (user_id, role, action, details) VALUES (?, ?, ?, ?)",
-            (user_id, role, action, details)
-        )
-        conn.commit()
-        conn.close()
-
-    def enforce_data_retention(self, retention_days=30):
-        """Remove records older than retention period"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Delete logs older than retention period
-        cursor.execute(
-            "DELETE FROM logs WHERE timestamp < datetime('now', ?)",
-            (f'-{retention_days} days',)
-        )
-        
-        deleted_count = cursor.rowcount
-        conn.commit()
-        conn.close()
-    
-        return deleted_count    
\ No newline at end of file
+import mysql.connector
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from audit_writer import AuditLogWriter, AuditWriteError
+from migrations import MigrationRunner
+from cache import metrics_cache
+from rollups import ActivityRollups
+from log_search import LogSearch
+from passwords import hash_password
+from instrumentation import instrumentation, InstrumentedCursor
+
+
+def to_db_timestamp(value):
+    """Format a datetime the way SQLite's CURRENT_TIMESTAMP stores it (UTC)"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+# Insert order of audit chain rows (see AuditChain.seal)
+LOG_COLUMNS = ('log_id', 'user_id', 'role', 'action', 'details', 'timestamp', 'subject_type',
+               'subject_id', 'content_hash', 'row_hash')
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time"""
+    pass
+
+
+class PooledSQLiteConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool"""
+    pool = None
+
+    # While instrumentation is on, queries go through an InstrumentedCursor
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = InstrumentedCursor if instrumentation.enabled else sqlite3.Cursor
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        if instrumentation.enabled:
+            return self.cursor().execute(sql, parameters)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if instrumentation.enabled:
+            return self.cursor().executemany(sql, seq_of_parameters)
+        return super().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def discard(self):
+        self.pool = None
+        super().close()
+
+
+class PooledMySQLConnection:
+    """Proxy around a mysql.connector connection whose close() returns it to the pool"""
+    def __init__(self, raw, pool):
+        self._raw = raw
+        self.pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        self.pool.release(self)
+
+    def discard(self):
+        self._raw.close()
+
+
+class ConnectionPool:
+    """Thread-affine connection pool.
+
+    A thread that already holds a connection gets the same one back (nested
+    checkouts are reference counted), so a page render and the log_activity
+    calls it triggers share a single connection. Released connections go to
+    an idle list for reuse by the next caller. When max_size is set, callers
+    wait up to `timeout` seconds for a free connection.
+    """
+    def __init__(self, connect, max_size=None, max_idle=8, timeout=30.0):
+        self._connect = connect
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self.checkouts = 0
+        self.created = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.depth += 1
+            with self._cond:
+                self.checkouts += 1
+            return conn
+
+        start = time.perf_counter()
+        with self._cond:
+            while not self._idle and self.max_size is not None and self._size >= self.max_size:
+                remaining = self.timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"No connection available after {self.timeout}s")
+                self._cond.wait(remaining)
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._size += 1
+            self._in_use += 1
+
+        if conn is None:
+            try:
+                conn = self._connect(self)
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self.created += 1
+
+        waited = time.perf_counter() - start
+        with self._cond:
+            self.checkouts += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def depth(self):
+        """Nesting level of the current thread's checkout (0 when it holds none)"""
+        return getattr(self._local, 'depth', 0) if getattr(self._local, 'conn', None) is not None else 0
+
+    def release(self, conn):
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.depth -= 1
+            if self._local.depth > 0:
+                return
+            self._local.conn = None
+
+        # Uncommitted work is discarded, as it was when connections were closed
+        keep = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            keep = False
+
+        with self._cond:
+            self._in_use -= 1
+            if keep and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+            else:
+                self._size -= 1
+                conn.discard()
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            conn.discard()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+                'created': self.created,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_time_total': self.wait_time,
+                'wait_time_max': self.max_wait,
+                'wait_time_avg': self.wait_time / self.checkouts if self.checkouts else 0.0
+            }
+
+
+class DatabaseSession:
+    """Per-client routing state: when the client last wrote each table.
+
+    Bound to the current thread with DatabaseManager.bind_session(). Writes
+    are recorded by notify_write(), and reads of a table go to the primary
+    until the replica has caught up with the session's last write to it.
+    Entries queued by log_activity() are not tracked: they reach replica
+    reads within max_staleness, like everyone else's.
+    """
+    def __init__(self):
+        self.writes = {}
+
+
+class SQLiteReplica:
+    """Read-only copy of a SQLite database, refreshed with the backup API.
+
+    Stands in for a streaming replica: a background thread copies the
+    primary into `path` every refresh_interval seconds. The copy stays in
+    WAL mode, so its readers keep their snapshot while a refresh is being
+    written. synced_at (time.monotonic()) is taken before queued audit
+    entries are flushed and the copy starts, so every write that finished
+    before synced_at is in the copy.
+    """
+    def __init__(self, primary, path, refresh_interval=5.0):
+        self.primary = primary
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.pool = ConnectionPool(self._connect)
+        self.synced_at = None
+        self.refreshes = 0
+        self.last_refresh_time = 0.0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connect(self, pool):
+        conn = sqlite3.connect(self.path, factory=PooledSQLiteConnection,
+                               check_same_thread=False, timeout=30)
+        conn.execute(f"PRAGMA busy_timeout = {DatabaseManager.SQLITE_PRAGMAS['busy_timeout']}")
+        conn.execute(f"PRAGMA cache_size = {DatabaseManager.SQLITE_PRAGMAS['cache_size']}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA query_only = ON")
+        conn.pool = pool
+        return conn
+
+    def refresh(self):
+        """Copy the primary now; returns the seconds the copy took"""
+        with self._lock:
+            started = time.monotonic()
+            try:
+                self.primary.flush_logs(timeout=30)
+            except AuditWriteError as e:
+                # Failed or slow audit writes only make the copy less fresh
+                self.last_error = str(e)
+            source = sqlite3.connect(self.primary.db_name, timeout=30)
+            target = sqlite3.connect(self.path, timeout=30)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            self.synced_at = started
+            self.refreshes += 1
+            self.last_refresh_time = time.monotonic() - started
+            return self.last_refresh_time
+
+    def lag(self):
+        """Seconds of writes the copy may be missing, or None before the first refresh"""
+        return None if self.synced_at is None else time.monotonic() - self.synced_at
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sqlite-replica", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                # Reads fall back to the primary once the copy is too stale
+                self.last_error = str(e)
+            self._stop.wait(self.refresh_interval)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.pool.close_all()
+
+
+class DatabaseManager:
+    # Applied to every new SQLite connection
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+        'cache_size': -16000
+    }
+
+    # Audit log writers and replicas, shared by every manager pointing at the same database
+    _audit_writers = {}
+    _audit_writers_lock = threading.Lock()
+    _replicas = {}
+
+    def __init__(self, db_type='sqlite', db_name='hospital.db', pool_size=5, pool_timeout=30.0,
+                 async_logging=True, log_batch_size=200, log_flush_interval=0.5,
+                 replica_name=None, replica_refresh_interval=5.0, max_staleness=15.0):
+        self.db_type = db_type
+        self.db_name = db_name
+        # Identifies this database in the process-wide metrics cache
+        self.cache_scope = (db_type, db_name)
+        if db_type == 'sqlite':
+            # One connection per active thread; size is not bounded
+            self.pool = ConnectionPool(self._connect_sqlite, timeout=pool_timeout)
+        else:
+            self.pool = ConnectionPool(self._connect_mysql, max_size=pool_size,
+                                       max_idle=pool_size, timeout=pool_timeout)
+        self._audit_chain = None
+        # Read routing: read_connection() uses the replica while it is at
+        # most max_staleness seconds behind and the session has no newer writes
+        self.max_staleness = max_staleness
+        self._session = threading.local()
+        # Shared by every session using this manager, so updated under a lock
+        self.routed_reads = {'replica': 0, 'primary_stale': 0, 'primary_session': 0}
+        self._routed_reads_lock = threading.Lock()
+        self.replica = None
+        self.init_database()
+
+        self.audit_writer = None
+        if async_logging:
+            key = (db_type, db_name)
+            with self._audit_writers_lock:
+                if key not in self._audit_writers:
+                    self._audit_writers[key] = AuditLogWriter(
+                        self.write_log_batch,
+                        batch_size=log_batch_size,
+                        flush_interval=log_flush_interval
+                    )
+                self.audit_writer = self._audit_writers[key]
+
+        if replica_name is not None and db_type == 'sqlite':
+            key = (db_type, db_name, replica_name)
+            with self._audit_writers_lock:
+                if key not in self._replicas:
+                    self._replicas[key] = SQLiteReplica(self, replica_name, replica_refresh_interval)
+                    self._replicas[key].start()
+                self.replica = self._replicas[key]
+    
+    def hash_password(self, password):
+        return hash_password(password)
+
+    def _connect_sqlite(self, pool):
+        conn = sqlite3.connect(self.db_name, factory=PooledSQLiteConnection,
+                               check_same_thread=False, timeout=30)
+        for pragma, value in self.SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        conn.pool = pool
+        return conn
+
+    def _connect_mysql(self, pool):
+        raw = mysql.connector.connect(
+            host="localhost",
+            user="your_username",
+            password="your_password",
+            database=self.db_name
+        )
+        return PooledMySQLConnection(raw, pool)
+
+    @instrumentation.timed('db.checkout')
+    def get_connection(self):
+        """Check out a pooled connection; close() returns it to the pool"""
+        return self.pool.acquire()
+
+    @contextmanager
+    def connection(self):
+        """Pooled primary connection that commits on success and rolls back on error.
+
+        Nested uses on one thread share the outermost checkout's
+        transaction: only the outermost exit commits or rolls back.
+        """
+        conn = self.get_connection()
+        outermost = self.pool.depth() == 1
+        try:
+            yield conn
+            if outermost:
+                conn.commit()
+        except Exception:
+            if outermost:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @contextmanager
+    def read_connection(self, *tables):
+        """Connection for read-only queries of `tables`: the replica when it
+        is fresh enough for the current session, otherwise the primary"""
+        if not self._use_replica(tables):
+            with self.connection() as conn:
+                yield conn
+            return
+        conn = self.replica.pool.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def bind_session(self, session):
+        """Route this thread's reads for `session` (a DatabaseSession)"""
+        self._session.current = session
+
+    def pending_replication(self, *tables):
+        """True while the current session has writes to `tables` (any table
+        when none are given) that the replica may not have yet"""
+        session = getattr(self._session, 'current', None)
+        if self.replica is None or self.replica.synced_at is None or session is None:
+            return False
+        written = [session.writes.get(table) for table in tables] if tables else session.writes.values()
+        return any(t is not None and t >= self.replica.synced_at for t in written)
+
+    def _use_replica(self, tables):
+        if self.replica is None:
+            return False
+        lag = self.replica.lag()
+        if lag is None or lag > self.max_staleness:
+            route = 'primary_stale'
+        elif self.pending_replication(*tables):
+            route = 'primary_session'
+        else:
+            route = 'replica'
+        with self._routed_reads_lock:
+            self.routed_reads[route] += 1
+        return route == 'replica'
+
+    def routed_read_counts(self):
+        """Copy of routed_reads taken under its lock"""
+        with self._routed_reads_lock:
+            return dict(self.routed_reads)
+
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def replica_stats(self):
+        if self.replica is None:
+            return {'enabled': False}
+        return {
+            'enabled': True,
+            'path': self.replica.path,
+            'lag': self.replica.lag(),
+            'max_staleness': self.max_staleness,
+            'refresh_interval': self.replica.refresh_interval,
+            'refreshes': self.replica.refreshes,
+            'last_refresh_time': self.replica.last_refresh_time,
+            'last_error': self.replica.last_error,
+            'routed_reads': self.routed_read_counts(),
+            'pool': self.replica.pool.stats()
+        }
+    
+    def init_database(self):
+        """Bring the schema up to date (a no-op once it is current)"""
+        return MigrationRunner(self).run()
+    
+    def log_activity(self, user_id, role, action, details="", durable=False, subject=None):
+        """Record an audit entry.
+
+        subject is an optional (subject_type, subject_id) pair naming who the
+        entry is about, e.g. ('patient', 42); it is stored in indexed
+        columns for data subject requests. Entries are queued for the
+        background writer; pass durable=True to wait until the entry (and
+        everything queued before it) is committed.
+        """
+        # Timestamp at call time, in the same UTC format as CURRENT_TIMESTAMP
+        timestamp = to_db_timestamp(utc_now())
+        subject_type, subject_id = subject or (None, None)
+        record = (user_id, role, action, details, timestamp, subject_type, subject_id)
+        if self.audit_writer is None:
+            self.write_log_batch([record])
+        else:
+            self.audit_writer.submit(record, wait=durable)
+
+    def write_log_batch(self, records):
+        """Insert log records in one transaction.
+
+        Records are (user_id, role, action, details, timestamp, subject_type,
+        subject_id) tuples. Each batch is sealed onto the audit hash chain.
+        """
+        with self.connection() as conn:
+            if self.db_type == 'sqlite' and not conn.in_transaction:
+                # Take the write lock before reading the chain head, so no
+                # other writer can extend the chain in between
+                conn.execute("BEGIN IMMEDIATE")
+            rows = self.audit_chain.seal(conn, records)
+            conn.cursor().executemany(
+                f"INSERT INTO logs ({', '.join(LOG_COLUMNS)}) VALUES ({', '.join('?' * len(LOG_COLUMNS))})",
+                rows
+            )
+            # Keep the activity rollups and the search index in step, in the same transaction
+            ActivityRollups(self).apply(conn, [(r[1], r[2], r[4]) for r in records])
+            LogSearch(self).add(conn, LOG_COLUMNS, rows)
+        self.notify_write('logs')
+
+    @property
+    def audit_chain(self):
+        if self._audit_chain is None:
+            # Imported here: audit_chain builds on this module
+            from audit_chain import AuditChain
+            self._audit_chain = AuditChain(self)
+        return self._audit_chain
+
+    def logs_deleted(self, conn, columns, rows):
+        """Correct derived data for log rows deleted in the caller's transaction"""
+        role, action, timestamp = (columns.index(c) for c in ('role', 'action', 'timestamp'))
+        ActivityRollups(self).apply(conn, [(r[role], r[action], r[timestamp]) for r in rows], sign=-1)
+        LogSearch(self).remove(conn, columns, rows)
+        self.audit_chain.anchor_deleted(conn, columns, rows)
+
+    def logs_rewritten(self, conn, columns, rows):
+        """Record log rows whose fields were redacted in the caller's transaction"""
+        LogSearch(self).update(conn, columns, rows)
+        self.audit_chain.redact(conn, columns, rows)
+
+    def notify_write(self, *tables):
+        """Invalidate cached metrics that depend on these tables and route
+        the current session's reads of them to the primary for now"""
+        metrics_cache.bump(self.cache_scope, *tables)
+        session = getattr(self._session, 'current', None)
+        if session is not None:
+            now = time.monotonic()
+            for table in tables:
+                session.writes[table] = now
+
+    def get_checkpoint(self, job):
+        """Last key processed by a resumable bulk job, or None"""
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT last_key FROM job_checkpoints WHERE job = ?", (job,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_checkpoint(self, conn, job, last_key):
+        """Record progress inside the caller's transaction"""
+        conn.execute(
+            "INSERT OR REPLACE INTO job_checkpoints (job, last_key, updated_at) "
+            "VALUES (?, ?, CURRENT_TIMESTAMP)",
+            (job, last_key)
+        )
+
+    def clear_checkpoint(self, job):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM job_checkpoints WHERE job = ?", (job,))
+
+    def flush_logs(self, timeout=None):
+        """Wait until all queued audit entries are committed"""
+        if self.audit_writer is not None:
+            self.audit_writer.flush(timeout)
+
+    def enforce_data_retention(self, retention_days=30, archive=False):
+        """Remove log records older than retention period, in small batches.
+
+        With archive=True the removed records are also written to the
+        retention archive first.
+        """
+        from retention import RetentionEngine, RetentionPolicy
+        policy = RetentionPolicy('logs', retention_days, 'timestamp', 'log_id', archive=archive)
+        return RetentionEngine(self).enforce(policy)['deleted']
\ No newline at end of file
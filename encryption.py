@@ -1,66 +1,405 @@
-import hashlib
-from cryptography.fernet import Fernet
-import streamlit as st
-
-class DataProtection:
-    def __init__(self):
-        # In production, store this key securely
-        self.key = Fernet.generate_key()
-        self.fernet = Fernet(self.key)
-        try:
-            with open('encryption_key.key', 'rb') as key_file:
-                self.key = key_file.read()
-        except FileNotFoundError:
-            self.key = Fernet.generate_key()
-            with open('encryption_key.key', 'wb') as key_file:
-                key_file.write(self.key)
-        
-        self.fernet = Fernet(self.key)
-    
-    def anonymize_name(self, name, patient_id):
-        return f"ANON_{patient_id:04d}"
-    
-    def anonymize_contact(self, contact):
-        if len(contact) >= 4:
-            return "XXX-XXX-" + contact[-4:]
-        return "XXX-XXX-XXXX"
-    
-    def encrypt_data(self, data):
-        """Encrypt data for reversible anonymization"""
-        if data is None:
-            return None
-        return self.fernet.encrypt(data.encode()).decode()
-    
-    def decrypt_data(self, encrypted_data):
-        """Decrypt data for authorized access"""
-        if encrypted_data is None:
-            return None
-        try:
-            return self.fernet.decrypt(encrypted_data.encode()).decode()
-        except:
-            return "Decryption failed"
-    
-    def apply_reversible_anonymization(self, patient_data):
-        """Apply reversible encryption instead of permanent masking"""
-        anonymized_data = patient_data.copy()
-        
-        # Store original data encrypted
-        anonymized_data['encrypted_name'] = self.encrypt_data(patient_data['name'])
-        anonymized_data['encrypted_contact'] = self.encrypt_data(patient_data['contact'])
-        
-        # Also apply regular anonymization for display
-        anonymized_data['anonymized_name'] = self.anonymize_name(patient_data['name'], patient_data['patient_id'])
-        anonymized_data['anonymized_contact'] = self.anonymize_contact(patient_data['contact'])
-        
-        return anonymized_data
-    
-    def reveal_original_data(self, patient_data):
-        """Decrypt and reveal original data (admin only)"""
-        revealed_data = patient_data.copy()
-        
-        if 'encrypted_name' in patient_data and patient_data['encrypted_name']:
-            revealed_data['original_name'] = self.decrypt_data(patient_data['encrypted_name'])
-        if 'encrypted_contact' in patient_data and patient_data['encrypted_contact']:
-            revealed_data['original_contact'] = self.decrypt_data(patient_data['encrypted_contact'])
-        
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import re
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from instrumentation import instrumentation
+
+
+class BatchResult:
+    """Output of a batch crypto call.
+
+    values holds one entry per input (None where the input was None or the
+    operation failed); errors maps the index of each failed input to the
+    reason it failed.
+    """
+    def __init__(self, values, errors):
+        self.values = values
+        self.errors = errors
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def __len__(self):
+        return len(self.values)
+
+
+class KeyRing:
+    """Fernet keys by key id: one primary key plus retired keys.
+
+    New ciphertexts are encrypted with the primary key and stored as
+    "<key id>:<Fernet token>", so decryption goes straight to the right
+    key. Untagged tokens written before key rotation existed are tried
+    against every key through MultiFernet. Retired keys stay readable until
+    a rotation job has re-encrypted everything they protect.
+    """
+    def __init__(self, keys, primary_id):
+        # keys: {key_id: key bytes}
+        self.keys = dict(keys)
+        self.primary_id = primary_id
+        self.fernets = {key_id: Fernet(key) for key_id, key in self.keys.items()}
+        self.primary = self.fernets[primary_id]
+        self.multi = MultiFernet([self.primary] + [f for key_id, f in self.fernets.items()
+                                                   if key_id != primary_id])
+
+    @staticmethod
+    def key_id(key):
+        """Short, stable identifier of a key (not secret-bearing)"""
+        return hashlib.sha256(key).hexdigest()[:8]
+
+    @staticmethod
+    def split(value):
+        """(key id or None, token) of a stored ciphertext"""
+        key_id, sep, token = value.partition(':')
+        return (key_id, token) if sep else (None, value)
+
+    def encrypt(self, text):
+        return f"{self.primary_id}:{self.primary.encrypt(text.encode()).decode()}"
+
+    def decrypt(self, value):
+        key_id, token = self.split(value)
+        if key_id is None:
+            return self.multi.decrypt(token.encode()).decode()
+        if key_id not in self.fernets:
+            raise InvalidToken(f"unknown key id {key_id}")
+        return self.fernets[key_id].decrypt(token.encode()).decode()
+
+    def rotate(self, value):
+        """Re-encrypt a ciphertext under the primary key (unchanged if already there)"""
+        key_id, token = self.split(value)
+        if key_id == self.primary_id:
+            return value
+        if key_id is not None and key_id not in self.fernets:
+            raise InvalidToken(f"unknown key id {key_id}")
+        # MultiFernet.rotate tries the primary first, then the retired keys
+        return f"{self.primary_id}:{self.multi.rotate(token.encode()).decode()}"
+
+    def apply(self, op, values):
+        """Run encrypt/decrypt/rotate over values; returns (values, {index: error})"""
+        method = getattr(self, op)
+        out = []
+        errors = {}
+        for i, value in enumerate(values):
+            if value is None:
+                out.append(None)
+                continue
+            try:
+                out.append(method(value))
+            except Exception as e:
+                out.append(None)
+                errors[i] = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        return out, errors
+
+
+# Loaded key rings by path, reused while the file is unchanged
+_key_rings = {}
+
+
+def _write_key_ring(path, keys, primary_id):
+    document = {
+        'primary': primary_id,
+        'keys': [
+            {'id': key_id, 'key': key.decode(), 'added_at': added_at}
+            for key_id, (key, added_at) in keys.items()
+        ]
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(document, f, indent=2)
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, path)
+
+
+def load_key_ring(path, legacy_key_file=None):
+    """KeyRing stored in `path`, created from the single legacy key file if missing"""
+    if not os.path.exists(path):
+        try:
+            with open(legacy_key_file, 'rb') as f:
+                key = f.read().strip()
+        except (TypeError, FileNotFoundError):
+            key = Fernet.generate_key()
+        added_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        _write_key_ring(path, {KeyRing.key_id(key): (key, added_at)}, KeyRing.key_id(key))
+
+    mtime = os.stat(path).st_mtime_ns
+    cached = _key_rings.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path) as f:
+        document = json.load(f)
+    ring = KeyRing({entry['id']: entry['key'].encode() for entry in document['keys']}, document['primary'])
+    _key_rings[path] = (mtime, ring)
+    return ring
+
+
+def rotate_key_ring(path, legacy_key_file=None):
+    """Add a new primary key; the old primary becomes a retired key"""
+    load_key_ring(path, legacy_key_file)
+    with open(path) as f:
+        entries = {entry['id']: (entry['key'].encode(), entry['added_at'])
+                   for entry in json.load(f)['keys']}
+    key = Fernet.generate_key()
+    key_id = KeyRing.key_id(key)
+    entries[key_id] = (key, datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+    _write_key_ring(path, entries, key_id)
+    return load_key_ring(path)
+
+
+def remove_retired_keys(path, key_ids):
+    """Drop retired keys once nothing is encrypted with them any more"""
+    ring = load_key_ring(path)
+    if ring.primary_id in key_ids:
+        raise ValueError("The primary key cannot be removed")
+    with open(path) as f:
+        entries = {entry['id']: (entry['key'].encode(), entry['added_at'])
+                   for entry in json.load(f)['keys'] if entry['id'] not in key_ids}
+    _write_key_ring(path, entries, ring.primary_id)
+    return load_key_ring(path)
+
+
+# Process pool worker state; each worker builds its ciphers once
+_worker_ring = None
+
+
+def _init_worker(keys, primary_id):
+    global _worker_ring
+    _worker_ring = KeyRing(keys, primary_id)
+
+
+def _worker_apply(values, op):
+    return _worker_ring.apply(op, values)
+
+
+class DataProtection:
+    # Batches smaller than this are processed in-process; process start-up
+    # and pickling cost more than they save on small inputs
+    parallel_threshold = 50000
+    parallel_chunk_size = 10000
+    # Smallest slice sent to a long-lived worker pool (see worker_pool)
+    min_parallel_chunk = 1000
+    # The single-key file the key ring is created from on first start
+    key_file = 'encryption_key.key'
+    key_ring_file = 'encryption_keys.json'
+    index_key_file = 'blind_index.key'
+    # Seconds between checks for a key ring rotated by another process
+    ring_refresh_interval = 1.0
+
+    def __init__(self):
+        # In production, store these keys securely. Key rings are cached
+        # per file, so constructing DataProtection is cheap.
+        self._ring = load_key_ring(self.key_ring_file, self.key_file)
+        self._ring_checked = time.monotonic()
+        self.index_key = self._load_index_key()
+    
+    @property
+    def ring(self):
+        now = time.monotonic()
+        if now - self._ring_checked > self.ring_refresh_interval:
+            self._ring_checked = now
+            self._ring = load_key_ring(self.key_ring_file, self.key_file)
+        return self._ring
+    
+    @property
+    def primary_key_id(self):
+        return self.ring.primary_id
+    
+    def rotate_key(self):
+        """Make a new key primary; returns (new key id, retired key ids)"""
+        self._ring = rotate_key_ring(self.key_ring_file, self.key_file)
+        self._ring_checked = time.monotonic()
+        return self._ring.primary_id, [k for k in self._ring.keys if k != self._ring.primary_id]
+    
+    def remove_retired_keys(self, key_ids):
+        self._ring = remove_retired_keys(self.key_ring_file, key_ids)
+        self._ring_checked = time.monotonic()
+    
+    def _load_index_key(self):
+        # Separate from the Fernet key so ciphertexts and blind indexes can
+        # be rotated independently
+        try:
+            with open(self.index_key_file, 'rb') as key_file:
+                return key_file.read()
+        except FileNotFoundError:
+            key = os.urandom(32)
+            with open(self.index_key_file, 'wb') as key_file:
+                key_file.write(key)
+            return key
+    
+    @staticmethod
+    def normalize_name(name):
+        """Unicode-normalized, case-folded name with collapsed whitespace"""
+        return " ".join(unicodedata.normalize('NFKC', name).casefold().split())
+    
+    @staticmethod
+    def normalize_contact(contact):
+        """Digits only, so formatting differences do not matter"""
+        return re.sub(r'\D', '', unicodedata.normalize('NFKC', contact))
+    
+    def blind_index(self, value, kind):
+        """Keyed HMAC of a normalized name or contact for exact-match lookups.
+
+        kind is 'name' or 'contact' and is mixed into the MAC, so equal
+        values of different kinds do not share an index entry.
+        """
+        if value is None:
+            return None
+        normalized = self.normalize_name(value) if kind == 'name' else self.normalize_contact(value)
+        if not normalized:
+            return None
+        message = f"{kind}\0{normalized}".encode()
+        return hmac.new(self.index_key, message, hashlib.sha256).hexdigest()[:32]
+    
+    def anonymize_name(self, name, patient_id):
+        return f"ANON_{patient_id:04d}"
+    
+    def anonymize_contact(self, contact):
+        if len(contact) >= 4:
+            return "XXX-XXX-" + contact[-4:]
+        return "XXX-XXX-XXXX"
+    
+    def derived_many(self, patients):
+        """(anonymized_name, anonymized_contact, name_bidx, contact_bidx) for
+        each (patient_id, name, contact), computed for a whole chunk at once"""
+        anonymize_name = self.anonymize_name
+        anonymize_contact = self.anonymize_contact
+        blind_index = self.blind_index
+        return [
+            (anonymize_name(name, patient_id), anonymize_contact(contact),
+             blind_index(name, 'name'), blind_index(contact, 'contact'))
+            for patient_id, name, contact in patients
+        ]
+    
+    @instrumentation.timed('crypto.encrypt')
+    def encrypt_data(self, data):
+        """Encrypt data for reversible anonymization"""
+        if data is None:
+            return None
+        return self.ring.encrypt(data)
+    
+    @instrumentation.timed('crypto.decrypt')
+    def decrypt_data(self, encrypted_data):
+        """Decrypt data for authorized access"""
+        if encrypted_data is None:
+            return None
+        try:
+            return self.ring.decrypt(encrypted_data)
+        except:
+            return "Decryption failed"
+    
+    @contextmanager
+    def worker_pool(self, max_workers=None):
+        """Process pool to pass as pool= to the *_many methods across many calls.
+
+        Yields None when only one worker would run. Worker start-up (spawn,
+        imports, building the ciphers) is paid once per pool instead of once
+        per call, so batch jobs should open one for the whole run.
+        """
+        workers = max_workers or os.cpu_count() or 1
+        if workers < 2:
+            yield None
+            return
+        ring = self.ring
+        # spawn rather than fork: the app process runs background threads
+        pool = ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker,
+                                   initargs=(ring.keys, ring.primary_id))
+        pool.workers = workers
+        # Workers encrypt under this key; a rotated ring falls back to in-process
+        pool.primary_id = ring.primary_id
+        try:
+            yield pool
+        finally:
+            pool.shutdown()
+
+    @instrumentation.timed('crypto.encrypt_many')
+    def encrypt_many(self, values, max_workers=None, pool=None):
+        """Encrypt a sequence of strings; returns a BatchResult"""
+        return self._apply_many(list(values), 'encrypt', max_workers, pool)
+
+    @instrumentation.timed('crypto.decrypt_many')
+    def decrypt_many(self, values, max_workers=None, pool=None):
+        """Decrypt a sequence of tokens; failures are reported in BatchResult.errors"""
+        return self._apply_many(list(values), 'decrypt', max_workers, pool)
+
+    @instrumentation.timed('crypto.rotate_many')
+    def rotate_many(self, values, max_workers=None, pool=None):
+        """Re-encrypt tokens under the primary key without exposing the plaintext"""
+        return self._apply_many(list(values), 'rotate', max_workers, pool)
+
+    def encrypt_column(self, df, column, target=None, max_workers=None):
+        """Return (copy of df with encrypted `column` in `target`, errors)"""
+        result = self.encrypt_many(self._column_values(df, column), max_workers)
+        out = df.copy()
+        out[target or f"encrypted_{column}"] = result.values
+        return out, result.errors
+
+    def decrypt_column(self, df, column, target=None, max_workers=None):
+        """Return (copy of df with decrypted `column` in `target`, errors)"""
+        result = self.decrypt_many(self._column_values(df, column), max_workers)
+        out = df.copy()
+        out[target or column.replace("encrypted_", "original_", 1)] = result.values
+        return out, result.errors
+
+    def _column_values(self, df, column):
+        # NaN/NA become None so they pass through untouched
+        return [value if isinstance(value, str) else None for value in df[column].tolist()]
+
+    def _apply_many(self, values, op, max_workers, pool=None):
+        ring = self.ring
+        if pool is not None:
+            # The caller already paid for the pool, so any batch worth
+            # splitting goes to it, as long as it still has the current keys
+            if pool.primary_id != ring.primary_id or len(values) < 2 * self.min_parallel_chunk:
+                return BatchResult(*ring.apply(op, values))
+            size = max(self.min_parallel_chunk, min(self.parallel_chunk_size, -(-len(values) // pool.workers)))
+            return self._map(pool, values, op, size)
+
+        workers = max_workers or os.cpu_count() or 1
+        if len(values) < self.parallel_threshold or workers < 2:
+            return BatchResult(*ring.apply(op, values))
+        with self.worker_pool(workers) as pool:
+            return self._map(pool, values, op, self.parallel_chunk_size)
+
+    def _map(self, pool, values, op, size):
+        chunks = [values[i:i + size] for i in range(0, len(values), size)]
+        out = []
+        errors = {}
+        results = pool.map(_worker_apply, chunks, [op] * len(chunks))
+        for offset, (chunk_out, chunk_errors) in zip(range(0, len(values), size), results):
+            out.extend(chunk_out)
+            errors.update({offset + i: message for i, message in chunk_errors.items()})
+        return BatchResult(out, errors)
+    
+    def apply_reversible_anonymization(self, patient_data):
+        """Apply reversible encryption instead of permanent masking"""
+        anonymized_data = patient_data.copy()
+        
+        # Store original data encrypted
+        anonymized_data['encrypted_name'] = self.encrypt_data(patient_data['name'])
+        anonymized_data['encrypted_contact'] = self.encrypt_data(patient_data['contact'])
+        
+        # Also apply regular anonymization for display
+        anonymized_data['anonymized_name'] = self.anonymize_name(patient_data['name'], patient_data['patient_id'])
+        anonymized_data['anonymized_contact'] = self.anonymize_contact(patient_data['contact'])
+        
+        return anonymized_data
+    
+    def reveal_original_data(self, patient_data):
+        """Decrypt and reveal original data (admin only)"""
+        revealed_data = patient_data.copy()
+        
+        if 'encrypted_name' in patient_data and patient_data['encrypted_name']:
+            revealed_data['original_name'] = self.decrypt_data(patient_data['encrypted_name'])
+        if 'encrypted_contact' in patient_data and patient_data['encrypted_contact']:
+            revealed_data['original_contact'] = self.decrypt_data(patient_data['encrypted_contact'])
+        
         return revealed_data
\ No newline at end of file
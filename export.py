@@ -0,0 +1,143 @@
+import csv
+import gzip
+import os
+import tempfile
+import time
+from log_partitions import LogStore
+
+
+FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'csv.gz': ('.csv.gz', 'application/gzip'),
+    'parquet': ('.parquet', 'application/octet-stream'),
+}
+
+
+def open_download(path):
+    """Open a finished export for st.download_button and remove its temp file.
+
+    The handle keeps the data readable until it is closed, so nothing is
+    read into memory before the download is requested. Where open files
+    cannot be removed (Windows) close_download() removes it instead.
+    """
+    handle = open(path, 'rb')
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return handle
+
+
+def close_download(handle):
+    """Close a handle from open_download() and remove its file if still there"""
+    handle.close()
+    try:
+        os.remove(handle.name)
+    except OSError:
+        pass
+
+
+class StreamingExporter:
+    """Exports a table in fixed-size chunks read from a streaming cursor.
+
+    Only one chunk of rows is held in memory at a time, whatever the size
+    of the table. Filters: start/end (timestamp range, end exclusive) and
+    user_id. The logs table is read through LogStore, so compacted months
+    in the requested range are included. Reads go to the read replica when
+    one is configured.
+    """
+    def __init__(self, db_manager, table='logs', timestamp_column='timestamp',
+                 key_column='log_id', chunk_size=5000):
+        self.db = db_manager
+        self.table = table
+        self.timestamp_column = timestamp_column
+        self.key_column = key_column
+        self.chunk_size = chunk_size
+
+    def _query(self, start=None, end=None, user_id=None):
+        clauses = []
+        params = []
+        if start:
+            clauses.append(f"{self.timestamp_column} >= ?")
+            params.append(str(start))
+        if end:
+            clauses.append(f"{self.timestamp_column} < ?")
+            params.append(str(end))
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return f"SELECT * FROM {self.table} {where} ORDER BY {self.key_column}", params
+
+    def columns(self):
+        """Column names of the exported table"""
+        with self.db.read_connection(self.table) as conn:
+            return [d[0] for d in conn.execute(f"SELECT * FROM {self.table} LIMIT 0").description]
+
+    def iter_chunks(self, start=None, end=None, user_id=None):
+        """Yield (columns, rows) one chunk at a time"""
+        if self.table == 'logs':
+            yield from LogStore(self.db, read_replica=True).iter_rows(start, end, user_id, chunk_size=self.chunk_size)
+            return
+        sql, params = self._query(start, end, user_id)
+        with self.db.read_connection(self.table) as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            columns = [d[0] for d in cursor.description]
+            while True:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                yield columns, rows
+
+    def export(self, fmt='csv', path=None, start=None, end=None, user_id=None):
+        """Write the export to `path` (a temp file by default); returns stats"""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        suffix, mime = FORMATS[fmt]
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix=f"{self.table}_export_", suffix=suffix)
+            os.close(fd)
+
+        started = time.perf_counter()
+        if fmt == 'parquet':
+            rows = self._write_parquet(path, start, end, user_id)
+        else:
+            opener = gzip.open if fmt == 'csv.gz' else open
+            rows = 0
+            with opener(path, 'wt', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                # The header goes first, so an export without rows is still a valid CSV
+                writer.writerow(self.columns())
+                for _, chunk in self.iter_chunks(start, end, user_id):
+                    writer.writerows(chunk)
+                    rows += len(chunk)
+
+        elapsed = time.perf_counter() - started
+        size = os.path.getsize(path)
+        return {
+            'path': path,
+            'format': fmt,
+            'mime': mime,
+            'rows': rows,
+            'bytes': size,
+            'elapsed': elapsed,
+            'rows_per_sec': rows / elapsed if elapsed else 0.0,
+            'bytes_per_sec': size / elapsed if elapsed else 0.0
+        }
+
+    def _write_parquet(self, path, start, end, user_id):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Everything as strings keeps the schema stable across chunks. The
+        # writer is opened up front, so an export without rows still has it
+        schema = pa.schema([(c, pa.string()) for c in self.columns()])
+        rows = 0
+        with pq.ParquetWriter(path, schema, compression='snappy') as writer:
+            for columns, chunk in self.iter_chunks(start, end, user_id):
+                data = {c: [None if r[i] is None else str(r[i]) for r in chunk]
+                        for i, c in enumerate(columns)}
+                writer.write_table(pa.table(data, schema=schema))
+                rows += len(chunk)
+        return rows
\ No newline at end of file
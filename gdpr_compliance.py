@@ -1,68 +1,178 @@
-import streamlit as st
-from datetime import datetime
-
-class GDPRCompliance:
-    def __init__(self, db_manager):
-        self.db = db_manager
-    
-    def show_consent_banner(self):
-        """Display GDPR consent banner for new users"""
-        if 'gdpr_consent' not in st.session_state:
-            st.session_state.gdpr_consent = False
-        
-        if not st.session_state.gdpr_consent:
-            with st.container():
-                st.markdown("""
-                <div style="background-color: #f0f2f6; padding: 20px; border-radius: 10px; border-left: 5px solid #ff4b4b;">
-                    <h3>🔒 GDPR Compliance Notice</h3>
-                    <p>This system processes personal data in compliance with GDPR regulations.</p>
-                    <p>By using this system, you acknowledge that:</p>
-                    <ul>
-                        <li>Personal data is processed lawfully and transparently</li>
-                        <li>Data minimization principles are applied</li>
-                        <li>Appropriate security measures are in place</li>
-                        <li>Your activities are logged for security purposes</li>
-                    </ul>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("I Understand & Consent", type="primary"):
-                        st.session_state.gdpr_consent = True
-                        if 'user' in st.session_state:
-                            self.db.log_activity(
-                                st.session_state.user['user_id'],
-                                st.session_state.user['role'],
-                                "gdpr_consent",
-                                "User accepted GDPR consent"
-                            )
-                        st.rerun()
-                with col2:
-                    if st.button("Learn More"):
-                        st.info("Contact the Data Protection Officer for more information.")
-    
-    def data_retention_management(self, user):
-        """Admin interface for data retention management"""
-        if user['role'] == 'admin':
-            st.subheader("GDPR Data Retention Management")
-            
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                retention_days = st.slider("Data Retention Period (days)", 
-                                         min_value=7, max_value=365, value=30)
-                
-                if st.button("Apply Retention Policy"):
-                    deleted_count = self.db.enforce_data_retention(retention_days)
-                    st.success(f"Deleted {deleted_count} records older than {retention_days} days")
-            
-            with col2:
-                st.info("""
-                **GDPR Compliance Features:**
-                - Right to be forgotten
-                - Data minimization
-                - Purpose limitation
-                - Storage limitation
-                - Integrity and confidentiality
-                """)
\ No newline at end of file
+import streamlit as st
+from datetime import datetime
+from retention import RetentionEngine, default_policies
+from data_subject import DataSubjectService, SubjectRequestError, SUBJECT_TYPES, MODES
+from export import open_download, close_download
+
+class GDPRCompliance:
+    def __init__(self, db_manager):
+        self.db = db_manager
+    
+    def show_consent_banner(self):
+        """Display GDPR consent banner for new users"""
+        if 'gdpr_consent' not in st.session_state:
+            st.session_state.gdpr_consent = False
+        
+        if not st.session_state.gdpr_consent:
+            with st.container():
+                st.markdown("""
+                <div style="background-color: #f0f2f6; padding: 20px; border-radius: 10px; border-left: 5px solid #ff4b4b;">
+                    <h3>🔒 GDPR Compliance Notice</h3>
+                    <p>This system processes personal data in compliance with GDPR regulations.</p>
+                    <p>By using this system, you acknowledge that:</p>
+                    <ul>
+                        <li>Personal data is processed lawfully and transparently</li>
+                        <li>Data minimization principles are applied</li>
+                        <li>Appropriate security measures are in place</li>
+                        <li>Your activities are logged for security purposes</li>
+                    </ul>
+                </div>
+                """, unsafe_allow_html=True)
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("I Understand & Consent", type="primary"):
+                        st.session_state.gdpr_consent = True
+                        if 'user' in st.session_state:
+                            self.db.log_activity(
+                                st.session_state.user['user_id'],
+                                st.session_state.user['role'],
+                                "gdpr_consent",
+                                "User accepted GDPR consent"
+                            )
+                        st.rerun()
+                with col2:
+                    if st.button("Learn More"):
+                        st.info("Contact the Data Protection Officer for more information.")
+    
+    def data_retention_management(self, user):
+        """Admin interface for data retention management"""
+        if user['role'] == 'admin':
+            st.subheader("GDPR Data Retention Management")
+            
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                retention_days = st.slider("Data Retention Period (days)", 
+                                         min_value=7, max_value=365, value=30)
+                
+                include_patients = st.checkbox("Also apply to patient records")
+                patient_days = st.number_input("Patient Record Retention (days)",
+                                               min_value=30, max_value=36500, value=3650,
+                                               disabled=not include_patients)
+                archive = st.checkbox("Archive expired log records before deleting", value=True)
+                compact = st.checkbox("Compact closed months of the audit log", value=True,
+                                      help="Moves each finished month into a compressed, read-only "
+                                           "segment that is dropped as a whole once it expires")
+                
+                if st.button("Apply Retention Policy"):
+                    policies = default_policies(retention_days, patient_days if include_patients else None)
+                    policies[0].archive = archive
+                    # Runs on a background thread in small batches so the
+                    # page (and other users' log writes) are not blocked
+                    engine = RetentionEngine(self.db, compact_logs=compact)
+                    engine.start_background(policies)
+                    st.session_state.retention_job = engine
+                
+                engine = st.session_state.get('retention_job')
+                if engine is not None:
+                    if engine.running:
+                        st.info("Retention job running...")
+                        if st.button("Refresh Status"):
+                            st.rerun()
+                    for report in engine.reports:
+                        st.success(f"Deleted {report['deleted']} {report['table']} records older than "
+                                   f"{report['retention_days']} days ({report['archived']} archived)")
+                        if report.get('partitions_dropped'):
+                            st.info(f"Dropped {report['partitions_dropped']} expired log partitions")
+                        if report.get('compacted'):
+                            st.info(f"Compacted log months: {', '.join(report['compacted'])}")
+            
+            with col2:
+                st.info("""
+                **GDPR Compliance Features:**
+                - Right to be forgotten
+                - Data minimization
+                - Purpose limitation
+                - Storage limitation
+                - Integrity and confidentiality
+                """)
+    
+    def data_subject_requests(self, user, data_protection):
+        """Admin interface for right of access and right to erasure requests"""
+        if user['role'] != 'admin':
+            return
+        
+        st.subheader("Data Subject Requests")
+        col1, col2 = st.columns(2)
+        with col1:
+            subject_type = st.selectbox("Subject type", SUBJECT_TYPES, key="dsr_type")
+        with col2:
+            subject_id = int(st.number_input("Subject ID", min_value=1, step=1, key="dsr_id"))
+        
+        service = DataSubjectService(self.db, data_protection)
+        # locate() flushes the audit log and scans the subject's entries, so
+        # it runs on request and its result is kept for this subject
+        subject = (subject_type, subject_id)
+        if st.button("Look Up Subject", key="dsr_lookup"):
+            st.session_state.dsr_located = (subject, service.locate(subject_type, subject_id))
+        cached = st.session_state.get('dsr_located')
+        if cached is None or cached[0] != subject:
+            st.caption("Look up the subject to see the data held about them.")
+            return
+        located = cached[1]
+        if not located['record'] and not located['logs']:
+            st.info(f"No data held for {subject_type} {subject_id}")
+            return
+        st.write(
+            f"Record: {'found' if located['record'] else 'not found'} · "
+            f"{located['logs']} log entries"
+            + (f" ({located['first_log']} to {located['last_log']})" if located['logs'] else "")
+        )
+        
+        if st.button("Export Subject Data (Right to Access)"):
+            try:
+                stats = service.export_bundle(subject_type, subject_id)
+            except SubjectRequestError as e:
+                st.error(str(e))
+                return
+            previous = st.session_state.pop('dsr_file', None)
+            if previous is not None:
+                close_download(previous)
+            handle = st.session_state.dsr_file = open_download(stats['path'])
+            self.db.log_activity(
+                user['user_id'], user['role'], "subject_access_export",
+                f"Exported data for {subject_type} ID {subject_id} ({stats['logs']} log entries)",
+                subject=(subject_type, subject_id)
+            )
+            st.download_button(
+                label="Download Bundle",
+                data=lambda: handle,
+                file_name=f"{subject_type}_{subject_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                mime="application/zip",
+                on_click="ignore",
+                key="dsr_download"
+            )
+        
+        mode = st.radio("Erasure mode", MODES, horizontal=True, key="dsr_mode",
+                        help="pseudonymize keeps the record under its ID without personal data; "
+                             "erase deletes it")
+        confirm = st.checkbox(f"Confirm {mode} of {subject_type} {subject_id}", key="dsr_confirm")
+        if st.button("Process Erasure Request (Right to be Forgotten)", disabled=not confirm):
+            progress_text = st.empty()
+            
+            def show_progress(report):
+                progress_text.write(f"{report['logs_updated']} log entries processed")
+            
+            try:
+                report = service.erase(subject_type, subject_id, mode=mode,
+                                       requested_by=user, progress=show_progress)
+            except SubjectRequestError as e:
+                st.error(str(e))
+                return
+            # What was found before the request no longer holds
+            st.session_state.pop('dsr_located', None)
+            st.success(f"{mode.capitalize()} complete: {report['record_updated']} records, "
+                       f"{report['logs_updated']} log entries and {report['archive_entries']} archived "
+                       f"entries processed in {report['elapsed']:.2f}s")
+            st.json(report)
\ No newline at end of file
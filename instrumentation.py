@@ -0,0 +1,214 @@
+import bisect
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds of the histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000, 100000]
+
+
+class Histogram:
+    """Fixed-bucket histogram; percentiles are estimated from bucket bounds"""
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'buckets': {
+                (f"<={bound}" if i < len(self.bounds) else f">{self.bounds[-1]}"): n
+                for i, (bound, n) in enumerate(zip(self.bounds + [None], self.counts)) if n
+            }
+        }
+
+
+class Instrumentation:
+    """Process-wide latency and query counters for the app's hot paths.
+
+    Timings are kept per operation name in millisecond histograms. While a
+    page function runs, queries and rows fetched on that thread are
+    attributed to the page. When disabled, instrumented calls cost a
+    single attribute check.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.time()
+        self._timings = {}
+        self._pages = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, name, seconds):
+        with self._lock:
+            histogram = self._timings.get(name)
+            if histogram is None:
+                histogram = self._timings[name] = Histogram(LATENCY_BUCKETS_MS)
+            histogram.record(seconds * 1000)
+
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def timed(self, name):
+        """Decorator recording each call's latency under `name`"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def page(self, fn):
+        """Decorator for page functions: latency, queries and rows per render"""
+        name = fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not self.enabled or getattr(self._local, 'page', None) is not None:
+                return fn(*args, **kwargs)
+            context = self._local.page = {'queries': 0, 'rows': 0}
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                self._local.page = None
+                self.record(f"page.{name}", elapsed)
+                with self._lock:
+                    stats = self._pages.get(name)
+                    if stats is None:
+                        stats = self._pages[name] = {
+                            'renders': 0,
+                            'queries': Histogram(COUNT_BUCKETS),
+                            'rows': Histogram(COUNT_BUCKETS)
+                        }
+                    stats['renders'] += 1
+                    stats['queries'].record(context['queries'])
+                    stats['rows'].record(context['rows'])
+        return wrapper
+
+    def count_query(self, seconds):
+        self.record('db.query', seconds)
+        context = getattr(self._local, 'page', None)
+        if context is not None:
+            context['queries'] += 1
+
+    def count_rows(self, n):
+        context = getattr(self._local, 'page', None)
+        if context is not None:
+            context['rows'] += n
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._pages.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'since': self.started,
+                'taken': time.time(),
+                'timings_ms': {name: h.snapshot() for name, h in sorted(self._timings.items())},
+                'pages': {
+                    name: {
+                        'renders': stats['renders'],
+                        'queries': stats['queries'].snapshot(),
+                        'rows': stats['rows'].snapshot()
+                    }
+                    for name, stats in sorted(self._pages.items())
+                }
+            }
+
+    def export_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports query latency and fetched rows"""
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            instrumentation.count_query(time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            instrumentation.count_query(time.perf_counter() - started)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            instrumentation.count_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        instrumentation.count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        instrumentation.count_rows(len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        instrumentation.count_rows(1)
+        return row
+
+
+# Off unless HMS_INSTRUMENTATION=1; admins can toggle it on the Performance page
+instrumentation = Instrumentation(enabled=os.environ.get('HMS_INSTRUMENTATION') == '1')
\ No newline at end of file
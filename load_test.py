@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import DatabaseManager, DatabaseSession
+from cache import metrics_cache
+from auth import Authentication
+from encryption import DataProtection
+from analytics import ActivityAggregator, DashboardMetrics
+from log_partitions import LogStore
+from patients import PatientQueryService, ANONYMIZED_COLUMNS, add_patient, update_diagnosis
+from benchmark import generate_synthetic_data, git_revision, DIAGNOSES, FIRST_NAMES, LAST_NAMES
+
+
+# Default accounts created by the first migration
+CREDENTIALS = {
+    'admin': ('admin', 'admin123'),
+    'doctor': ('dr_bob', 'doc123'),
+    'receptionist': ('alice_recep', 'rec123'),
+}
+# (operation, weight) per role, following the pages each role uses
+WORKFLOWS = {
+    'admin': [('show_dashboard', 3), ('audit_logs', 1)],
+    'doctor': [('view_patients', 1)],
+    'receptionist': [('add_patient', 1), ('edit_patient', 1)],
+}
+DEFAULT_MIX = {'admin': 1, 'doctor': 3, 'receptionist': 2}
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) of a sorted list, nearest rank"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))]
+
+
+def is_locked_error(error):
+    return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+
+class OperationStats:
+    """Latencies and failures of one operation during one stage"""
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.locked = 0
+        self.error_types = {}
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        return {
+            'count': len(latencies),
+            'errors': self.errors,
+            'locked': self.locked,
+            'error_types': self.error_types,
+            'throughput': len(latencies) / elapsed if elapsed else 0.0,
+            'mean_ms': sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+        }
+
+
+class LoadTest:
+    """Simulated concurrent sessions against one SQLite file.
+
+    Each worker thread plays one role and runs sessions back to back: a
+    login through Authentication.authenticate_user, then ops_per_session
+    operations picked from the role's workflow, then a logout. Operations
+    call the same data-layer functions as the app.py pages, through one
+    shared DatabaseManager, Authentication and DataProtection, as the app
+    shares them between sessions. With replica=True reads are routed as in
+    the app, to a refreshed copy of the database with read-your-writes per
+    session.
+    """
+    def __init__(self, db_path, mix=None, ops_per_session=20, think_time=0.0, seed=42,
+                 use_cache=True, credential_cache=True, replica=False, replica_refresh_interval=5.0):
+        self.db_path = db_path
+        self.mix = mix or DEFAULT_MIX
+        self.ops_per_session = ops_per_session
+        self.think_time = think_time
+        self.seed = seed
+        self.use_cache = use_cache
+        replica_name = f"{os.path.splitext(db_path)[0]}_replica.db" if replica else None
+        self.db = DatabaseManager(db_name=db_path, replica_name=replica_name,
+                                  replica_refresh_interval=replica_refresh_interval)
+        self.auth = Authentication(self.db, cache_ttl=300.0 if credential_cache else 0.0)
+        self.protection = DataProtection()
+        self.operations = {
+            'login': self.login,
+            'show_dashboard': self.show_dashboard,
+            'audit_logs': self.audit_logs,
+            'view_patients': self.view_patients,
+            'add_patient': self.add_patient,
+            'edit_patient': self.edit_patient,
+        }
+
+    # Operations; each mirrors the data access of the page it is named after
+
+    def login(self, role, rng):
+        username, password = CREDENTIALS[role]
+        user = self.auth.authenticate_user(username, password)
+        if user is None:
+            raise RuntimeError(f"Login failed for {username}")
+        self.db.log_activity(user['user_id'], user['role'], "login", "User logged in")
+        return user
+
+    def show_dashboard(self, user, rng):
+        cache = metrics_cache if self.use_cache else None
+        metrics = DashboardMetrics(self.db, cache=cache)
+        metrics.counts()
+        metrics.recent_logs(5)
+        aggregator = ActivityAggregator(self.db, window_days=30, cache=cache, grace=2.0)
+        aggregator.daily_action_counts()
+        aggregator.role_counts()
+        aggregator.hourly_counts()
+
+    def audit_logs(self, user, rng):
+        self.db.flush_logs(timeout=5)
+        LogStore(self.db, read_replica=True).recent(1000)
+
+    def view_patients(self, user, rng):
+        service = PatientQueryService(self.db, self.protection, read_replica=True)
+        filters = {'diagnosis': rng.choice(DIAGNOSES)} if rng.random() < 0.3 else {}
+        service.page(filters, limit=50, columns=ANONYMIZED_COLUMNS)
+        service.estimate_count(filters)
+
+    def add_patient(self, user, rng):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        patient_id = add_patient(self.db, self.protection, name, f"555-{rng.randrange(10 ** 7):07d}",
+                                 rng.choice(DIAGNOSES))
+        self.db.log_activity(user['user_id'], user['role'], "add_patient", f"Added patient ID: {patient_id}",
+                             subject=('patient', patient_id))
+
+    def edit_patient(self, user, rng):
+        service = PatientQueryService(self.db, self.protection)
+        matches = service.search(rng.choice(LAST_NAMES)[:3]) or service.search(rng.choice(FIRST_NAMES)[:2])
+        if not matches:
+            return
+        patient_id = rng.choice(matches)[0]
+        service.get(patient_id)
+        update_diagnosis(self.db, patient_id, rng.choice(DIAGNOSES))
+        self.db.log_activity(user['user_id'], user['role'], "edit_patient", f"Updated patient ID: {patient_id}",
+                             subject=('patient', patient_id))
+
+    # Driver
+
+    def roles(self, concurrency):
+        """Role of each worker, interleaved according to the mix so that low
+        concurrency levels already include every role"""
+        slots = sorted(((k + 0.5) / weight, role) for role, weight in self.mix.items() if weight
+                       for k in range(weight))
+        return [slots[i % len(slots)][1] for i in range(concurrency)]
+
+    def _timed(self, stats, lock, name, fn, *args):
+        started = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            with lock:
+                op = stats.setdefault(name, OperationStats())
+                op.errors += 1
+                op.locked += is_locked_error(e)
+                op.error_types[type(e).__name__] = op.error_types.get(type(e).__name__, 0) + 1
+            return None, False
+        elapsed = time.perf_counter() - started
+        with lock:
+            stats.setdefault(name, OperationStats()).latencies.append(elapsed)
+        return result, True
+
+    def worker(self, role, deadline, stats, lock, seed):
+        rng = random.Random(seed)
+        operations, weights = zip(*WORKFLOWS[role])
+        sessions = 0
+        while time.perf_counter() < deadline:
+            self.db.bind_session(DatabaseSession())
+            user, ok = self._timed(stats, lock, 'login', self.login, role, rng)
+            if not ok:
+                continue
+            sessions += 1
+            for _ in range(self.ops_per_session):
+                if time.perf_counter() >= deadline:
+                    break
+                name = rng.choices(operations, weights)[0]
+                self._timed(stats, lock, name, self.operations[name], user, rng)
+                if self.think_time:
+                    time.sleep(rng.uniform(0, 2 * self.think_time))
+            self.db.log_activity(user['user_id'], user['role'], "logout", "User logged out")
+        return sessions
+
+    def run_stage(self, concurrency, duration):
+        """Run `concurrency` sessions in parallel for `duration` seconds; returns a report"""
+        stats = {}
+        lock = threading.Lock()
+        writer = self.db.audit_writer
+        failed_before = writer.rows_failed if writer else 0
+        routed_before = self.db.routed_read_counts()
+        started = time.perf_counter()
+        deadline = started + duration
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as pool:
+            futures = [pool.submit(self.worker, role, deadline, stats, lock, self.seed * 1000 + i)
+                       for i, role in enumerate(self.roles(concurrency))]
+            sessions = sum(f.result() for f in futures)
+        self.db.flush_logs(timeout=30)
+        elapsed = time.perf_counter() - started
+
+        operations = {name: op.summary(elapsed) for name, op in sorted(stats.items())}
+        total = sum(op['count'] for op in operations.values())
+        return {
+            'concurrency': concurrency,
+            'roles': {role: self.roles(concurrency).count(role) for role in self.mix},
+            'elapsed': elapsed,
+            'sessions': sessions,
+            'operations': operations,
+            'throughput': total / elapsed if elapsed else 0.0,
+            'errors': sum(op['errors'] for op in operations.values()),
+            'locked': sum(op['locked'] for op in operations.values()),
+            # Audit entries the background writer gave up on (e.g. after lock timeouts)
+            'audit_rows_failed': (writer.rows_failed - failed_before) if writer else 0,
+            'routed_reads': {k: v - routed_before[k] for k, v in self.db.routed_read_counts().items()},
+            'pool': self.db.pool_stats(),
+        }
+
+    def ramp(self, levels, duration, progress=None):
+        reports = []
+        for concurrency in levels:
+            report = self.run_stage(concurrency, duration)
+            reports.append(report)
+            if progress:
+                progress(report)
+        return reports
+
+
+def print_stage(report):
+    print(f"\nconcurrency {report['concurrency']} {report['roles']}: "
+          f"{report['throughput']:.1f} ops/s, {report['sessions']} sessions, "
+          f"{report['errors']} errors ({report['locked']} database is locked), "
+          f"{report['audit_rows_failed']} audit rows failed")
+    if any(report['routed_reads'].values()):
+        print(f"  routed reads: {report['routed_reads']}")
+    print(f"  {'operation':16s} {'count':>7s} {'ops/s':>8s} {'p50 ms':>9s} {'p95 ms':>9s} "
+          f"{'p99 ms':>9s} {'errors':>7s} {'locked':>7s}")
+    for name, op in report['operations'].items():
+        print(f"  {name:16s} {op['count']:7d} {op['throughput']:8.1f} {op['p50_ms']:9.2f} "
+              f"{op['p95_ms']:9.2f} {op['p99_ms']:9.2f} {op['errors']:7d} {op['locked']:7d}")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        role, _, weight = part.partition('=')
+        if role not in WORKFLOWS:
+            raise argparse.ArgumentTypeError(f"Unknown role: {role}")
+        mix[role] = int(weight or 1)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent role-based load test on a scratch SQLite database")
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--logs", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="scratch database to use instead of generating one (it is written to)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                        help="concurrency levels to ramp through")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="role weights, e.g. admin=1,doctor=3,receptionist=2")
+    parser.add_argument("--ops-per-session", type=int, default=20)
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean seconds between operations")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the shared metrics cache")
+    parser.add_argument("--no-credential-cache", action="store_true", help="run the password KDF on every login")
+    parser.add_argument("--replica", action="store_true", help="route reads to a refreshed copy of the database")
+    parser.add_argument("--replica-refresh", type=float, default=5.0, help="seconds between replica refreshes")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--keep", action="store_true", help="keep the generated scratch database")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="hms_load_")
+    try:
+        db_path = args.db
+        if db_path is None:
+            db_path = os.path.join(workdir, f"load_{args.patients}_{args.logs}.db")
+            print(f"Generating {args.patients} patients and {args.logs} logs in {db_path}")
+            generate_synthetic_data(db_path, args.patients, args.logs, args.days, args.seed)
+
+        test = LoadTest(db_path, mix=args.mix, ops_per_session=args.ops_per_session,
+                        think_time=args.think_time, seed=args.seed, use_cache=not args.no_cache,
+                        credential_cache=not args.no_credential_cache, replica=args.replica,
+                        replica_refresh_interval=args.replica_refresh)
+        reports = test.ramp(args.concurrency, args.duration, progress=print_stage)
+        if test.db.replica is not None:
+            test.db.replica.close()
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({
+                    'revision': git_revision(),
+                    'python': platform.python_version(),
+                    'sqlite': sqlite3.sqlite_version,
+                    'cpus': os.cpu_count(),
+                    'params': {k: v for k, v in vars(args).items() if k != 'output'},
+                    'stages': reports
+                }, f, indent=2)
+            print(f"\nResults written to {args.output}")
+    finally:
+        if args.keep:
+            print(f"Scratch files kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
\ No newline at end of file
@@ -0,0 +1,663 @@
+import argparse
+import functools
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import operator
+import os
+import shutil
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from database import utc_now
+
+
+SEGMENT_FORMAT = 2
+# Rows per Parquet row group: the unit segments are written, pruned and cached in
+ROW_GROUP_SIZE = 20000
+# Declared logs column types that are not stored as strings
+_ARROW_TYPES = {'INTEGER': 'int64', 'REAL': 'float64', 'BLOB': 'binary'}
+
+
+def month_bounds(month):
+    """[start, end) timestamps of a 'YYYY-MM' month"""
+    year, number = int(month[:4]), int(month[5:7])
+    year, number = (year + 1, 1) if number == 12 else (year, number + 1)
+    return f"{month}-01 00:00:00", f"{year:04d}-{number:02d}-01 00:00:00"
+
+
+def current_month():
+    return utc_now().strftime('%Y-%m')
+
+
+def write_segment(path, month, columns, types, rows, row_group_size=ROW_GROUP_SIZE):
+    """Stream rows into a Parquet segment; returns (bytes, sha256).
+
+    Rows may be any iterable and only one row group is held in memory at a
+    time. Parquet keeps min/max statistics per row group, which readers use
+    to skip groups outside the log_id or timestamp range they want.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [(column, getattr(pa, _ARROW_TYPES.get((kind or '').upper(), 'string'))())
+         for column, kind in zip(columns, types)],
+        metadata={'format': str(SEGMENT_FORMAT), 'month': month}
+    )
+    text = [pa.types.is_string(field.type) for field in schema]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    rows = iter(rows)
+    with pq.ParquetWriter(tmp, schema, compression='zstd') as writer:
+        while True:
+            chunk = list(itertools.islice(rows, row_group_size))
+            if not chunk:
+                break
+            arrays = []
+            for values, is_text, field in zip(zip(*chunk), text, schema):
+                if is_text:
+                    values = [None if v is None else str(v) for v in values]
+                arrays.append(pa.array(values, field.type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema), row_group_size=row_group_size)
+
+    checksum = hashlib.sha256()
+    with open(tmp, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            checksum.update(block)
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    # Segments are never modified in place; changes write a new version
+    os.chmod(path, 0o444)
+    return os.path.getsize(path), checksum.hexdigest()
+
+
+def remove_segment(path):
+    if os.path.exists(path):
+        os.chmod(path, 0o644)
+        os.remove(path)
+
+
+class SegmentCache:
+    """Recently read row groups as Arrow tables, least recently used evicted first.
+
+    Bounded by the tables' size in memory rather than by entry count, so
+    a handful of large months cannot stay resident.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+        table = load()
+        with self._lock:
+            if key not in self._entries and table.nbytes <= self.max_bytes:
+                self._entries[key] = (table, table.nbytes)
+                self.bytes += table.nbytes
+                while self.bytes > self.max_bytes:
+                    _, (_, size) = self._entries.popitem(last=False)
+                    self.bytes -= size
+        return table
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+segment_cache = SegmentCache()
+
+
+class Segment:
+    """One segment file, read a row group at a time.
+
+    Gzip JSON segments (.seg.gz) from before the Parquet format are still
+    readable; they have no statistics and read as a single row group.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.legacy = path.endswith('.seg.gz')
+        # Raises FileNotFoundError straight away, before anything is yielded
+        self._file = open(path, 'rb')
+        if self.legacy:
+            self.bounds = [None]
+        else:
+            import pyarrow.parquet as pq
+            self._parquet = pq.ParquetFile(self._file)
+            metadata = self._parquet.metadata
+            names = self._parquet.schema_arrow.names
+            self.bounds = [self._group_bounds(metadata.row_group(i), names)
+                           for i in range(metadata.num_row_groups)]
+
+    @staticmethod
+    def _group_bounds(group, names):
+        bounds = {}
+        for column in ('log_id', 'timestamp'):
+            if column in names:
+                stats = group.column(names.index(column)).statistics
+                if stats is not None and stats.has_min_max:
+                    bounds[column] = (stats.min, stats.max)
+        return bounds
+
+    def overlaps(self, group, start=None, end=None, after_id=None, log_id=None, **filters):
+        """False when row group statistics rule out every row"""
+        bounds = self.bounds[group]
+        if not bounds:
+            return True
+        if 'log_id' in bounds:
+            low, high = bounds['log_id']
+            if after_id is not None and high <= after_id:
+                return False
+            if log_id is not None and not low <= log_id <= high:
+                return False
+        if 'timestamp' in bounds:
+            low, high = bounds['timestamp']
+            if start and high < str(start):
+                return False
+            if end and low >= str(end):
+                return False
+        return True
+
+    def table(self, group):
+        def load():
+            if not self.legacy:
+                return self._parquet.read_row_group(group)
+            import pyarrow as pa
+            self._file.seek(0)
+            with gzip.open(self._file, 'rt', encoding='utf-8') as f:
+                segment = json.load(f)
+            return pa.table({c: segment['data'][c] for c in segment['columns']})
+        return segment_cache.get((self.path, group), load)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _SegmentStats:
+    """Manifest figures for rows on their way into a segment"""
+    def __init__(self, columns):
+        self.key, self.ts = columns.index('log_id'), columns.index('timestamp')
+        self.user = columns.index('user_id')
+        self.stype, self.sid = columns.index('subject_type'), columns.index('subject_id')
+        self.rows = 0
+        self.min_log_id = self.max_log_id = None
+        self.min_timestamp = self.max_timestamp = None
+        self.refs = Counter()
+
+    def track(self, rows):
+        """Pass rows through, recording what _publish() needs"""
+        for row in rows:
+            log_id, ts = row[self.key], str(row[self.ts])
+            if self.rows == 0:
+                self.min_log_id = self.max_log_id = log_id
+                self.min_timestamp = self.max_timestamp = ts
+            else:
+                self.min_log_id = min(self.min_log_id, log_id)
+                self.max_log_id = max(self.max_log_id, log_id)
+                self.min_timestamp = min(self.min_timestamp, ts)
+                self.max_timestamp = max(self.max_timestamp, ts)
+            self.rows += 1
+            if row[self.user] is not None:
+                self.refs[('user', row[self.user])] += 1
+            if row[self.stype] is not None and row[self.sid] is not None:
+                self.refs[(row[self.stype], row[self.sid])] += 1
+            yield row
+
+
+class LogStore:
+    """Audit log storage split into monthly partitions.
+
+    The current month, and anything not yet compacted, lives in the logs
+    table (the hot partition). compact() streams each closed month into a
+    read-only Parquet segment file listed in log_partitions;
+    log_partition_refs records which months mention each patient
+    (subject_type 'patient') and each acting user (subject_type 'user'),
+    so per-subject lookups only open the segments that matter.
+
+    Reads go through iter_rows()/recent(), which only touch the segments
+    whose time range overlaps the query, skip row groups whose statistics
+    rule them out and filter the rest as Arrow tables. Activity rollups
+    keep counting compacted rows, so charts are unaffected. Retention
+    drops whole partitions with drop_expired() instead of deleting rows.
+
+    With read_replica=True the read methods go through read_connection(),
+    for pages that tolerate replica staleness; jobs that act on what they
+    read (erasure, retention, compaction) keep the default.
+    """
+    def __init__(self, db_manager, segment_dir=None, read_replica=False):
+        self.db = db_manager
+        self.segment_dir = segment_dir or f"{db_manager.db_name}.segments"
+        self.read_replica = read_replica
+
+    def _read(self):
+        return self.db.read_connection('logs') if self.read_replica else self.db.connection()
+
+    def columns(self, conn):
+        return [row[1] for row in conn.execute("PRAGMA table_info(logs)").fetchall()]
+
+    def _types(self, conn, columns):
+        declared = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(logs)").fetchall()}
+        return [declared.get(column) for column in columns]
+
+    def partitions(self, start=None, end=None, months=None, after_id=None):
+        """Manifest rows (dicts) overlapping [start, end), oldest first"""
+        clauses = []
+        params = []
+        if after_id is not None:
+            clauses.append("max_log_id > ?")
+            params.append(after_id)
+        if start:
+            clauses.append("max_timestamp >= ?")
+            params.append(str(start))
+        if end:
+            clauses.append("min_timestamp < ?")
+            params.append(str(end))
+        if months is not None:
+            if not months:
+                return []
+            clauses.append(f"month IN ({', '.join('?' * len(months))})")
+            params.extend(months)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._read() as conn:
+            cursor = conn.execute(f"SELECT * FROM log_partitions {where} ORDER BY month", params)
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def _path(self, partition):
+        return os.path.join(self.segment_dir, partition['path'])
+
+    def segment_chunks(self, partition, columns, descending=False, **filters):
+        """Yield one partition's matching rows, in `columns` order, a row group at a time.
+
+        filters are those of iter_rows() plus log_id. Row groups whose
+        statistics rule out every match are never read; the rest are
+        filtered as Arrow tables before any rows are built. Columns added
+        since compaction read as None.
+        """
+        try:
+            segment = Segment(self._path(partition))
+        except FileNotFoundError:
+            # Replaced or dropped since the manifest row was read (e.g. from a replica)
+            with self.db.connection() as conn:
+                current = conn.execute("SELECT path FROM log_partitions WHERE month = ?",
+                                       (partition['month'],)).fetchone()
+            if current is None:
+                return
+            if current[0] == partition['path']:
+                raise
+            yield from self.segment_chunks(dict(partition, path=current[0]), columns, descending, **filters)
+            return
+
+        import pyarrow as pa
+        expression = self._expression(**filters)
+        with segment:
+            groups = range(len(segment.bounds))
+            for group in (reversed(groups) if descending else groups):
+                if not segment.overlaps(group, **filters):
+                    continue
+                table = segment.table(group)
+                for column in columns:
+                    if column not in table.column_names:
+                        table = table.append_column(column, pa.nulls(table.num_rows))
+                if expression is not None:
+                    table = table.filter(expression)
+                if not table.num_rows:
+                    continue
+                rows = list(zip(*(table.column(c).to_pylist() for c in columns)))
+                if descending:
+                    rows.reverse()
+                yield rows
+
+    def row(self, log_id):
+        """(columns, row) of one entry wherever it is stored, or None"""
+        with self._read() as conn:
+            columns = self.columns(conn)
+            row = conn.execute(f"SELECT {', '.join(columns)} FROM logs WHERE log_id = ?", (log_id,)).fetchone()
+            partition = conn.execute(
+                "SELECT month FROM log_partitions WHERE min_log_id <= ? AND max_log_id >= ?", (log_id, log_id)
+            ).fetchone()
+        if row is None and partition is not None:
+            for rows in self.segment_chunks(self.partitions(months=[partition[0]])[0], columns, log_id=log_id):
+                row = rows[0]
+                break
+        return (columns, row) if row is not None else None
+
+    def subject_months(self, subject):
+        """Compacted months with log entries for a (subject_type, subject_id)"""
+        with self._read() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT month FROM log_partition_refs WHERE subject_type = ? AND subject_id = ? ORDER BY month",
+                tuple(subject)
+            ).fetchall()]
+
+    def _months_for(self, user_id, subject):
+        if subject is None and user_id is None:
+            return None
+        months = None
+        for ref in ([subject] if subject is not None else []) + ([('user', user_id)] if user_id is not None else []):
+            found = set(self.subject_months(ref))
+            months = found if months is None else months & found
+        return sorted(months)
+
+    def _where(self, start, end, user_id, subject, action, after_id=None):
+        clauses = []
+        params = []
+        if after_id is not None:
+            clauses.append("log_id > ?")
+            params.append(after_id)
+        if start:
+            clauses.append("timestamp >= ?")
+            params.append(str(start))
+        if end:
+            clauses.append("timestamp < ?")
+            params.append(str(end))
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if subject is not None:
+            clauses.append("subject_type = ? AND subject_id = ?")
+            params.extend(subject)
+        if action:
+            clauses.append("action = ?")
+            params.append(action)
+        return clauses, params
+
+    def _expression(self, start=None, end=None, user_id=None, subject=None, action=None,
+                    after_id=None, log_id=None):
+        """Arrow filter equivalent to _where(), or None when nothing is filtered"""
+        import pyarrow.compute as pc
+        conditions = []
+        if after_id is not None:
+            conditions.append(pc.field('log_id') > after_id)
+        if log_id is not None:
+            conditions.append(pc.field('log_id') == log_id)
+        if start:
+            conditions.append(pc.field('timestamp') >= str(start))
+        if end:
+            conditions.append(pc.field('timestamp') < str(end))
+        if user_id is not None:
+            conditions.append(pc.field('user_id') == user_id)
+        if subject is not None:
+            conditions.append((pc.field('subject_type') == subject[0]) & (pc.field('subject_id') == subject[1]))
+        if action:
+            conditions.append(pc.field('action') == action)
+        return functools.reduce(operator.and_, conditions) if conditions else None
+
+    def iter_rows(self, start=None, end=None, user_id=None, subject=None, action=None,
+                  descending=False, chunk_size=5000, hot=True, after_id=None):
+        """Yield (columns, rows) chunks across cold segments and the hot table in log_id order.
+
+        Compacted months always precede the rows still in the hot table, so
+        segments are read in month order before (or, descending, after) it.
+        hot=False reads the compacted months only; after_id skips rows with
+        log_id <= after_id.
+        """
+        with self._read() as conn:
+            columns = self.columns(conn)
+        months = self._months_for(user_id, subject)
+        partitions = self.partitions(start, end, months, after_id)
+        filters = dict(start=start, end=end, user_id=user_id, subject=subject, action=action, after_id=after_id)
+
+        def cold_chunks():
+            for partition in (reversed(partitions) if descending else partitions):
+                for rows in self.segment_chunks(partition, columns, descending, **filters):
+                    for i in range(0, len(rows), chunk_size):
+                        yield columns, rows[i:i + chunk_size]
+
+        def hot_chunks():
+            clauses, params = self._where(start, end, user_id, subject, action, after_id)
+            where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+            with self._read() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"SELECT {', '.join(columns)} FROM logs {where} "
+                    f"ORDER BY log_id {'DESC' if descending else 'ASC'}",
+                    params
+                )
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield columns, rows
+
+        if not hot:
+            yield from cold_chunks()
+        elif descending:
+            yield from itertools.chain(hot_chunks(), cold_chunks())
+        else:
+            yield from itertools.chain(cold_chunks(), hot_chunks())
+
+    def recent(self, limit, **filters):
+        """(columns, rows) of the newest `limit` matching rows, newest first"""
+        columns = None
+        rows = []
+        chunks = self.iter_rows(descending=True, chunk_size=limit, **filters)
+        try:
+            for columns, chunk in chunks:
+                rows.extend(chunk[:limit - len(rows)])
+                if len(rows) >= limit:
+                    break
+        finally:
+            # Releases the hot cursor's pooled connection straight away
+            chunks.close()
+        if columns is None:
+            with self._read() as conn:
+                columns = self.columns(conn)
+        return columns, rows
+
+    def _publish(self, conn, month, stats, path, size, checksum):
+        """Record a new segment version for `month` in the caller's transaction"""
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO log_partitions
+                (month, path, rows, min_log_id, max_log_id, min_timestamp, max_timestamp,
+                 bytes, checksum, compacted_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """,
+            (month, os.path.basename(path), stats.rows, stats.min_log_id, stats.max_log_id,
+             stats.min_timestamp, stats.max_timestamp, size, checksum)
+        )
+        conn.execute("DELETE FROM log_partition_refs WHERE month = ?", (month,))
+        conn.executemany(
+            "INSERT INTO log_partition_refs (subject_type, subject_id, month, rows) VALUES (?, ?, ?, ?)",
+            [(subject_type, subject_id, month, n) for (subject_type, subject_id), n in stats.refs.items()]
+        )
+
+    def _new_path(self, month):
+        return os.path.join(self.segment_dir, f"logs_{month}_{time.time_ns()}.parquet")
+
+    def write(self, month, columns, rows):
+        """Stream rows into a new segment file; returns (path, stats, bytes, sha256)"""
+        with self.db.connection() as conn:
+            types = self._types(conn, columns)
+        path = self._new_path(month)
+        stats = _SegmentStats(columns)
+        size, checksum = write_segment(path, month, columns, types, stats.track(rows))
+        return path, stats, size, checksum
+
+    def rewrite(self, partition, columns, rows, apply=None):
+        """Replace a partition's segment with `rows` (any iterable); returns the rows kept.
+
+        The partition is dropped when no rows are left. The new segment is
+        written first, then the manifest change and apply(conn), if given,
+        commit in one transaction: after a crash either both happened or
+        neither did, so a rerun never applies derived-data corrections twice.
+        """
+        month = partition['month']
+        path, stats, size, checksum = self.write(month, columns, rows)
+        with self.db.connection() as conn:
+            if stats.rows:
+                self._publish(conn, month, stats, path, size, checksum)
+            else:
+                conn.execute("DELETE FROM log_partitions WHERE month = ?", (month,))
+                conn.execute("DELETE FROM log_partition_refs WHERE month = ?", (month,))
+            if apply is not None:
+                apply(conn)
+        if not stats.rows:
+            remove_segment(path)
+        remove_segment(self._path(partition))
+        self.db.notify_write('logs')
+        return stats.rows
+
+    def compact(self, before_month=None, progress=None):
+        """Move every month before `before_month` (default: the current one) out of the hot table"""
+        started = time.perf_counter()
+        before = before_month or current_month()
+        self._remove_orphans()
+        with self.db.connection() as conn:
+            months = [row[0] for row in conn.execute(
+                "SELECT DISTINCT substr(timestamp, 1, 7) FROM logs WHERE timestamp < ? ORDER BY 1",
+                (month_bounds(before)[0],)
+            ).fetchall()]
+
+        report = {'months': [], 'rows': 0, 'bytes': 0, 'elapsed': 0.0}
+        for month in months:
+            rows, size = self._compact_month(month)
+            report['months'].append(month)
+            report['rows'] += rows
+            report['bytes'] += size
+            report['elapsed'] = time.perf_counter() - started
+            if progress:
+                progress(report)
+        report['elapsed'] = time.perf_counter() - started
+        return report
+
+    def _compact_month(self, month, fetch_size=5000):
+        start, end = month_bounds(month)
+        with self.db.connection() as conn:
+            columns = self.columns(conn)
+        key = columns.index('log_id')
+        previous = (self.partitions(months=[month]) or [None])[0]
+        hot_max_id = None
+
+        def hot_rows():
+            nonlocal hot_max_id
+            with self.db.connection() as conn:
+                cursor = conn.execute(
+                    f"SELECT {', '.join(columns)} FROM logs WHERE timestamp >= ? AND timestamp < ? ORDER BY log_id",
+                    (start, end)
+                )
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    hot_max_id = rows[-1][key]
+                    yield from rows
+
+        # The month is streamed, never held in memory: late rows for an
+        # already compacted month are merged with its segment into a new version
+        hot = hot_rows()
+        rows = hot
+        if previous is not None:
+            cold = itertools.chain.from_iterable(self.segment_chunks(previous, columns))
+            rows = heapq.merge(cold, hot, key=operator.itemgetter(key))
+        try:
+            # The segment is durable before the rows leave the hot table
+            path, stats, size, checksum = self.write(month, columns, rows)
+        finally:
+            hot.close()
+        if hot_max_id is None:
+            remove_segment(path)
+            return 0, 0
+
+        with self.db.connection() as conn:
+            self._publish(conn, month, stats, path, size, checksum)
+            conn.execute(
+                "DELETE FROM logs WHERE timestamp >= ? AND timestamp < ? AND log_id <= ?",
+                (start, end, hot_max_id)
+            )
+        if previous is not None:
+            remove_segment(self._path(previous))
+        self.db.notify_write('logs')
+        return stats.rows, size
+
+    def _remove_orphans(self):
+        # Segments written by a compaction that never committed
+        if not os.path.isdir(self.segment_dir):
+            return
+        with self.db.connection() as conn:
+            known = {row[0] for row in conn.execute("SELECT path FROM log_partitions").fetchall()}
+        for name in os.listdir(self.segment_dir):
+            if name not in known:
+                remove_segment(os.path.join(self.segment_dir, name))
+
+    def drop_expired(self, cutoff, archive=None, archive_dir=None):
+        """Apply retention to the cold partitions; returns (rows removed, partitions dropped).
+
+        Partitions entirely older than `cutoff` are dropped as a unit: their
+        segment file is copied to archive_dir/logs when archive_dir is given,
+        then deleted. A partition straddling the cutoff is rewritten without
+        its expired rows, which are passed to archive.write() when an archive
+        SegmentWriter is given.
+
+        Each partition's manifest change and the matching rollup, search
+        index and audit chain corrections commit together, so a run
+        interrupted at any point can simply be repeated. Rows archived by
+        the interrupted run may then be archived a second time.
+        """
+        removed = 0
+        dropped = 0
+        for partition in self.partitions(end=cutoff):
+            with self.db.connection() as conn:
+                columns = self.columns(conn)
+
+            def expire(conn):
+                for rows in self.segment_chunks(partition, columns, end=cutoff):
+                    self.db.logs_deleted(conn, columns, rows)
+
+            if partition['max_timestamp'] < cutoff:
+                if archive_dir:
+                    # Copied before and deleted after the manifest change, so a
+                    # crash in between leaves the segment in both places
+                    target = os.path.join(archive_dir, 'logs')
+                    os.makedirs(target, exist_ok=True)
+                    tmp = os.path.join(target, partition['path'] + ".tmp")
+                    shutil.copyfile(self._path(partition), tmp)
+                    os.replace(tmp, os.path.join(target, partition['path']))
+                with self.db.connection() as conn:
+                    conn.execute("DELETE FROM log_partitions WHERE month = ?", (partition['month'],))
+                    conn.execute("DELETE FROM log_partition_refs WHERE month = ?", (partition['month'],))
+                    expire(conn)
+                remove_segment(self._path(partition))
+                removed += partition['rows']
+                dropped += 1
+            else:
+                if archive is not None:
+                    for rows in self.segment_chunks(partition, columns, end=cutoff):
+                        archive.write(columns, rows)
+                kept = itertools.chain.from_iterable(self.segment_chunks(partition, columns, start=cutoff))
+                removed += partition['rows'] - self.rewrite(partition, columns, kept, apply=expire)
+            self.db.notify_write('logs')
+        return removed, dropped
+
+
+if __name__ == "__main__":
+    from database import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Manage monthly audit log partitions")
+    parser.add_argument("command", choices=["compact", "list"])
+    parser.add_argument("--db", default="hospital.db")
+    parser.add_argument("--before", help="compact months before YYYY-MM (default: current month)")
+    args = parser.parse_args()
+
+    store = LogStore(DatabaseManager(db_name=args.db))
+    if args.command == "compact":
+        print(store.compact(args.before, progress=lambda r: print(f"compacted {r['months'][-1]}")))
+    else:
+        for partition in store.partitions():
+            print(partition)
\ No newline at end of file
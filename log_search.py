@@ -0,0 +1,236 @@
+import argparse
+import re
+import time
+from datetime import datetime, timedelta
+
+
+# Columns copied into logs_fts. Search text only ever matches action and
+# details; role and user_id are indexed so filters on them are answered by
+# the index too, and timestamp is stored for showing and checking results
+INDEXED_COLUMNS = ('log_id', 'action', 'details', 'timestamp', 'role', 'user_id')
+RESULT_COLUMNS = ['log_id', 'timestamp', 'user_id', 'role', 'action', 'details', 'rank']
+
+# Entries are timestamped when logged and written in submission order, so
+# log_id follows timestamp order apart from entries in flight together;
+# log_id bounds derived from a time range allow this much leeway
+ORDER_SLACK = timedelta(minutes=5)
+
+_TERM = re.compile(r'\w+\*?')
+
+
+def match_query(text, role=None, user_id=None):
+    """FTS5 query matching entries that contain every word of `text`.
+
+    Each word is quoted, so punctuation and FTS5 operators in user input
+    cannot cause syntax errors; a trailing * keeps its prefix meaning.
+    role and user_id become column filters. Returns None when there is
+    nothing to search for.
+    """
+    terms = []
+    for term in _TERM.findall(text or ''):
+        prefix = term.endswith('*')
+        term = term.rstrip('*')
+        terms.append(f'"{term}"*' if prefix else f'"{term}"')
+    if not terms:
+        return None
+    query = f"{{action details}} : ({' '.join(terms)})"
+    if role:
+        query += ' AND {role} : "%s"' % role.replace('"', '""')
+    if user_id is not None:
+        query += f' AND {{user_id}} : "{int(user_id)}"'
+    return query
+
+
+def _shift(value, delta):
+    """A 'YYYY-MM-DD[ HH:MM:SS]' timestamp (or date) moved by delta, in the stored format"""
+    return (datetime.fromisoformat(str(value)) + delta).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class LogSearch:
+    """Full-text search over audit log action and details.
+
+    logs_fts is an FTS5 table keyed by log_id (its rowid). It is kept in
+    step in the same transactions as the logs table: rows are added by
+    write_log_batch, removed by retention through logs_deleted() and
+    updated by erasure through logs_rewritten(). Compaction moves rows into
+    segments without changing their log_id, so compacted months stay
+    searchable and results never need to open a segment.
+
+    Every filter narrows the index scan itself: role and user_id through
+    column filters, and time ranges through log_id (rowid) bounds. Pages
+    are keyset-based on log_id, so a later page costs no more than the
+    first, and entries logged between page requests never shift a page.
+    """
+    def __init__(self, db_manager):
+        self.db = db_manager
+
+    @staticmethod
+    def _pick(columns, rows):
+        index = [columns.index(c) for c in INDEXED_COLUMNS]
+        return [tuple(row[i] for i in index) for row in rows]
+
+    def add(self, conn, columns, rows):
+        conn.executemany(
+            "INSERT INTO logs_fts (rowid, action, details, timestamp, role, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+            self._pick(columns, rows)
+        )
+
+    def remove(self, conn, columns, rows):
+        key = columns.index('log_id')
+        conn.executemany("DELETE FROM logs_fts WHERE rowid = ?", [(row[key],) for row in rows])
+
+    def update(self, conn, columns, rows):
+        """Re-index rewritten rows"""
+        conn.executemany(
+            "UPDATE logs_fts SET action = ?, details = ?, timestamp = ?, role = ?, user_id = ? WHERE rowid = ?",
+            [row[1:] + row[:1] for row in self._pick(columns, rows)]
+        )
+
+    def search(self, text, start=None, end=None, role=None, user_id=None, limit=50,
+               after=None, order='rank'):
+        """(columns, rows, next_after) of matching entries.
+
+        Pages hold the newest matches first. order='rank' sorts each page
+        by bm25, best match first; order='newest' leaves it newest first
+        and skips ranking. bm25 scores move as the index grows, so they
+        only order rows within a page, never choose the page. start/end
+        bound the timestamp ([start, end)). Pass a page's next_after as
+        `after` to get the following page; it is None on the last page.
+        Reads go to the read replica when one is configured.
+        """
+        query = match_query(text, role, user_id)
+        if query is None:
+            return RESULT_COLUMNS, [], None
+        clauses = ["logs_fts MATCH ?"]
+        params = [query]
+        with self.db.read_connection('logs') as conn:
+            bounds = self._log_id_bounds(conn, start, end)
+            if bounds is None:
+                return RESULT_COLUMNS, [], None
+            low, high = bounds
+            if low is not None:
+                clauses.append("rowid >= ?")
+                params.append(low)
+            if high is not None:
+                clauses.append("rowid <= ?")
+                params.append(high)
+            # The exact check, over just the rows within the bounds
+            if start:
+                clauses.append("timestamp >= ?")
+                params.append(str(start))
+            if end:
+                clauses.append("timestamp < ?")
+                params.append(str(end))
+            if after is not None:
+                clauses.append("rowid < ?")
+                params.append(after)
+            # bm25 reads every match's statistics, so it is only computed when asked for
+            rank = "NULL" if order == 'newest' else "rank"
+            rows = conn.execute(
+                f"""
+                SELECT rowid, timestamp, user_id, role, action, details, {rank}
+                FROM logs_fts
+                WHERE {' AND '.join(clauses)}
+                ORDER BY rowid DESC
+                LIMIT ?
+                """,
+                params + [limit + 1]
+            ).fetchall()
+        next_after = rows[limit - 1][0] if len(rows) > limit else None
+        rows = rows[:limit]
+        if order != 'newest':
+            rows.sort(key=lambda row: row[6])
+        return RESULT_COLUMNS, rows, next_after
+
+    def _log_id_bounds(self, conn, start, end):
+        """(low, high) log_id bounds covering [start, end), or None if nothing can match.
+
+        Either bound is None when that side is open. Compacted months always precede
+        the hot table, so the manifest answers for them and an indexed
+        lookup on logs(timestamp) for the rest.
+        """
+        low = high = None
+        if start:
+            bound = _shift(start, -ORDER_SLACK)
+            low = conn.execute("SELECT MIN(min_log_id) FROM log_partitions WHERE max_timestamp >= ?",
+                               (bound,)).fetchone()[0]
+            if low is None:
+                row = conn.execute("SELECT log_id FROM logs WHERE timestamp >= ? ORDER BY timestamp LIMIT 1",
+                                   (bound,)).fetchone()
+                if row is None:
+                    return None
+                low = row[0]
+        if end:
+            bound = _shift(end, ORDER_SLACK)
+            row = conn.execute("SELECT log_id FROM logs WHERE timestamp < ? ORDER BY timestamp DESC LIMIT 1",
+                               (bound,)).fetchone()
+            high = row[0] if row else conn.execute(
+                "SELECT MAX(max_log_id) FROM log_partitions WHERE min_timestamp < ?", (bound,)
+            ).fetchone()[0]
+            if high is None:
+                return None
+        return low, high
+
+    def rebuild(self):
+        """Recreate the index from the logs table and the compacted segments"""
+        with self.db.connection() as conn:
+            rebuild_search_index(conn.cursor(), self.db)
+
+    def optimize(self):
+        """Merge the index's b-trees; worthwhile after large rebuilds or deletes"""
+        with self.db.connection() as conn:
+            conn.execute("INSERT INTO logs_fts (logs_fts) VALUES ('optimize')")
+
+
+def rebuild_search_index(cursor, db):
+    cursor.execute("DELETE FROM logs_fts")
+    cursor.execute(
+        "INSERT INTO logs_fts (rowid, action, details, timestamp, role, user_id) "
+        "SELECT log_id, action, details, timestamp, role, user_id FROM logs"
+    )
+    from log_partitions import LogStore
+    store = LogStore(db)
+    search = LogSearch(db)
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(logs)").fetchall()]
+    partitions = cursor.execute("SELECT * FROM log_partitions ORDER BY month").fetchall()
+    names = [d[0] for d in cursor.description]
+    for partition in partitions:
+        for rows in store.segment_chunks(dict(zip(names, partition)), columns):
+            search.add(cursor.connection, columns, rows)
+
+
+if __name__ == "__main__":
+    from database import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Search or maintain the audit log full-text index")
+    parser.add_argument("command", choices=["search", "rebuild", "optimize"])
+    parser.add_argument("text", nargs="?", default="")
+    parser.add_argument("--db", default="hospital.db")
+    parser.add_argument("--from", dest="start", help="earliest timestamp (YYYY-MM-DD[ HH:MM:SS], UTC)")
+    parser.add_argument("--to", dest="end", help="timestamp to search before")
+    parser.add_argument("--role")
+    parser.add_argument("--user", type=int, help="user ID")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=1, help="number of pages to fetch")
+    parser.add_argument("--newest", action="store_true", help="leave each page newest first instead of sorting it by best match")
+    args = parser.parse_args()
+
+    search = LogSearch(DatabaseManager(db_name=args.db, async_logging=False))
+    started = time.perf_counter()
+    if args.command == "search":
+        after = None
+        for page in range(args.pages):
+            columns, rows, after = search.search(args.text, args.start, args.end, args.role, args.user,
+                                                 args.limit, after, 'newest' if args.newest else 'rank')
+            for row in rows:
+                print(dict(zip(columns, row)))
+            print(f"page {page + 1}: {len(rows)}{'+' if after is not None else ''} results "
+                  f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+            if after is None:
+                break
+    elif args.command == "rebuild":
+        search.rebuild()
+        print(f"Index rebuilt in {time.perf_counter() - started:.1f}s")
+    else:
+        search.optimize()
+        print(f"Index optimized in {time.perf_counter() - started:.1f}s")
\ No newline at end of file
@@ -0,0 +1,369 @@
+import threading
+from rollups import rebuild_rollups
+
+
+def create_base_tables(cursor, db):
+    # Create users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL
+        )
+    ''')
+
+    # Create patients table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS patients (
+            patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            contact TEXT NOT NULL,
+            diagnosis TEXT NOT NULL,
+            anonymized_name TEXT,
+            anonymized_contact TEXT,
+            encrypted_name TEXT,
+            encrypted_contact TEXT,
+            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Create logs table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS logs (
+            log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            role TEXT,
+            action TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            details TEXT
+        )
+    ''')
+
+    # Insert default users
+    default_users = [
+        ('admin', db.hash_password('admin123'), 'admin'),
+        ('dr_bob', db.hash_password('doc123'), 'doctor'),
+        ('alice_recep', db.hash_password('rec123'), 'receptionist')
+    ]
+    cursor.executemany(
+        "INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)",
+        default_users
+    )
+
+
+def add_column(cursor, table, column, definition):
+    """ALTER TABLE ... ADD COLUMN unless the column already exists"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def add_encrypted_patient_columns(cursor, db):
+    # Databases created before these columns existed never got them,
+    # because CREATE TABLE IF NOT EXISTS leaves existing tables alone
+    add_column(cursor, 'patients', 'encrypted_name', 'TEXT')
+    add_column(cursor, 'patients', 'encrypted_contact', 'TEXT')
+
+
+def add_blind_index_columns(cursor, db):
+    # Filled in by add_patient, the bulk jobs and the blind index backfill
+    add_column(cursor, 'patients', 'name_bidx', 'TEXT')
+    add_column(cursor, 'patients', 'contact_bidx', 'TEXT')
+
+
+def add_log_subject_columns(cursor, db):
+    # The patient (or other subject) a log entry is about, so data subject
+    # requests can find entries without parsing details
+    add_column(cursor, 'logs', 'subject_type', 'TEXT')
+    add_column(cursor, 'logs', 'subject_id', 'INTEGER')
+
+
+def backfill_log_subjects(cursor, db):
+    """Fill logs.subject_type/subject_id for entries written before those columns existed.
+
+    "Updated patient ID: n" carries the ID. "Added patient: name" is
+    matched to the patient with that name added closest in time to the
+    log entry.
+    """
+    cursor.execute('''
+        UPDATE logs SET subject_type = 'patient', subject_id = CAST(substr(details, 21) AS INTEGER)
+        WHERE action = 'edit_patient' AND details LIKE 'Updated patient ID: %' AND subject_id IS NULL
+    ''')
+    # Each name lookup is a point query on idx_patients_name
+    cursor.execute(
+        "SELECT log_id, substr(details, 16), timestamp FROM logs "
+        "WHERE action = 'add_patient' AND details LIKE 'Added patient: %' AND subject_id IS NULL"
+    )
+    updates = []
+    for log_id, name, timestamp in cursor.fetchall():
+        match = cursor.execute(
+            """
+            SELECT patient_id FROM patients WHERE name = ? COLLATE NOCASE
+            ORDER BY name = ? DESC, abs(julianday(date_added) - julianday(?))
+            LIMIT 1
+            """,
+            (name, name, timestamp)
+        ).fetchone()
+        if match:
+            updates.append((match[0], log_id))
+    cursor.executemany("UPDATE logs SET subject_type = 'patient', subject_id = ? WHERE log_id = ?", updates)
+
+
+def add_patient_key_id_column(cursor, db):
+    # Which key ring key encrypted_name/encrypted_contact are encrypted
+    # with; NULL for rows encrypted before key rotation existed
+    add_column(cursor, 'patients', 'key_id', 'TEXT')
+
+
+def add_log_hash_columns(cursor, db):
+    add_column(cursor, 'logs', 'content_hash', 'TEXT')
+    add_column(cursor, 'logs', 'row_hash', 'TEXT')
+
+
+def start_audit_chain(cursor, db):
+    # Existing entries are left unhashed; the chain starts after the
+    # newest one, recorded by a signed genesis checkpoint
+    from audit_chain import AuditChain, GENESIS_HASH
+    chain = AuditChain(db)
+    seq = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'logs'").fetchone()
+    last_id = max(seq[0] if seq else 0,
+                  cursor.execute("SELECT COALESCE(MAX(log_id), 0) FROM logs").fetchone()[0])
+    cursor.execute(
+        "INSERT OR REPLACE INTO audit_chain_head (id, log_id, row_hash, signature) VALUES (1, ?, ?, ?)",
+        (last_id, GENESIS_HASH, chain.sign('head', last_id, GENESIS_HASH))
+    )
+    # The head records its newest checkpoint from migration 14 on
+    chain.checkpoint(cursor, 'genesis', last_id, GENESIS_HASH, record_in_head=False)
+
+
+def record_head_checkpoint(cursor, db):
+    # Re-sign the head so its signature covers the newest checkpoint id
+    from audit_chain import AuditChain
+    chain = AuditChain(db)
+    add_column(cursor, 'audit_chain_head', 'checkpoint_id', 'INTEGER')
+    head_id, head_hash = cursor.execute("SELECT log_id, row_hash FROM audit_chain_head WHERE id = 1").fetchone()
+    newest = cursor.execute("SELECT MAX(checkpoint_id) FROM audit_checkpoints").fetchone()[0]
+    chain.set_head(cursor, head_id, head_hash, newest)
+
+
+def build_search_index(cursor, db):
+    from log_search import rebuild_search_index
+    rebuild_search_index(cursor, db)
+
+
+# (version, description, steps). A step is an SQL string or a callable
+# taking (cursor, db_manager). Append new migrations; never edit old ones.
+MIGRATIONS = [
+    (1, "base tables and default users", [create_base_tables]),
+    (2, "encrypted patient columns", [add_encrypted_patient_columns]),
+    (3, "indexes for time-range log and patient queries", [
+        "CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_user_timestamp ON logs(user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_action_timestamp ON logs(action, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_patients_date_added ON patients(date_added)",
+    ]),
+    (4, "checkpoints for resumable bulk jobs", [
+        '''
+        CREATE TABLE IF NOT EXISTS job_checkpoints (
+            job TEXT PRIMARY KEY,
+            last_key INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (5, "case-insensitive patient name index for prefix search", [
+        "CREATE INDEX IF NOT EXISTS idx_patients_name ON patients(name COLLATE NOCASE)",
+    ]),
+    (6, "activity rollup tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS activity_daily_rollup (
+            day TEXT NOT NULL,
+            action TEXT NOT NULL,
+            role TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, action, role)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS activity_hourly_rollup (
+            day TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, hour)
+        )
+        ''',
+        rebuild_rollups,
+    ]),
+    (7, "blind index columns for exact patient lookups", [
+        add_blind_index_columns,
+        "CREATE INDEX IF NOT EXISTS idx_patients_name_bidx ON patients(name_bidx)",
+        "CREATE INDEX IF NOT EXISTS idx_patients_contact_bidx ON patients(contact_bidx)",
+    ]),
+    (8, "structured data subject columns on logs", [
+        add_log_subject_columns,
+        "CREATE INDEX IF NOT EXISTS idx_logs_subject ON logs(subject_type, subject_id)",
+        backfill_log_subjects,
+    ]),
+    (9, "monthly audit log partitions", [
+        '''
+        CREATE TABLE IF NOT EXISTS log_partitions (
+            month TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            min_log_id INTEGER NOT NULL,
+            max_log_id INTEGER NOT NULL,
+            min_timestamp TEXT NOT NULL,
+            max_timestamp TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            checksum TEXT NOT NULL,
+            compacted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS log_partition_refs (
+            subject_type TEXT NOT NULL,
+            subject_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            PRIMARY KEY (subject_type, subject_id, month)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_log_partitions_range ON log_partitions(min_timestamp, max_timestamp)",
+    ]),
+    (10, "encryption key id on patients", [
+        add_patient_key_id_column,
+        "CREATE INDEX IF NOT EXISTS idx_patients_key_id ON patients(key_id)",
+    ]),
+    (11, "hash-chained audit log", [
+        add_log_hash_columns,
+        '''
+        CREATE TABLE IF NOT EXISTS audit_chain_head (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            log_id INTEGER NOT NULL,
+            row_hash TEXT NOT NULL,
+            signature TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS audit_checkpoints (
+            checkpoint_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            log_id INTEGER NOT NULL,
+            row_hash TEXT NOT NULL,
+            rows INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            signature TEXT NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_audit_checkpoints_log_id ON audit_checkpoints(log_id)",
+        '''
+        CREATE TABLE IF NOT EXISTS audit_redactions (
+            log_id INTEGER PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            signature TEXT NOT NULL,
+            redacted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        start_audit_chain,
+    ]),
+    (12, "full-text search index over log action and details", [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(
+            action, details,
+            timestamp UNINDEXED, role UNINDEXED, user_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        ''',
+        build_search_index,
+    ]),
+    (13, "search index filters on role, user and log_id", [
+        # role and user_id become indexed columns, matched only through
+        # column filters; bm25 ignores them when ranking
+        "DROP TABLE IF EXISTS logs_fts",
+        '''
+        CREATE VIRTUAL TABLE logs_fts USING fts5(
+            action, details, role, user_id,
+            timestamp UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        ''',
+        "INSERT INTO logs_fts (logs_fts, rank) VALUES ('rank', 'bm25(1.0, 1.0, 0.0, 0.0, 0.0)')",
+        build_search_index,
+    ]),
+    (14, "audit chain head records the newest checkpoint", [
+        record_head_checkpoint,
+    ]),
+]
+
+
+class MigrationRunner:
+    """Applies pending MIGRATIONS and records them in schema_version.
+
+    When the schema is already current this costs a single SELECT, and
+    databases already checked by this process are skipped entirely.
+    """
+    _checked = set()
+    _lock = threading.Lock()
+
+    def __init__(self, db_manager, migrations=None):
+        self.db = db_manager
+        self.migrations = migrations if migrations is not None else MIGRATIONS
+
+    @property
+    def latest_version(self):
+        return max(version for version, _, _ in self.migrations)
+
+    def current_version(self, cursor):
+        try:
+            cursor.execute("SELECT MAX(version) FROM schema_version")
+        except Exception:
+            # No schema_version table yet
+            return 0
+        return cursor.fetchone()[0] or 0
+
+    def run(self):
+        """Apply pending migrations; returns the versions applied"""
+        key = (self.db.db_type, self.db.db_name)
+        if key in self._checked:
+            return []
+
+        with self._lock:
+            applied = []
+            with self.db.connection() as conn:
+                cursor = conn.cursor()
+                if self.current_version(cursor) < self.latest_version:
+                    applied = self._migrate(conn, cursor)
+            self._checked.add(key)
+        return applied
+
+    def _migrate(self, conn, cursor):
+        if self.db.db_type == 'sqlite':
+            # Take the write lock up front so concurrent processes migrate once
+            conn.commit()
+            cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        current = self.current_version(cursor)
+
+        applied = []
+        for version, description, steps in sorted(self.migrations, key=lambda m: m[0]):
+            if version <= current:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(cursor, self.db)
+                else:
+                    cursor.execute(step)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            applied.append(version)
+        return applied
\ No newline at end of file
@@ -0,0 +1,56 @@
+import base64
+import hashlib
+import hmac
+import os
+
+
+# scrypt cost parameters; raise SCRYPT_N to make hashing slower. Stored
+# hashes carry their own parameters, and hashes made with older ones are
+# upgraded on the next successful login.
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem must cover the 128 * r * n bytes scrypt needs, with headroom
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=32,
+                          maxmem=256 * r * (n + p + 2))
+
+
+def hash_password(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """Salted scrypt hash in the form scrypt$n$r$p$salt$digest"""
+    salt = os.urandom(16)
+    return f"scrypt${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+
+def legacy_hash(password):
+    """Unsalted SHA-256 used before scrypt"""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def is_legacy_hash(stored):
+    return len(stored) == 64 and not stored.startswith("scrypt$")
+
+
+def verify_password(password, stored):
+    if is_legacy_hash(stored):
+        return hmac.compare_digest(legacy_hash(password), stored)
+    try:
+        _, n, r, p, salt, digest = stored.split("$")
+        expected = base64.b64decode(digest)
+        actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def needs_rehash(stored, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """True for legacy hashes and scrypt hashes made with other parameters"""
+    if is_legacy_hash(stored):
+        return True
+    return not stored.startswith(f"scrypt${n}${r}${p}$")
\ No newline at end of file
@@ -0,0 +1,313 @@
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import time
+from datetime import datetime
+
+from database import to_db_timestamp
+
+
+REQUIRED_FIELDS = ('name', 'contact', 'diagnosis')
+MAX_LENGTHS = {'name': 200, 'contact': 50, 'diagnosis': 5000}
+REJECT_COLUMNS = ['row', 'reason', 'name', 'contact', 'diagnosis', 'date_added']
+
+
+def iter_csv_records(f):
+    """Yield dicts from a CSV file with a header row"""
+    for record in csv.DictReader(f):
+        yield record
+
+
+def iter_json_records(f, read_size=65536, max_record_size=1 << 20):
+    """Yield objects from a JSON array or a JSON Lines file without loading it whole.
+
+    Malformed input raises ValueError naming its character offset (or
+    line). A record still incomplete after max_record_size characters
+    counts as malformed, so a bad file is never buffered whole.
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(read_size)
+    stripped = buffer.lstrip()
+    if not stripped.startswith('['):
+        # JSON Lines; the readline() completes a line cut off by the first read
+        lines = itertools.chain(io.StringIO(buffer + f.readline(max_record_size)),
+                                iter(lambda: f.readline(max_record_size + 1), ''))
+        for number, line in enumerate(lines, 1):
+            if len(line) > max_record_size:
+                raise ValueError(f"line {number} is longer than {max_record_size} characters")
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"malformed JSON on line {number}: {e.msg}") from None
+            yield record
+        return
+
+    # Characters of the file before the start of `buffer`
+    offset = len(buffer) - len(stripped) + 1
+    buffer = stripped[1:]
+    eof = False
+    while True:
+        trimmed = buffer.lstrip().lstrip(',').lstrip()
+        offset += len(buffer) - len(trimmed)
+        buffer = trimmed
+        if buffer.startswith(']'):
+            return
+        try:
+            record, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as e:
+            if eof or len(buffer) > max_record_size:
+                raise ValueError(f"malformed JSON at character {offset + e.pos}: {e.msg}") from None
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield record
+        buffer = buffer[end:]
+        offset += end
+
+
+class ImportFileError(ValueError):
+    """The input could not be read; `report` covers the records imported before it"""
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
+class PatientImporter:
+    """Streams patient records from CSV or JSON into the patients table.
+
+    Each chunk is validated, given a reserved block of patient IDs, and has
+    its anonymized, encrypted and blind index columns computed before a
+    single executemany insert. Every chunk is recorded by one audit entry, and
+    rows that fail validation are written to a reject file with a reason.
+    """
+    def __init__(self, db_manager, data_protection, chunk_size=5000):
+        self.db = db_manager
+        self.protection = data_protection
+        self.chunk_size = chunk_size
+
+    def validate(self, record):
+        """Return (row tuple without ID, None) or (None, reason)"""
+        if not isinstance(record, dict):
+            return None, "not an object"
+        values = {}
+        for field in REQUIRED_FIELDS:
+            value = record.get(field)
+            value = str(value).strip() if value is not None else ''
+            if not value:
+                return None, f"missing {field}"
+            if len(value) > MAX_LENGTHS[field]:
+                return None, f"{field} longer than {MAX_LENGTHS[field]} characters"
+            values[field] = value
+        if sum(c.isdigit() for c in values['contact']) < 4:
+            return None, "contact has fewer than 4 digits"
+
+        date_added = record.get('date_added')
+        if date_added not in (None, ''):
+            try:
+                date_added = to_db_timestamp(datetime.fromisoformat(str(date_added).strip()))
+            except ValueError:
+                return None, "date_added is not an ISO date"
+        else:
+            date_added = None
+        return (values['name'], values['contact'], values['diagnosis'], date_added), None
+
+    def reserve_ids(self, count):
+        """Reserve `count` consecutive patient IDs; returns the first one.
+
+        patients uses AUTOINCREMENT, so bumping its sqlite_sequence entry
+        keeps concurrent add_patient inserts out of the reserved block.
+        """
+        with self.db.connection() as conn:
+            updated = conn.execute(
+                "UPDATE sqlite_sequence SET seq = seq + ? WHERE name = 'patients'", (count,)
+            ).rowcount
+            if not updated:
+                conn.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) "
+                    "SELECT 'patients', COALESCE(MAX(patient_id), 0) + ? FROM patients",
+                    (count,)
+                )
+            last = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'patients'").fetchone()[0]
+        return last - count + 1
+
+    def prepare(self, rows, first_id):
+        """Build insert tuples for validated rows; returns (inserts, failures)"""
+        key_id = self.protection.primary_key_id
+        names = self.protection.encrypt_many([row[0] for row in rows])
+        contacts = self.protection.encrypt_many([row[1] for row in rows])
+        anonymize_name = self.protection.anonymize_name
+        anonymize_contact = self.protection.anonymize_contact
+        blind_index = self.protection.blind_index
+        inserts = []
+        failures = []
+        for i, (name, contact, diagnosis, date_added) in enumerate(rows):
+            error = names.errors.get(i) or contacts.errors.get(i)
+            if error:
+                failures.append((i, f"encryption failed: {error}"))
+                continue
+            patient_id = first_id + i
+            inserts.append((
+                patient_id, name, contact, diagnosis,
+                anonymize_name(name, patient_id), anonymize_contact(contact),
+                names.values[i], contacts.values[i], key_id,
+                blind_index(name, 'name'), blind_index(contact, 'contact'), date_added
+            ))
+        return inserts, failures
+
+    def insert(self, conn, inserts):
+        conn.executemany(
+            """
+            INSERT INTO patients (patient_id, name, contact, diagnosis, anonymized_name,
+                                  anonymized_contact, encrypted_name, encrypted_contact, key_id,
+                                  name_bidx, contact_bidx, date_added)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            """,
+            inserts
+        )
+
+    def run(self, records, user, source="upload", reject_file=None, progress=None):
+        """Import an iterable of dicts; returns a stats report.
+
+        user is the session user dict the audit entries are recorded for;
+        rejected rows are written as CSV to reject_file (a text file object)
+        when one is given. Input that cannot be parsed stops the import with
+        ImportFileError once the records before it are imported.
+        """
+        start = time.perf_counter()
+        rejects = csv.writer(reject_file) if reject_file is not None else None
+        if rejects:
+            rejects.writerow(REJECT_COLUMNS)
+        report = {
+            'source': source,
+            'read': 0,
+            'imported': 0,
+            'rejected': 0,
+            'chunks': 0,
+            'first_id': None,
+            'last_id': None,
+            'elapsed': 0.0,
+            'rows_per_sec': 0.0
+        }
+
+        def reject(row_number, reason, record):
+            report['rejected'] += 1
+            if rejects:
+                fields = record if isinstance(record, dict) else {}
+                rejects.writerow([row_number, reason] + [fields.get(c, '') for c in REJECT_COLUMNS[2:]])
+
+        chunk = []
+        records = iter(records)
+        while True:
+            try:
+                record = next(records)
+            except StopIteration:
+                break
+            except (ValueError, csv.Error) as e:
+                # Covers UnicodeDecodeError; everything before the bad record is kept
+                if chunk:
+                    self._import_chunk(chunk, user, source, report, reject)
+                self._update_rate(report, start)
+                raise ImportFileError(f"record {report['read'] + 1}: {e}", report) from e
+            report['read'] += 1
+            chunk.append((report['read'], record))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk, user, source, report, reject)
+                chunk = []
+                self._update_rate(report, start)
+                if progress:
+                    progress(report)
+        if chunk:
+            self._import_chunk(chunk, user, source, report, reject)
+
+        self._update_rate(report, start)
+        if progress:
+            progress(report)
+        return report
+
+    def _import_chunk(self, chunk, user, source, report, reject):
+        valid = []
+        for row_number, record in chunk:
+            row, reason = self.validate(record)
+            if reason:
+                reject(row_number, reason, record)
+            else:
+                valid.append((row_number, record, row))
+        report['chunks'] += 1
+        if not valid:
+            return
+
+        first_id = self.reserve_ids(len(valid))
+        # Crypto and anonymization happen outside the write transaction
+        inserts, failures = self.prepare([row for _, _, row in valid], first_id)
+        for i, reason in failures:
+            reject(valid[i][0], reason, valid[i][1])
+        if not inserts:
+            return
+
+        with self.db.connection() as conn:
+            self.insert(conn, inserts)
+        self.db.notify_write('patients')
+
+        first, last = inserts[0][0], inserts[-1][0]
+        report['imported'] += len(inserts)
+        report['first_id'] = report['first_id'] or first
+        report['last_id'] = last
+        # One summarized entry per chunk; no patient details in the log
+        self.db.log_activity(
+            user['user_id'], user['role'], "import_patients",
+            f"Imported {len(inserts)} patients (IDs {first}-{last}) from {source}, "
+            f"{len(chunk) - len(inserts)} rejected"
+        )
+
+    def _update_rate(self, report, start):
+        report['elapsed'] = time.perf_counter() - start
+        report['rows_per_sec'] = report['read'] / report['elapsed'] if report['elapsed'] else 0.0
+
+    def import_file(self, f, fmt, user, source="upload", reject_file=None, progress=None):
+        """Import from a text file object in 'csv' or 'json' format"""
+        reader = iter_csv_records if fmt == 'csv' else iter_json_records
+        return self.run(reader(f), user, source, reject_file, progress)
+
+
+if __name__ == "__main__":
+    from database import DatabaseManager
+    from encryption import DataProtection
+
+    parser = argparse.ArgumentParser(description="Bulk import patients from CSV or JSON")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "json"], help="defaults to the file extension")
+    parser.add_argument("--db", default="hospital.db")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--rejects", help="reject file (default: <path>.rejects.csv)")
+    parser.add_argument("--user-id", type=int, default=1, help="user the audit entries are recorded for")
+    parser.add_argument("--role", default="admin")
+    args = parser.parse_args()
+
+    fmt = args.format or ('json' if args.path.lower().endswith(('.json', '.jsonl')) else 'csv')
+    reject_path = args.rejects or f"{args.path}.rejects.csv"
+    db = DatabaseManager(db_name=args.db)
+    importer = PatientImporter(db, DataProtection(), chunk_size=args.chunk_size)
+
+    def print_progress(report):
+        print(f"read={report['read']} imported={report['imported']} rejected={report['rejected']} "
+              f"({report['rows_per_sec']:.0f} rows/s)")
+
+    with open(args.path, newline='', encoding='utf-8-sig') as f, \
+            open(reject_path, 'w', newline='', encoding='utf-8') as rejects:
+        try:
+            report = importer.import_file(f, fmt, {'user_id': args.user_id, 'role': args.role},
+                                          source=os.path.basename(args.path),
+                                          reject_file=rejects, progress=print_progress)
+        except ImportFileError as e:
+            db.flush_logs()
+            raise SystemExit(f"{args.path}: {e} ({e.report['imported']} records imported before it)")
+    db.flush_logs()
+    if not report['rejected']:
+        os.remove(reject_path)
+    print(report)
\ No newline at end of file
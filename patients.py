@@ -0,0 +1,177 @@
+# Columns safe to show to non-admin roles
+ANONYMIZED_COLUMNS = ['patient_id', 'anonymized_name', 'anonymized_contact', 'diagnosis', 'date_added']
+ALL_COLUMNS = ['patient_id', 'name', 'contact', 'diagnosis', 'anonymized_name',
+               'anonymized_contact', 'encrypted_name', 'encrypted_contact', 'date_added']
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def looks_like_contact(term):
+    """Phone-number-like search terms: digits and phone punctuation, at least seven digits"""
+    digits = sum(c.isdigit() for c in term)
+    return digits >= 7 and all(c.isdigit() or c in " +-()." for c in term)
+
+
+def add_patient(db_manager, data_protection, name, contact, diagnosis):
+    """Insert a patient with its anonymized columns and blind indexes; returns the patient_id"""
+    with db_manager.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO patients (name, contact, diagnosis, name_bidx, contact_bidx) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (name, contact, diagnosis,
+             data_protection.blind_index(name, 'name'), data_protection.blind_index(contact, 'contact'))
+        )
+        patient_id = cursor.lastrowid
+        # The anonymized name is derived from the new patient_id
+        cursor.execute(
+            "UPDATE patients SET anonymized_name = ?, anonymized_contact = ? WHERE patient_id = ?",
+            (data_protection.anonymize_name(name, patient_id), data_protection.anonymize_contact(contact),
+             patient_id)
+        )
+    db_manager.notify_write('patients')
+    return patient_id
+
+
+def update_diagnosis(db_manager, patient_id, diagnosis):
+    with db_manager.connection() as conn:
+        conn.execute("UPDATE patients SET diagnosis = ? WHERE patient_id = ?", (diagnosis, patient_id))
+    db_manager.notify_write('patients')
+
+
+class PatientQueryService:
+    """Server-side filtered, keyset-paginated access to the patients table.
+
+    Supported filters (all optional): patient_id, date_from, date_to
+    (date_added range, date_to exclusive), diagnosis (substring), and
+    name and contact (exact, normalized). The exact filters go through the
+    blind index columns and need a DataProtection instance. With
+    read_replica=True queries go through read_connection(), for pages that
+    only display what they read.
+    """
+    # Filtered counts stop at this many rows and are reported as estimates
+    count_limit = 10000
+
+    def __init__(self, db_manager, data_protection=None, read_replica=False):
+        self.db = db_manager
+        self.protection = data_protection
+        self.read_replica = read_replica
+
+    def _read(self):
+        return self.db.read_connection('patients') if self.read_replica else self.db.connection()
+
+    def _where(self, filters):
+        clauses = []
+        params = []
+        filters = filters or {}
+        if filters.get('patient_id') is not None:
+            clauses.append("patient_id = ?")
+            params.append(int(filters['patient_id']))
+        if filters.get('date_from'):
+            clauses.append("date_added >= ?")
+            params.append(str(filters['date_from']))
+        if filters.get('date_to'):
+            clauses.append("date_added < ?")
+            params.append(str(filters['date_to']))
+        if filters.get('diagnosis'):
+            clauses.append("diagnosis LIKE ? ESCAPE '\\'")
+            params.append(f"%{escape_like(filters['diagnosis'])}%")
+        for field in ('name', 'contact'):
+            if filters.get(field):
+                if self.protection is None:
+                    raise ValueError(f"Exact {field} lookups need a DataProtection instance")
+                # Indexed point lookup on the keyed hash; no decryption involved
+                clauses.append(f"{field}_bidx = ?")
+                params.append(self.protection.blind_index(filters[field], field))
+        return clauses, params
+
+    def page(self, filters=None, after_id=None, limit=50, columns=None):
+        """One page ordered by patient_id.
+
+        Returns (DataFrame, next_after_id); next_after_id is None on the
+        last page.
+        """
+        columns = columns or ANONYMIZED_COLUMNS
+        clauses, params = self._where(filters)
+        if after_id is not None:
+            clauses.append("patient_id > ?")
+            params.append(after_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        # Imported on first use so the login page never loads pandas
+        import pandas as pd
+        # Fetch one extra row to learn whether another page exists
+        with self._read() as conn:
+            df = pd.read_sql(
+                f"SELECT {', '.join(columns)} FROM patients {where} ORDER BY patient_id LIMIT ?",
+                conn,
+                params=params + [limit + 1]
+            )
+        if len(df) > limit:
+            df = df.iloc[:limit]
+            return df, int(df['patient_id'].iloc[-1])
+        return df, None
+
+    def estimate_count(self, filters=None):
+        """Return (count, exact).
+
+        Unfiltered counts are estimated from the primary key range;
+        filtered counts are exact up to count_limit.
+        """
+        clauses, params = self._where(filters)
+        with self._read() as conn:
+            if not clauses:
+                row = conn.execute("SELECT MAX(patient_id) FROM patients").fetchone()
+                return row[0] or 0, False
+            row = conn.execute(
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM patients WHERE {' AND '.join(clauses)} LIMIT ?)",
+                params + [self.count_limit + 1]
+            ).fetchone()
+        count = row[0]
+        if count > self.count_limit:
+            return self.count_limit, False
+        return count, True
+
+    def find(self, name=None, contact=None, columns=None, limit=50):
+        """Patients whose name and/or contact match exactly after normalization"""
+        df, _ = self.page({'name': name, 'contact': contact}, limit=limit, columns=columns)
+        return df
+
+    def search(self, term, limit=20):
+        """Patient picker lookup: exact patient_id, exact contact or case-insensitive name prefix.
+
+        Returns a list of (patient_id, name).
+        """
+        term = (term or "").strip()
+        if not term:
+            return []
+        results = []
+        with self._read() as conn:
+            if term.isdigit():
+                results += conn.execute(
+                    "SELECT patient_id, name FROM patients WHERE patient_id = ?", (int(term),)
+                ).fetchall()
+            if self.protection is not None and looks_like_contact(term):
+                results += conn.execute(
+                    "SELECT patient_id, name FROM patients WHERE contact_bidx = ? LIMIT ?",
+                    (self.protection.blind_index(term, 'contact'), limit)
+                ).fetchall()
+            # Uses idx_patients_name (COLLATE NOCASE) as a prefix range scan
+            results += conn.execute(
+                "SELECT patient_id, name FROM patients WHERE name LIKE ? ESCAPE '\\' "
+                "ORDER BY name LIMIT ?",
+                (f"{escape_like(term)}%", limit)
+            ).fetchall()
+        return results[:limit]
+
+    def get(self, patient_id, columns=None):
+        """Single patient as a dict, or None"""
+        columns = columns or ALL_COLUMNS
+        with self._read() as conn:
+            cursor = conn.execute(
+                f"SELECT {', '.join(columns)} FROM patients WHERE patient_id = ?", (patient_id,)
+            )
+            row = cursor.fetchone()
+        return dict(zip(columns, row)) if row else None
\ No newline at end of file
@@ -0,0 +1,217 @@
+import argparse
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from database import to_db_timestamp, utc_now
+from log_partitions import LogStore
+
+
+class RetentionPolicy:
+    """How long rows of one table are kept; retention_days=None disables it.
+
+    Expired rows are only copied to the archive when archive=True.
+    """
+    def __init__(self, table, retention_days, timestamp_column, key_column, archive=False):
+        self.table = table
+        self.retention_days = retention_days
+        self.timestamp_column = timestamp_column
+        self.key_column = key_column
+        self.archive = archive
+
+    @property
+    def enabled(self):
+        return self.retention_days is not None
+
+    def cutoff(self):
+        return to_db_timestamp(utc_now() - timedelta(days=self.retention_days))
+
+
+def default_policies(logs_days=30, patients_days=None):
+    # Expired patient records are not archived by default: keeping a copy
+    # of the personal data would defeat the point of the retention limit
+    return [
+        RetentionPolicy('logs', logs_days, 'timestamp', 'log_id', archive=True),
+        RetentionPolicy('patients', patients_days, 'date_added', 'patient_id', archive=False),
+    ]
+
+
+class SegmentWriter:
+    """Appends rows as JSON lines to gzip-compressed archive segment files"""
+    def __init__(self, archive_dir, table, rows_per_segment=100000):
+        self.directory = os.path.join(archive_dir, table)
+        self.table = table
+        self.rows_per_segment = rows_per_segment
+        self.run_id = utc_now().strftime('%Y%m%dT%H%M%SZ')
+        self.paths = []
+        self._file = None
+        self._rows = 0
+
+    def write(self, columns, rows):
+        for row in rows:
+            if self._file is None or self._rows >= self.rows_per_segment:
+                self._open_next()
+            self._file.write(json.dumps(dict(zip(columns, row)), default=str) + "\n")
+            self._rows += 1
+        # Rows must be on disk before the caller deletes them
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _open_next(self):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self.table}_{self.run_id}_{len(self.paths):05d}.jsonl.gz")
+        self._raw = open(path, 'ab')
+        self._file = gzip.open(self._raw, 'wt', encoding='utf-8')
+        self.paths.append(path)
+        self._rows = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = None
+
+
+class RetentionEngine:
+    """Deletes expired rows in small primary-key-range batches.
+
+    Each batch is its own short transaction, so concurrent writers (such as
+    the audit log writer) only ever wait for one batch. `pause` seconds of
+    sleep between batches throttles the job further. Compacted log months
+    are dropped a whole partition at a time; with compact_logs=True the
+    closed months left in the logs table are compacted afterwards.
+    """
+    def __init__(self, db_manager, archive_dir='archive', batch_size=1000, pause=0.0,
+                 compact_logs=False):
+        self.db = db_manager
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.pause = pause
+        self.compact_logs = compact_logs
+        self.reports = []
+        self._thread = None
+
+    def enforce(self, policy, progress=None):
+        """Apply one policy; returns a report dict"""
+        started = time.perf_counter()
+        report = {
+            'table': policy.table,
+            'retention_days': policy.retention_days,
+            'deleted': 0,
+            'archived': 0,
+            'batches': 0,
+            'partitions_dropped': 0,
+            'segments': [],
+            'elapsed': 0.0
+        }
+        if not policy.enabled:
+            return report
+
+        cutoff = policy.cutoff()
+        archive = SegmentWriter(self.archive_dir, policy.table) if policy.archive else None
+        key, ts = policy.key_column, policy.timestamp_column
+        store = LogStore(self.db) if policy.table == 'logs' else None
+        try:
+            if store is not None:
+                removed, dropped = store.drop_expired(
+                    cutoff, archive=archive, archive_dir=self.archive_dir if archive else None
+                )
+                report['deleted'] += removed
+                report['partitions_dropped'] = dropped
+                if archive is not None:
+                    report['archived'] += removed
+
+            while True:
+                with self.db.connection() as conn:
+                    cursor = conn.execute(
+                        f"SELECT * FROM {policy.table} WHERE {ts} < ? ORDER BY {key} LIMIT ?",
+                        (cutoff, self.batch_size)
+                    )
+                    columns = [d[0] for d in cursor.description]
+                    rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                key_index = columns.index(key)
+                low, high = rows[0][key_index], rows[-1][key_index]
+                if archive is not None:
+                    archive.write(columns, rows)
+                    report['archived'] += len(rows)
+
+                # The batch is the first N expired keys, so this key range
+                # holds no other expired rows
+                with self.db.connection() as conn:
+                    cursor = conn.execute(
+                        f"DELETE FROM {policy.table} WHERE {key} BETWEEN ? AND ? AND {ts} < ?",
+                        (low, high, cutoff)
+                    )
+                    report['deleted'] += cursor.rowcount
+                    if policy.table == 'logs':
+                        self.db.logs_deleted(conn, columns, rows)
+                self.db.notify_write(policy.table)
+                report['batches'] += 1
+                report['elapsed'] = time.perf_counter() - started
+                if progress:
+                    progress(report)
+                if self.pause:
+                    time.sleep(self.pause)
+        finally:
+            if archive is not None:
+                archive.close()
+                report['segments'] = archive.paths
+
+        if store is not None and self.compact_logs:
+            report['compacted'] = store.compact()['months']
+        report['elapsed'] = time.perf_counter() - started
+        return report
+
+    def run(self, policies, progress=None):
+        self.reports = [self.enforce(policy, progress) for policy in policies if policy.enabled]
+        return self.reports
+
+    def start_background(self, policies):
+        """Run the policies on a daemon thread; poll `running` and `reports`"""
+        if self.running:
+            return self._thread
+        self.reports = []
+
+        def work():
+            for policy in policies:
+                if policy.enabled:
+                    self.reports.append(self.enforce(policy))
+
+        self._thread = threading.Thread(target=work, name="retention-job", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+
+if __name__ == "__main__":
+    from database import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Enforce data retention outside the web app")
+    parser.add_argument("--db", default="hospital.db")
+    parser.add_argument("--logs-days", type=int, default=30)
+    parser.add_argument("--patients-days", type=int, help="enable patient record retention")
+    parser.add_argument("--archive-dir", default="archive")
+    parser.add_argument("--no-archive", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument("--compact", action="store_true", help="compact closed log months afterwards")
+    args = parser.parse_args()
+
+    policies = default_policies(args.logs_days, args.patients_days)
+    if args.no_archive:
+        for policy in policies:
+            policy.archive = False
+
+    engine = RetentionEngine(DatabaseManager(db_name=args.db), args.archive_dir, args.batch_size, args.pause,
+                             compact_logs=args.compact)
+    for report in engine.run(policies):
+        print(report)
\ No newline at end of file
@@ -0,0 +1,107 @@
+import argparse
+from collections import Counter
+
+
+class ActivityRollups:
+    """Per-day activity counts maintained alongside the logs table.
+
+    activity_daily_rollup holds counts per (day, action, role) and
+    activity_hourly_rollup per (day, hour). Both are updated in the same
+    transaction that inserts or deletes the log rows, so charts can read
+    a few hundred rollup rows instead of scanning the log.
+    """
+    def __init__(self, db_manager):
+        self.db = db_manager
+
+    @staticmethod
+    def buckets(rows):
+        """Count (role, action, timestamp) rows into daily and hourly buckets"""
+        daily = Counter()
+        hourly = Counter()
+        for role, action, timestamp in rows:
+            timestamp = str(timestamp)
+            day = timestamp[:10]
+            daily[(day, action or '', role or '')] += 1
+            hourly[(day, int(timestamp[11:13] or 0))] += 1
+        return daily, hourly
+
+    def apply(self, conn, rows, sign=1):
+        """Add (sign=1) or remove (sign=-1) (role, action, timestamp) rows"""
+        daily, hourly = self.buckets(rows)
+        conn.executemany(
+            """
+            INSERT INTO activity_daily_rollup (day, action, role, count) VALUES (?, ?, ?, ?)
+            ON CONFLICT(day, action, role) DO UPDATE SET count = count + excluded.count
+            """,
+            [(day, action, role, sign * n) for (day, action, role), n in daily.items()]
+        )
+        conn.executemany(
+            """
+            INSERT INTO activity_hourly_rollup (day, hour, count) VALUES (?, ?, ?)
+            ON CONFLICT(day, hour) DO UPDATE SET count = count + excluded.count
+            """,
+            [(day, hour, sign * n) for (day, hour), n in hourly.items()]
+        )
+        if sign < 0:
+            conn.executemany(
+                "DELETE FROM activity_daily_rollup WHERE day = ? AND action = ? AND role = ? AND count <= 0",
+                list(daily)
+            )
+            conn.executemany(
+                "DELETE FROM activity_hourly_rollup WHERE day = ? AND hour = ? AND count <= 0",
+                list(hourly)
+            )
+
+    def rebuild(self, conn=None):
+        """Recompute both rollup tables from the logs table"""
+        if conn is None:
+            with self.db.connection() as conn:
+                rebuild_rollups(conn.cursor(), self.db)
+            self.db.notify_write('logs')
+        else:
+            rebuild_rollups(conn.cursor(), self.db)
+
+
+def rebuild_rollups(cursor, db):
+    cursor.execute("DELETE FROM activity_daily_rollup")
+    cursor.execute("DELETE FROM activity_hourly_rollup")
+    cursor.execute('''
+        INSERT INTO activity_daily_rollup (day, action, role, count)
+        SELECT substr(timestamp, 1, 10), COALESCE(action, ''), COALESCE(role, ''), COUNT(*)
+        FROM logs
+        GROUP BY 1, 2, 3
+    ''')
+    cursor.execute('''
+        INSERT INTO activity_hourly_rollup (day, hour, count)
+        SELECT substr(timestamp, 1, 10), CAST(substr(timestamp, 12, 2) AS INTEGER), COUNT(*)
+        FROM logs
+        GROUP BY 1, 2
+    ''')
+    # Compacted months are no longer in the logs table but still count
+    partitioned = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'log_partitions'"
+    ).fetchone()
+    if partitioned:
+        from log_partitions import LogStore
+        store = LogStore(db)
+        rollups = ActivityRollups(db)
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(logs)").fetchall()]
+        role, action, timestamp = (columns.index(c) for c in ('role', 'action', 'timestamp'))
+        partitions = cursor.execute("SELECT * FROM log_partitions ORDER BY month").fetchall()
+        names = [d[0] for d in cursor.description]
+        for partition in partitions:
+            partition = dict(zip(names, partition))
+            for rows in store.segment_chunks(partition, columns):
+                rollups.apply(cursor.connection, [(r[role], r[action], r[timestamp]) for r in rows])
+
+
+if __name__ == "__main__":
+    from database import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Maintain activity rollup tables")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--db", default="hospital.db")
+    args = parser.parse_args()
+
+    ActivityRollups(DatabaseManager(db_name=args.db, async_logging=False)).rebuild()
+    print("Rollups rebuilt")
\ No newline at end of file
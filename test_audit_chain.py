@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from audit_chain import AuditChain
+from database import DatabaseManager
+
+
+class VerifyDuringWritesTest(unittest.TestCase):
+    """verify() must not report entries written while it runs as tampering"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        # The chain key and log segments live relative to the working directory
+        os.chdir(self.dir)
+        self.db = DatabaseManager(db_name=os.path.join(self.dir, 'test.db'), async_logging=False)
+        for i in range(50):
+            self.db.log_activity(1, 'admin', 'Test', f"entry {i}")
+        self.chain = AuditChain(self.db)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_write_during_verify(self):
+        def write(report):
+            # Another session writing while verification is under way
+            writer = threading.Thread(target=self.db.log_activity,
+                                      args=(1, 'admin', 'Test', f"written after {report['to_log_id']}"))
+            writer.start()
+            writer.join()
+
+        report = self.chain.verify(progress=write, chunk_size=10)
+        self.assertTrue(report['ok'], report['problems'])
+        self.assertEqual(report['to_log_id'], report['head_log_id'])
+
+        # The entries written meanwhile are covered by the next run
+        report = self.chain.verify()
+        self.assertTrue(report['ok'], report['problems'])
+        self.assertEqual(report['rows'], 5)
+
+    def test_truncated_tail(self):
+        self.assertTrue(self.chain.verify()['ok'])
+        with self.db.connection() as conn:
+            head = conn.execute("SELECT log_id, row_hash, checkpoint_id, signature FROM audit_chain_head").fetchone()
+        for i in range(10):
+            self.db.log_activity(1, 'admin', 'Test', f"later {i}")
+        self.assertTrue(self.chain.verify()['ok'])
+
+        # Drop the newest entries and put back the earlier signed head
+        with self.db.connection() as conn:
+            conn.execute("DELETE FROM logs WHERE log_id > ?", (head[0],))
+            conn.execute("UPDATE audit_chain_head SET log_id = ?, row_hash = ?, checkpoint_id = ?, signature = ?",
+                         head)
+        report = self.chain.verify()
+        self.assertFalse(report['ok'])
+
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
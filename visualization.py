@@ -1,77 +1,93 @@
-import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
-
-class ActivityVisualization:
-    def __init__(self, db_manager):
-        self.db = db_manager
-    
-    def get_activity_data(self):
-        conn = self.db.get_connection()
-        logs_df = pd.read_sql("SELECT * FROM logs ORDER BY timestamp DESC", conn)
-        conn.close()
-        return logs_df
-    
-    def plot_daily_activity(self):
-        logs_df = self.get_activity_data()
-        
-        if logs_df.empty:
-            st.warning("No activity data available")
-            return
-        
-        # Convert timestamp to datetime
-        logs_df['timestamp'] = pd.to_datetime(logs_df['timestamp'])
-        logs_df['date'] = logs_df['timestamp'].dt.date
-        
-        # Group by date and action
-        daily_activity = logs_df.groupby(['date', 'action']).size().reset_index(name='count')
-        
-        # Create stacked bar chart
-        fig = px.bar(daily_activity, 
-                    x='date', 
-                    y='count', 
-                    color='action',
-                    title='Daily User Activities',
-                    labels={'count': 'Number of Actions', 'date': 'Date'})
-        
-        st.plotly_chart(fig, use_container_width=True)
-    
-    def plot_role_activity(self):
-        logs_df = self.get_activity_data()
-        
-        if logs_df.empty:
-            return
-        
-        # Group by role and action
-        role_activity = logs_df.groupby(['role', 'action']).size().reset_index(name='count')
-        
-        # Create pie chart for role distribution
-        role_dist = logs_df['role'].value_counts()
-        fig = px.pie(role_dist, 
-                    values=role_dist.values, 
-                    names=role_dist.index,
-                    title='Activity Distribution by Role')
-        
-        st.plotly_chart(fig, use_container_width=True)
-    
-    def plot_action_timeline(self):
-        logs_df = self.get_activity_data()
-        
-        if logs_df.empty:
-            return
-        
-        # Create timeline of actions
-        logs_df['timestamp'] = pd.to_datetime(logs_df['timestamp'])
-        logs_df['hour'] = logs_df['timestamp'].dt.hour
-        
-        hourly_activity = logs_df.groupby('hour').size().reset_index(name='count')
-        
-        fig = px.line(hourly_activity, 
-                     x='hour', 
-                     y='count',
-                     title='Activity Timeline (by Hour)',
-                     markers=True)
-        
+import streamlit as st
+import plotly.express as px
+from analytics import ActivityAggregator, LiveActivity
+from instrumentation import instrumentation
+
+class ActivityVisualization:
+    def __init__(self, db_manager, window_days=30, queries=None):
+        self.db = db_manager
+        self.window_days = window_days
+        # Anything with the ActivityAggregator chart methods, e.g. a LiveActivity.
+        # Under load other sessions write to the logs table all the time, so
+        # the charts accept results a couple of seconds stale rather than
+        # requerying after every write
+        self.queries = queries or ActivityAggregator(db_manager, window_days, grace=2.0)
+
+    def get_activity_data(self, limit=1000):
+        return self.queries.recent_activity(limit)
+
+    def show_live(self, interval=5, recent_limit=100, key='live_activity'):
+        """Charts and recent entries that update every `interval` seconds.
+
+        The session's LiveActivity lives in session_state, so each refresh
+        only fetches the entries written since the previous one.
+        """
+        live = st.session_state.get(key)
+        if live is None or live.window_days != self.window_days:
+            live = st.session_state[key] = LiveActivity(self.db, self.window_days, recent_limit=recent_limit)
+        view = ActivityVisualization(self.db, self.window_days, queries=live)
+
+        @st.fragment(run_every=interval)
+        def render():
+            live.poll()
+            col1, col2 = st.columns(2)
+            with col1:
+                view.plot_daily_activity()
+            with col2:
+                view.plot_role_activity()
+            view.plot_action_timeline()
+
+            st.caption(f"Live: {live.last_poll_rows} new entries in the last update "
+                       f"(every {interval}s), up to log ID {live.watermark}")
+            st.dataframe(live.recent_activity(recent_limit), hide_index=True)
+
+        render()
+
+    @instrumentation.timed('plot.daily_activity')
+    def plot_daily_activity(self):
+        daily_activity = self.queries.daily_action_counts()
+
+        if daily_activity.empty:
+            st.warning("No activity data available")
+            return
+
+        # Create stacked bar chart
+        fig = px.bar(daily_activity,
+                    x='date',
+                    y='count',
+                    color='action',
+                    title='Daily User Activities',
+                    labels={'count': 'Number of Actions', 'date': 'Date'})
+
+        st.plotly_chart(fig, use_container_width=True)
+
+    @instrumentation.timed('plot.role_activity')
+    def plot_role_activity(self):
+        role_dist = self.queries.role_counts()
+
+        if role_dist.empty:
+            return
+
+        # Create pie chart for role distribution
+        fig = px.pie(role_dist,
+                    values='count',
+                    names='role',
+                    title='Activity Distribution by Role')
+
+        st.plotly_chart(fig, use_container_width=True)
+
+    @instrumentation.timed('plot.action_timeline')
+    def plot_action_timeline(self):
+        hourly_activity = self.queries.hourly_counts()
+
+        if hourly_activity.empty:
+            return
+
+        # Create timeline of actions
+        fig = px.line(hourly_activity,
+                     x='hour',
+                     y='count',
+                     title='Activity Timeline (by Hour)',
+                     markers=True)
+
         st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file